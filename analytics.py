@@ -0,0 +1,271 @@
+import os, random, logging, threading
+from collections import OrderedDict
+import numpy as np
+import utils
+from graph_store import CompactGraph
+
+# Sources sampled for betweenness on graphs larger than this, exact below it
+BETWEENNESS_SAMPLES = int(os.getenv('ANALYTICS_BETWEENNESS_SAMPLES', '256'))
+# Upper bound on (source, node) pairs tracked at once by betweenness, which sets its batch size
+BETWEENNESS_BATCH_ENTRIES = 2 ** 19
+PAGERANK_ALPHA = 0.85
+PAGERANK_MAX_ITER = 100
+PAGERANK_TOL = 1.0e-6
+# Entries in each top-N table
+TOP_N = int(os.getenv('ANALYTICS_TOP_N', '10'))
+# Analytics kept for graphs seen recently, keyed on their nodes and edges
+ANALYTICS_CACHE_SIZE = int(os.getenv('ANALYTICS_CACHE_SIZE', '32'))
+
+_analytics_cache = OrderedDict()
+_analytics_cache_lock = threading.Lock()
+
+
+def graph_arrays(graph):
+    """
+    Returns a graph as node names plus NumPy arrays of edge sources and targets.
+
+    Args:
+        graph (networkx.DiGraph or CompactGraph): The ownership graph.
+
+    Returns:
+        tuple: (list of node names indexed by ID, source ID array, target ID array).
+    """
+    if isinstance(graph, CompactGraph):
+        edges = graph.edge_array()
+        return graph.node_names(), edges[:, 0].astype(np.int64), edges[:, 1].astype(np.int64)
+
+    names = list(graph.nodes)
+    ids = {name: node_id for node_id, name in enumerate(names)}
+    edges = np.array([(ids[source], ids[target]) for source, target in graph.edges()], dtype=np.int64).reshape(-1, 2)
+    return names, edges[:, 0], edges[:, 1]
+
+
+def pagerank(n, sources, targets, alpha=PAGERANK_ALPHA, max_iter=PAGERANK_MAX_ITER, tol=PAGERANK_TOL):
+    """
+    PageRank by power iteration over edge arrays, with the same defaults as networkx.pagerank.
+    Rank from dangling nodes is spread evenly over all nodes.
+
+    Returns:
+        numpy.ndarray: The rank of each node, summing to 1.
+    """
+    if n == 0:
+        return np.zeros(0)
+    out_degree = np.bincount(sources, minlength=n).astype(float)
+    dangling = out_degree == 0
+    weights = np.divide(1.0, out_degree, out=np.zeros(n), where=~dangling)
+    rank = np.full(n, 1.0 / n)
+
+    for _ in range(max_iter):
+        previous = rank
+        rank = alpha * (np.bincount(targets, weights=previous[sources] * weights[sources], minlength=n)
+                        + previous[dangling].sum() / n) + (1 - alpha) / n
+        if np.abs(rank - previous).sum() < n * tol:
+            return rank
+    logging.warning(f"PageRank didn't converge in {max_iter} iterations")
+    return rank
+
+
+def csr_arrays(n, sources, targets):
+    """
+    Returns the successor lists of a graph in compressed sparse row form.
+
+    Returns:
+        tuple: (indptr, indices), node i's successors are indices[indptr[i]:indptr[i + 1]].
+    """
+    order = np.argsort(sources, kind='stable')
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=n), out=indptr[1:])
+    return indptr, targets[order].astype(np.int64)
+
+
+def betweenness(n, sources, targets, samples=BETWEENNESS_SAMPLES, seed=0):
+    """
+    Directed betweenness centrality (Brandes), normalised like networkx.betweenness_centrality.
+    Graphs with more nodes than `samples` use that many random source nodes, scaled up.
+
+    The breadth-first searches run level by level on the CSR arrays, a batch of sources at a time:
+    each frontier is an array of (source, node) keys expanded with NumPy, so the work per level is
+    proportional to the edges leaving the frontier. Path counts and dependencies are then
+    accumulated back over the edges recorded at each level.
+
+    Returns:
+        numpy.ndarray: The betweenness of each node.
+    """
+    centrality = np.zeros(n)
+    if n < 3:
+        return centrality
+
+    indptr, indices = csr_arrays(n, sources, targets)
+    out_degree = np.diff(indptr)
+    starts = np.arange(n) if n <= samples else np.array(random.Random(seed).sample(range(n), samples))
+    # Sources searched together, bounding the (batch, node) arrays to BETWEENNESS_BATCH_ENTRIES entries
+    batch_size = max(1, min(len(starts), BETWEENNESS_BATCH_ENTRIES // n))
+
+    for batch in np.array_split(starts, -(-len(starts) // batch_size)):
+        # State per (source, node) pair, flattened to key = row * n + node
+        distance = np.full(len(batch) * n, -1, dtype=np.int32)
+        paths = np.zeros(len(batch) * n)
+        frontier = np.arange(len(batch), dtype=np.int64) * n + batch
+        distance[frontier] = 0
+        paths[frontier] = 1
+        levels = []
+
+        level = 0
+        while len(frontier):
+            nodes = frontier % n
+            degrees = out_degree[nodes]
+            total = int(degrees.sum())
+            if total == 0:
+                break
+            # Every edge leaving the frontier, as (from key, to key)
+            offsets = np.arange(total) - np.repeat(np.cumsum(degrees) - degrees, degrees)
+            successors = indices[np.repeat(indptr[nodes], degrees) + offsets]
+            from_keys = np.repeat(frontier, degrees)
+            to_keys = from_keys - np.repeat(nodes, degrees) + successors
+
+            level += 1
+            discovered = to_keys[distance[to_keys] < 0]
+            distance[discovered] = level
+            # Edges on a shortest path carry the path counts one level down
+            on_path = distance[to_keys] == level
+            from_keys, to_keys = from_keys[on_path], to_keys[on_path]
+            np.add.at(paths, to_keys, paths[from_keys])
+            levels.append((from_keys, to_keys))
+            frontier = np.unique(discovered)
+
+        # Accumulate dependencies back from the furthest level
+        dependency = np.zeros(len(batch) * n)
+        for from_keys, to_keys in reversed(levels):
+            np.add.at(dependency, from_keys, paths[from_keys] / paths[to_keys] * (1 + dependency[to_keys]))
+        dependency[np.arange(len(batch), dtype=np.int64) * n + batch] = 0
+        centrality += dependency.reshape(len(batch), n).sum(axis=0)
+
+    scale = 1.0 / ((n - 1) * (n - 2))
+    if n > samples:
+        scale *= n / samples
+    return centrality * scale
+
+
+def weak_components(n, sources, targets):
+    """
+    Labels the weakly connected components by propagating the smallest node ID across edges.
+
+    Returns:
+        numpy.ndarray: A component label for each node.
+    """
+    labels = np.arange(n)
+    while True:
+        previous = labels.copy()
+        np.minimum.at(labels, sources, labels[targets])
+        np.minimum.at(labels, targets, labels[sources])
+        # Pointer jumping, so long chains settle in a few rounds
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            return labels
+
+
+def control_depths(n, sources, targets):
+    """
+    The number of ownership layers between each node and the companies at the bottom of the graph
+    (those that control nothing), found breadth first from the bottom.
+
+    Returns:
+        numpy.ndarray: The depth of each node, -1 for nodes only reachable through cycles.
+    """
+    depth = np.full(n, -1)
+    frontier = np.bincount(sources, minlength=n) == 0
+    depth[frontier] = 0
+    level = 0
+    while frontier.any():
+        level += 1
+        # Controllers of the current layer that haven't been given a depth yet
+        controllers = np.zeros(n, dtype=bool)
+        controllers[sources[frontier[targets]]] = True
+        frontier = controllers & (depth < 0)
+        depth[frontier] = level
+    return depth
+
+
+def _fingerprint(names, sources, targets):
+    return hash((tuple(names), sources.tobytes(), targets.tobytes()))
+
+
+def compute_network_analytics(graph, top_n=TOP_N):
+    """
+    Computes the analytics panel's metrics for an ownership graph in one pass over its edge arrays.
+
+    Args:
+        graph (networkx.DiGraph or CompactGraph): The ownership graph, with edges from controller to controlled.
+        top_n (int, optional): Entries in each ranking.
+
+    Returns:
+        dict: 'summary' of graph-wide figures, and 'top' rankings of (node, value) pairs by degree,
+            PageRank, betweenness, control depth and interlocks (companies controlled).
+    """
+    return _analytics_from_arrays(graph, *graph_arrays(graph), top_n)
+
+
+def _analytics_from_arrays(graph, names, sources, targets, top_n):
+    n = len(names)
+    in_degree = np.bincount(targets, minlength=n)
+    out_degree = np.bincount(sources, minlength=n)
+    degree = in_degree + out_degree
+    ranks = pagerank(n, sources, targets)
+    centrality = betweenness(n, sources, targets)
+    components = weak_components(n, sources, targets)
+    depths = control_depths(n, sources, targets)
+    component_sizes = np.bincount(components, minlength=n) if n else np.zeros(0, dtype=int)
+    # A controller of several companies in the graph interlocks them
+    interlocking = out_degree > 1
+
+    def top(values, minimum=None):
+        order = np.argsort(-values, kind='stable')[:top_n]
+        return [(names[node], values[node].item()) for node in order if minimum is None or values[node] > minimum]
+
+    return {
+        'summary': {
+            'total_nodes': n,
+            'total_edges': int(len(sources)),
+            'total_companies': utils.calculate_network_metrics(graph)['total_companies'],
+            'components': int(np.count_nonzero(component_sizes)),
+            'largest_component': int(component_sizes.max()) if n else 0,
+            'max_control_depth': int(depths.max()) if n else 0,
+            'interlocking_controllers': int(np.count_nonzero(interlocking)),
+            'interlocks': int((out_degree[interlocking] - 1).sum()),
+        },
+        'top': {
+            'degree': top(degree),
+            'pagerank': top(ranks),
+            'betweenness': top(centrality, minimum=0),
+            'control_depth': top(depths, minimum=0),
+            'interlocks': top(out_degree, minimum=1),
+        },
+    }
+
+
+def get_network_analytics(graph, top_n=TOP_N):
+    """
+    Returns the analytics for a graph, computing them only the first time. They are stored on the
+    graph (graph.graph['analytics']) and in a small cache keyed on the nodes and edges, so an
+    identical graph rebuilt later is not recomputed either.
+    """
+    cached = graph.graph.get('analytics')
+    if cached is not None:
+        return cached
+
+    arrays = graph_arrays(graph)
+    key = (_fingerprint(*arrays), top_n)
+    with _analytics_cache_lock:
+        analytics = _analytics_cache.get(key)
+        if analytics is not None:
+            _analytics_cache.move_to_end(key)
+
+    if analytics is None:
+        analytics = _analytics_from_arrays(graph, *arrays, top_n)
+        with _analytics_cache_lock:
+            _analytics_cache[key] = analytics
+            while len(_analytics_cache) > ANALYTICS_CACHE_SIZE:
+                _analytics_cache.popitem(last=False)
+
+    graph.graph['analytics'] = analytics
+    return analytics
@@ -0,0 +1,111 @@
+import os, csv, json, logging, argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import networkx as nx
+from networkx.readwrite import json_graph
+import scraper, utils
+
+# Trees built at once. Each tree also expands its frontier on TREE_MAX_WORKERS threads,
+# and every call shares scraper.rate_limiter, so this only bounds how much work is in flight.
+BATCH_MAX_WORKERS = int(os.getenv('BATCH_MAX_WORKERS', '4'))
+
+
+def build_trees(company_numbers, max_workers=BATCH_MAX_WORKERS, entity_cache=None):
+    """
+    Builds company trees for many companies at once, sharing one entity cache so holding companies
+    that several trees converge on are only fetched once.
+
+    Args:
+        company_numbers (list): The company numbers of the root companies.
+        max_workers (int, optional): The number of trees built concurrently.
+        entity_cache (scraper.EntityCache, optional): The shared cache, a new one is created if not given.
+
+    Returns:
+        dict: Company number to the tree's entity list, in the order of company_numbers.
+            Companies whose tree failed are left out.
+    """
+    entity_cache = entity_cache if entity_cache is not None else scraper.EntityCache()
+    # Duplicate numbers would only build the same tree twice
+    company_numbers = list(dict.fromkeys(number.strip() for number in company_numbers if number and number.strip()))
+    trees = {}
+
+    def build(company_number):
+        return scraper.get_company_tree(company_number, concurrent=True, company_number=company_number, entity_cache=entity_cache)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(build, number): number for number in company_numbers}
+        for done, future in enumerate(as_completed(futures), start=1):
+            company_number = futures[future]
+            try:
+                trees[company_number] = future.result()
+            except Exception as e:
+                logging.error(f"Failed to build tree for {company_number}: {e}")
+                continue
+            logging.info(f"Built tree for {company_number} ({done}/{len(company_numbers)}), {len(entity_cache)} cached responses")
+
+    return {number: trees[number] for number in company_numbers if number in trees}
+
+
+def merge_trees(trees):
+    """
+    Builds a graph for each tree and merges them into one graph, in which shared companies
+    appear once.
+
+    Args:
+        trees (dict): Company number to entity list, as returned by build_trees.
+
+    Returns:
+        tuple: (merged graph, dict of company number to that company's own graph).
+    """
+    subgraphs = {number: utils.create_interlock_network(entity_data) for number, entity_data in trees.items() if entity_data}
+    merged = nx.compose_all(list(subgraphs.values())) if subgraphs else nx.DiGraph()
+
+    # compose_all keeps the attributes of the last graph, so only the batch roots stay highlighted
+    for node in merged.nodes():
+        merged.nodes[node].pop('color', None)
+    for graph in subgraphs.values():
+        for node, data in graph.nodes(data=True):
+            if data.get('color'):
+                merged.nodes[node]['color'] = data['color']
+
+    return merged, subgraphs
+
+
+def write_graph(graph, path):
+    """Writes a graph as node-link JSON."""
+    with open(path, 'w') as f:
+        json.dump(json_graph.node_link_data(graph), f, indent=2, default=str)
+
+
+def read_company_numbers(path):
+    """
+    Reads company numbers from a text file (one per line) or a CSV with a company_number column.
+    """
+    with open(path, newline='') as f:
+        if path.lower().endswith('.csv'):
+            return [row['company_number'] for row in csv.DictReader(f)]
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Build company trees for many companies with shared deduplication.")
+    parser.add_argument('companies', nargs='+', help="Company numbers, or files of company numbers (.txt or .csv).")
+    parser.add_argument('--out', default='batch_output', help="Directory to write merged.json and one <number>.json per company.")
+    parser.add_argument('--workers', type=int, default=BATCH_MAX_WORKERS, help="Trees built concurrently.")
+    args = parser.parse_args()
+
+    company_numbers = []
+    for item in args.companies:
+        company_numbers.extend(read_company_numbers(item) if os.path.isfile(item) else [item])
+
+    trees = build_trees(company_numbers, max_workers=args.workers)
+    merged, subgraphs = merge_trees(trees)
+
+    os.makedirs(args.out, exist_ok=True)
+    write_graph(merged, os.path.join(args.out, 'merged.json'))
+    for company_number, graph in subgraphs.items():
+        write_graph(graph, os.path.join(args.out, f"{company_number}.json"))
+
+    logging.info(f"Wrote merged graph of {merged.number_of_nodes()} nodes and {merged.number_of_edges()} edges "
+                 f"plus {len(subgraphs)} company graphs to {args.out}")
@@ -0,0 +1,340 @@
+import os, sys, json, time, random, logging, argparse, platform, tempfile, threading, tracemalloc
+from datetime import datetime, timezone
+import pandas as pd
+import scraper, utils, graph_store, analytics, large_graph
+from data_sources import DataSource, SyntheticDataSource
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+# Tree builds make several calls per entity with latency, so they default to smaller sizes
+DEFAULT_TREE_SIZES = [10, 100, 1000]
+DEFAULT_LATENCY = 0.01
+DEFAULT_THRESHOLD = 0.2
+# Wall time differences smaller than this are timer noise, not regressions
+MIN_WALL_TIME_DELTA = 0.005
+
+
+class CountingDataSource(DataSource):
+    """
+    Wraps a local data source and counts the calls made to it.
+
+    Args:
+        source (DataSource): The data source to answer calls.
+    """
+
+    def __init__(self, source):
+        super().__init__()
+        self.source = source
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def get(self, endpoint, params=None):
+        with self._lock:
+            self.calls += 1
+        return self.source.get(endpoint, params=params)
+
+
+def synthetic_source_for(size, fanout=3, latency=0.0):
+    """
+    Builds a single synthetic group with at least `size` companies.
+
+    Args:
+        size (int): The minimum number of companies in the group.
+        fanout (int, optional): The number of controllers per company.
+        latency (float, optional): Seconds of latency per call.
+
+    Returns:
+        SyntheticDataSource: The data source.
+    """
+    depth = 0
+    total = 1
+    while total < size:
+        depth += 1
+        total += fanout ** depth
+    return SyntheticDataSource(groups=1, depth=depth, fanout=fanout, latency=latency)
+
+
+def synthetic_entity_data(size, seed=0):
+    """
+    Builds a list of entity dicts shaped like the output of scraper.get_company_tree,
+    without any traversal.
+
+    Args:
+        size (int): The number of entities.
+        seed (int, optional): The random seed.
+
+    Returns:
+        list: The entity dicts, root company first.
+    """
+    rng = random.Random(seed)
+    entity_data = []
+    for i in range(size):
+        company_number = f"{i + 1:08d}"
+        # Each company is controlled by up to three others, making a tree rooted at the first
+        controlled_number = f"{(i - 1) // 3 + 1:08d}" if i else None
+        entity_data.append({
+            'company_id': company_number,
+            'company_name': f"SYNTHETIC {company_number} LIMITED",
+            'etag': f"etag-{company_number}",
+            'name': f"SYNTHETIC {company_number} LIMITED",
+            'nature_of_control': [] if i == 0 else rng.choice([
+                ['ownership-of-shares-75-to-100-percent', 'voting-rights-75-to-100-percent'],
+                ['ownership-of-shares-25-to-50-percent'],
+            ]),
+            'link': scraper.construct_ch_link(company_number),
+            'kind': 'root' if i == 0 else 'corporate-entity-person-with-significant-control',
+            'notified_on': '2016-04-06',
+            'locality': 'London',
+            'accounts': {'last_accounts': {'period_end_on': '2023-12-31'}},
+            'previous_names': [{'name': f"OLD {company_number} LIMITED", 'effective_from': '2001-01-01', 'ceased_on': '2010-01-01'}],
+            'filing_history': {},
+            **({'controlled_company_id': controlled_number, 'controlled_company_name': f"SYNTHETIC {controlled_number} LIMITED"} if i else {}),
+        })
+    return entity_data
+
+
+def synthetic_filings(size, seed=0):
+    """Builds `size` filing history items with descriptions drawn from the filing history YAML."""
+    rng = random.Random(seed)
+    codes = list(utils.DESCRIPTIONS_DICT.keys())
+    return [
+        {
+            'description': rng.choice(codes),
+            'date': f"{2000 + i % 24}-01-01",
+            'links': {'document_metadata': f"https://document-api.company-information.service.gov.uk/document/{i}"},
+        }
+        for i in range(size)
+    ]
+
+
+def bench_tree(size, latency, concurrent, lazy=False):
+    """Builds a tree of about `size` entities against a synthetic source with injected latency."""
+    source = CountingDataSource(synthetic_source_for(size, latency=latency))
+    root_name = source.source.companies[source.source.roots[0]]['company_name']
+
+    def run():
+        scraper.set_data_source(source)
+        try:
+            return scraper.get_company_tree(root_name, concurrent=concurrent, lazy=lazy)
+        finally:
+            scraper.set_data_source(None)
+
+    return run, lambda: source.calls
+
+
+def bench_tree_lazy(size, latency, concurrent):
+    """Builds the same tree as bench_tree without fetching profiles and filing histories."""
+    return bench_tree(size, latency, concurrent, lazy=True)
+
+
+def bench_network(size, latency, concurrent):
+    entity_data = synthetic_entity_data(size)
+    return lambda: utils.create_interlock_network(entity_data), None
+
+
+def bench_compact_network(size, latency, concurrent):
+    entity_data = synthetic_entity_data(size)
+    return lambda: graph_store.create_compact_network(entity_data), None
+
+
+def bench_analytics(size, latency, concurrent):
+    graph = graph_store.create_compact_network(synthetic_entity_data(size))
+    return lambda: analytics.compute_network_analytics(graph), None
+
+
+def bench_elements(size, latency, concurrent):
+    graph = utils.create_interlock_network(synthetic_entity_data(size))
+    return lambda: utils.create_cytoscape_elements(graph, 'SYNTHETIC 00000001 LIMITED'), None
+
+
+def bench_large_elements(size, latency, concurrent):
+    """Lays out, collapses and renders the elements large-graph mode draws first."""
+    graph = utils.create_interlock_network(synthetic_entity_data(size))
+
+    def run():
+        # Drop the layout stored on the graph, so every run computes it
+        graph.graph.pop('large_graph', None)
+        return large_graph.lod_elements(graph, 'SYNTHETIC 00000001 LIMITED')
+
+    return run, None
+
+
+def bench_document_options(size, latency, concurrent):
+    filings = synthetic_filings(size)
+    return lambda: utils.get_document_options(filings), None
+
+
+def bench_addresses(size, latency, concurrent):
+    """Enriches a CSV of `size` company numbers against a synthetic source with injected latency."""
+    source = CountingDataSource(SyntheticDataSource(groups=size, depth=0, fanout=0, latency=latency))
+    handle, csv_path = tempfile.mkstemp(suffix='.csv')
+    os.close(handle)
+    pd.DataFrame({'company_number': sorted(source.source.companies)}).to_csv(csv_path, index=False)
+
+    def run():
+        scraper.set_data_source(source)
+        try:
+            return scraper.get_addresses(csv_path)
+        finally:
+            scraper.set_data_source(None)
+            os.remove(csv_path)
+
+    return run, lambda: source.calls
+
+
+BENCHMARKS = {
+    'tree': bench_tree,
+    'tree_lazy': bench_tree_lazy,
+    'network': bench_network,
+    'compact_network': bench_compact_network,
+    'analytics': bench_analytics,
+    'elements': bench_elements,
+    'large_elements': bench_large_elements,
+    'document_options': bench_document_options,
+    'addresses': bench_addresses,
+}
+
+# Benchmarks that make API calls, which default to DEFAULT_TREE_SIZES
+API_BENCHMARKS = {'tree', 'tree_lazy', 'addresses'}
+
+
+def _run_once(name, size, latency, concurrent, traced=False):
+    """Runs a benchmark once, returning its wall time, API calls and, when traced, peak memory."""
+    run, api_calls = BENCHMARKS[name](size, latency, concurrent)
+
+    # The response cache would turn repeated runs into cache hits
+    response_cache = scraper.response_cache
+    scraper.response_cache = None
+
+    if traced:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        run()
+    finally:
+        wall_time = time.perf_counter() - start
+        peak_memory = tracemalloc.get_traced_memory()[1] if traced else None
+        if traced:
+            tracemalloc.stop()
+        scraper.response_cache = response_cache
+
+    return {
+        'wall_time': wall_time,
+        'api_calls': api_calls() if api_calls else 0,
+        'peak_memory': peak_memory,
+    }
+
+
+def run_benchmark(name, size, latency=DEFAULT_LATENCY, concurrent=True, repeat=1):
+    """
+    Runs one benchmark at one size.
+
+    Wall time is measured on untraced runs, as tracemalloc slows every allocation down. Peak memory
+    is measured on one more run with tracemalloc on, whose timing is thrown away.
+
+    Args:
+        name (str): The benchmark name, a key of BENCHMARKS.
+        size (int): The number of entities.
+        latency (float, optional): Seconds of latency per API call.
+        concurrent (bool, optional): Whether tree builds use concurrent traversal.
+        repeat (int, optional): Time this many runs and keep the fastest, to reduce noise.
+
+    Returns:
+        dict: wall_time (seconds), api_calls and peak_memory (bytes).
+    """
+    best = None
+    for _ in range(repeat):
+        result = _run_once(name, size, latency, concurrent)
+        if best is None or result['wall_time'] < best['wall_time']:
+            best = result
+
+    best['peak_memory'] = _run_once(name, size, latency, concurrent, traced=True)['peak_memory']
+    return best
+
+
+def compare_results(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compares results against a saved baseline.
+
+    Args:
+        results (dict): The results of this run, keyed on 'name[size]'.
+        baseline (dict): The saved baseline results, keyed the same way.
+        threshold (float, optional): The relative increase in wall time or peak memory counted as a regression.
+
+    Returns:
+        list: A description of each regression found.
+    """
+    regressions = []
+    for key, result in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+
+        for metric in ('wall_time', 'peak_memory'):
+            if metric == 'wall_time' and result[metric] - previous[metric] < MIN_WALL_TIME_DELTA:
+                continue
+            if previous[metric] and result[metric] > previous[metric] * (1 + threshold):
+                regressions.append(f"{key} {metric}: {previous[metric]:.4g} -> {result[metric]:.4g} "
+                                   f"(+{(result[metric] / previous[metric] - 1) * 100:.0f}%)")
+
+        if result['api_calls'] > previous['api_calls']:
+            regressions.append(f"{key} api_calls: {previous['api_calls']} -> {result['api_calls']}")
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark tree building, network construction and element rendering.")
+    parser.add_argument('benchmarks', nargs='*', help=f"Benchmarks to run, any of {', '.join(BENCHMARKS)} (default: all).")
+    parser.add_argument('--sizes', type=int, nargs='+', help="Entity counts to run each benchmark at.")
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY, help="Seconds of latency per API call.")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per benchmark, the fastest is kept.")
+    parser.add_argument('--sequential', action='store_true', help="Build trees with the sequential traversal.")
+    parser.add_argument('--save', help="Save the results as a baseline JSON file.")
+    parser.add_argument('--compare', help="Compare the results against a baseline JSON file.")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="Relative slowdown or memory growth counted as a regression.")
+    parser.add_argument('--verbose', action='store_true', help="Keep INFO logging from the code under test.")
+    args = parser.parse_args(argv)
+
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    results = {}
+    for name in args.benchmarks or list(BENCHMARKS):
+        sizes = args.sizes or (DEFAULT_TREE_SIZES if name in API_BENCHMARKS else DEFAULT_SIZES)
+        for size in sizes:
+            result = run_benchmark(name, size, latency=args.latency, concurrent=not args.sequential, repeat=args.repeat)
+            results[f"{name}[{size}]"] = result
+            print(f"{name:<18}{size:>8}  {result['wall_time']:>9.4f}s  {result['api_calls']:>7} calls  "
+                  f"{result['peak_memory'] / 1024 / 1024:>9.2f} MiB", flush=True)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'created': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'latency': args.latency,
+                'results': results,
+            }, f, indent=2)
+        print(f"Saved baseline to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare_results(results, baseline, args.threshold)
+        if regressions:
+            print("Regressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("No regressions against baseline.")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
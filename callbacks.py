@@ -1,15 +1,215 @@
 from dash.dependencies import Input, Output, State, ALL
-from dash import html, no_update, dcc, callback_context
+from dash import html, no_update, dcc, callback_context, Patch
 import dash_bootstrap_components as dbc
-import utils, scraper
-import logging, os
+import utils, scraper, analytics, large_graph
+import logging, os, time, threading, itertools
+from collections import OrderedDict
 from flask import send_file
+from tree_cache import TreeCache
+from jobs import JobQueue, DONE, FAILED, CANCELLED
 
 
-# Cache and search history
-cache = {}
+# Built trees, shared between users and worker processes, and search history
+tree_cache = TreeCache.from_env()
 search_history = []
 
+# Tree builds run in the background, the UI polls them with the job-poll interval
+job_queue = JobQueue()
+JOB_POLL_INTERVAL_MS = int(os.getenv('JOB_POLL_INTERVAL_MS', '500'))
+
+# Layout for graphs small enough to draw in full, large graphs use large_graph.PRESET_LAYOUT
+DEFAULT_LAYOUT = {'name': 'cose'}
+# Seconds a tree with entities that couldn't be fetched is cached for, so it is soon rebuilt in full
+INCOMPLETE_TREE_TTL = int(os.getenv('INCOMPLETE_TREE_TTL', '60'))
+
+
+
+# Analytics panel
+ANALYTICS_LABELS = {
+    'total_nodes': "Nodes",
+    'total_edges': "Control relationships",
+    'total_companies': "Companies",
+    'components': "Separate groups",
+    'largest_component': "Largest group",
+    'max_control_depth': "Deepest ownership chain",
+    'interlocking_controllers': "Controllers of several companies",
+    'interlocks': "Interlocks",
+}
+
+ANALYTICS_RANKINGS = {
+    'pagerank': ("PageRank", "{:.4f}"),
+    'betweenness': ("Betweenness", "{:.4f}"),
+    'degree': ("Connections", "{}"),
+    'control_depth': ("Ownership layers below", "{}"),
+    'interlocks': ("Companies controlled", "{}"),
+}
+
+
+def render_analytics(results):
+    """
+    Renders network analytics as the contents of the analytics panel.
+
+    Inputs:
+        results: The output of analytics.get_network_analytics.
+
+    Outputs:
+        A list of HTML components: a summary table, then a table per ranking.
+    """
+    summary = html.Table(
+        [html.Tr([html.Td(label), html.Td(results['summary'][key])]) for key, label in ANALYTICS_LABELS.items()],
+        style={"width": "100%", "borderCollapse": "collapse"}
+    )
+
+    rankings = []
+    for key, (title, value_format) in ANALYTICS_RANKINGS.items():
+        rows = results['top'].get(key, [])
+        if not rows:
+            continue
+        rankings.append(html.Div([
+            html.H5(title),
+            html.Table(
+                [html.Tr([html.Th("Company"), html.Th(title)])]
+                + [html.Tr([html.Td(name), html.Td(value_format.format(value))]) for name, value in rows],
+                style={"width": "100%", "borderCollapse": "collapse"}
+            )
+        ], style={'margin-top': '10px'}))
+
+    return [html.H4("Network Analytics"), summary] + rankings
+
+
+def build_network(company_number, company_name, progress=None):
+    """
+    Builds a company's tree, network elements and analytics, and stores them in the tree cache.
+    Run as a background job.
+
+    Inputs:
+        company_number: The company number of the selected company.
+        company_name: The name of the selected company, as shown in the search results.
+        progress: The job's scraper.TreeProgress.
+
+    Outputs:
+        dict: tree, elements, layout, analytics and incomplete (see scraper.TreeProgress), or None if no
+            data was found. Large graphs are drawn with precomputed positions and collapsed subtrees, see large_graph.
+    """
+    # Profiles and filing histories are fetched when a node is tapped
+    company_tree = scraper.get_company_tree(company_name, concurrent=True, company_number=company_number, lazy=True, progress=progress)
+    if not company_tree:
+        return None
+
+    graph = utils.create_interlock_network(company_tree)
+    if large_graph.is_large(graph):
+        elements, layout = large_graph.lod_elements(graph, company_name), large_graph.PRESET_LAYOUT
+    else:
+        elements, layout = utils.create_cytoscape_elements(graph, company_name), DEFAULT_LAYOUT
+    # Computed once per graph, toggling the panel doesn't recompute it
+    network = {'tree': company_tree, 'elements': elements, 'layout': layout, 'analytics': analytics.get_network_analytics(graph),
+               'incomplete': list(progress.incomplete) if progress else [], 'built_at': time.time()}
+    tree_cache.set(company_number, network, ttl=INCOMPLETE_TREE_TTL if network['incomplete'] else None)
+    return network
+
+
+# Graphs rebuilt from the tree cache, company number -> (built_at of the tree, graph), most recent last
+GRAPH_MEMO_SIZE = 4
+graph_memo = OrderedDict()
+graph_memo_lock = threading.Lock()
+
+
+def cached_graph(company_number):
+    """
+    Rebuilds the network of a tree in the tree cache, keeping the last few so expanding clusters of
+    a large graph doesn't rebuild it every time. A graph is only reused while the tree it was built
+    from is still the one cached, so a rebuilt or expired tree is never served from an old graph.
+
+    Inputs:
+        company_number: The company number the tree is cached under.
+
+    Outputs:
+        The networkx DiGraph, with its large-graph layout computed on first use.
+    """
+    network = tree_cache.get(company_number)
+    with graph_memo_lock:
+        memo = graph_memo.pop(company_number, None)
+        if network is None:
+            raise ValueError(f"No tree cached for {company_number}")
+        if memo is not None and memo[0] == network.get('built_at'):
+            graph_memo[company_number] = memo
+            return memo[1]
+
+    graph = utils.create_interlock_network(network['tree'])
+    with graph_memo_lock:
+        graph_memo[company_number] = (network.get('built_at'), graph)
+        while len(graph_memo) > GRAPH_MEMO_SIZE:
+            graph_memo.popitem(last=False)
+    return graph
+
+
+def render_job_progress(job):
+    """
+    Describes a running tree build.
+
+    Inputs:
+        job: A dict from jobs.Job.snapshot.
+
+    Outputs:
+        str: The status line shown while the tree is built.
+    """
+    status = f"Building tree ({job['phase']}): {job['nodes']} companies found, {job['api_calls']} API calls, {job['elapsed']}s"
+    if job['rate_limit_wait']:
+        status += f", {job['rate_limit_wait']}s waiting for the rate limit"
+    if job.get('retries'):
+        status += f", {job['retries']} retries"
+    return status
+
+
+def render_incomplete(network):
+    """
+    Describes what is missing from a tree built while the API was failing.
+
+    Inputs:
+        network: A dict from build_network.
+
+    Outputs:
+        str: The warning shown with the tree, empty if the tree is complete.
+    """
+    incomplete = network.get('incomplete', [])
+    if not incomplete:
+        return ""
+    names = ', '.join(entry['name'] for entry in incomplete[:5]) + (f" and {len(incomplete) - 5} more" if len(incomplete) > 5 else "")
+    return f"The tree may be incomplete, {len(incomplete)} entities couldn't be fetched: {names}. Companies affected are outlined."
+
+
+def element_key(element):
+    """Identifies a Cytoscape element: nodes by ID, edges by their ends."""
+    data = element['data']
+    return ('edge', data['source'], data['target']) if 'source' in data else ('node', data['id'])
+
+
+def patch_elements(current, final):
+    """
+    Works out the changes that turn the elements on screen into the finished tree's elements.
+
+    Inputs:
+        current: The elements the browser has, in order.
+        final: The finished tree's elements.
+
+    Outputs:
+        A dash Patch updating changed elements in place, appending new ones and deleting the rest.
+    """
+    patch = Patch()
+    positions = {element_key(element): index for index, element in enumerate(current)}
+    final_keys = set()
+    for element in final:
+        key = element_key(element)
+        final_keys.add(key)
+        index = positions.get(key)
+        if index is None:
+            patch.append(element)
+        elif current[index] != element:
+            patch[index] = element
+    # Delete from the end so earlier indices stay valid
+    for index in sorted((index for key, index in positions.items() if key not in final_keys), reverse=True):
+        del patch[index]
+    return patch
 
 
 # Main search function
@@ -30,6 +230,10 @@ def register_callbacks(app):
         Output('cytoscape-network', 'elements'),
         Output('message', 'children'),
         Output('message', 'style'),
+        Output('analytics-container', 'children'),
+        Output('tree-job', 'data'),
+        Output('job-poll', 'disabled'),
+        Output('cytoscape-network', 'layout'),
         [Input('submit-button', 'n_clicks'), Input({'type': 'select-company', 'index': ALL}, 'n_clicks')],
         [State('input-company-name', 'value')]
     )
@@ -46,7 +250,7 @@ def register_callbacks(app):
                 search_data = scraper.search_ch(company_name)
 
                 if not search_data or "items" not in search_data:
-                    return False, html.P("No results found."), [], "", {'display': 'none'}
+                    return False, html.P("No results found."), [], "", {'display': 'none'}, [], no_update, no_update, no_update
 
                 global search_results
                 search_results = search_data["items"]
@@ -66,7 +270,7 @@ def register_callbacks(app):
                         )
                     )
 
-                return True, cards, [], "", {'display': 'none'}  # Open left panel with search results
+                return True, cards, [], "", {'display': 'none'}, [], no_update, no_update, no_update  # Open left panel with search results
 
         # If a company selection button is clicked, close modal and fetch network
         elif ctx.triggered and 'select-company' in ctx.triggered[0]['prop_id']:
@@ -87,20 +291,148 @@ def register_callbacks(app):
 
             logging.info(f"Fetching data for selected company: {selected_company_name} (number: {selected_company_number})")
             
-            try:
-                company_tree = scraper.get_company_tree(selected_company_name)
-            except Exception as e:
-                logging.error(f"Error fetching company tree for {selected_company_name}: {e}")
-                return False, [], [], f"Error fetching data for {selected_company_name}: {str(e)}", {'padding': '20px', 'display': 'block'}
+            # Re-selecting a company, or one another user already built, is served from the tree cache
+            cached = tree_cache.get(selected_company_number)
+            if cached is not None:
+                logging.info(f"Tree cache hit for {selected_company_number}")
+                tree_job = {'id': None, 'company': selected_company_name, 'number': selected_company_number, 'sent': len(cached['elements'])}
+                warning = render_incomplete(cached)
+                return (False, [], cached['elements'], warning, {'padding': '20px', 'display': 'block' if warning else 'none'},
+                        render_analytics(cached['analytics']), tree_job, True, cached['layout'])
+
+            # Build in the background and poll for progress, users selecting the same company share the build
+            job = job_queue.submit(selected_company_number, build_network, selected_company_number, selected_company_name)
+            tree_job = {'id': job.id, 'company': selected_company_name, 'number': selected_company_number, 'sent': 0}
+            return False, [], [], "", {'display': 'none'}, [], tree_job, False, DEFAULT_LAYOUT  # Close modal and start drawing it as it's found
+
+        return False, [], [], "", {'display': 'none'}, [], no_update, no_update, no_update
+
+    # Background tree builds
+    @app.callback(
+        Output('cytoscape-network', 'elements', allow_duplicate=True),
+        Output('message', 'children', allow_duplicate=True),
+        Output('message', 'style', allow_duplicate=True),
+        Output('analytics-container', 'children', allow_duplicate=True),
+        Output('job-poll', 'disabled', allow_duplicate=True),
+        Output('job-status', 'style'),
+        Output('job-progress', 'children'),
+        Output('tree-job', 'data', allow_duplicate=True),
+        Output('cytoscape-network', 'layout', allow_duplicate=True),
+        [Input('job-poll', 'n_intervals')],
+        [State('tree-job', 'data')],
+        prevent_initial_call=True
+    )
+    def poll_tree_job(n_intervals, tree_job):
+        """
+        Draws the selected company's tree as it is discovered, sending only the elements added since
+        the last poll, then corrects it to the finished tree once the build is done.
 
-            if not company_tree:
-                return False, [], [], f"No data found for {selected_company_name}", {'padding': '20px', 'display': 'block'}
+        Inputs:
+            n_intervals: The number of times the poll interval has fired.
+            tree_job: The job's ID, the selected company's name and the number of elements already sent.
 
-            elements = utils.create_cytoscape_elements(utils.create_interlock_network(company_tree), selected_company_name)
+        Outputs:
+            A patch of the network elements, message, analytics panel, whether to stop polling,
+            the progress line and the updated job data.
+        """
+        hidden = {'display': 'none'}
+        shown = {'padding': '20px', 'display': 'block'}
+        job = job_queue.get(tree_job['id']) if tree_job and tree_job['id'] else None
+        if job is None:
+            if not tree_job or not tree_job['id']:
+                return no_update, no_update, no_update, no_update, True, hidden, "", no_update, no_update
+            # Jobs live in the process that queued them, so this poll reached another worker process or
+            # the job was pruned. The finished tree may still be in the shared tree cache.
+            network = tree_cache.get(tree_job['number'])
+            if network is not None:
+                warning = render_incomplete(network)
+                return (network['elements'], warning, shown if warning else hidden, render_analytics(network['analytics']), True, hidden, "",
+                        dict(tree_job, sent=len(network['elements'])), network['layout'])
+            logging.warning(f"Job {tree_job['id']} for {tree_job['number']} isn't known to this process")
+            return (no_update, f"Lost track of the tree being built for {tree_job['company']}, please select it again",
+                    shown, no_update, True, hidden, "", no_update, no_update)
+
+        status = job.snapshot()
+        sent = tree_job['sent']
+        # Large trees stop being drawn as they grow, the finished tree is drawn collapsed instead
+        discovered = list(itertools.islice(utils.iter_cytoscape_elements(list(job.progress.entities), tree_job['company']),
+                                           large_graph.LARGE_GRAPH_THRESHOLD))
+
+        if job.status == DONE:
+            if not job.result:
+                return [], f"No data found for {tree_job['company']}", shown, [], True, hidden, "", no_update, no_update
+            network = job.result
+            if network['layout'] == large_graph.PRESET_LAYOUT:
+                elements = network['elements']
+            else:
+                elements = patch_elements(discovered[:sent], network['elements'])
+            warning = render_incomplete(network)
+            return (elements, warning, shown if warning else hidden, render_analytics(network['analytics']), True, hidden, "",
+                    dict(tree_job, sent=len(network['elements'])), network['layout'])
+        if job.status == FAILED:
+            # Whatever was drawn stays on screen
+            return no_update, f"Error fetching data for {tree_job['company']}: {job.error}", shown, [], True, hidden, "", no_update, no_update
+        if job.status == CANCELLED:
+            return no_update, f"Cancelled building the tree for {tree_job['company']}, showing what was found", shown, [], True, hidden, "", no_update, no_update
+
+        if len(discovered) > sent:
+            elements = Patch()
+            elements.extend(discovered[sent:])
+            tree_job = dict(tree_job, sent=len(discovered))
+        else:
+            elements, tree_job = no_update, no_update
+        return elements, no_update, no_update, no_update, False, shown, render_job_progress(status), tree_job, no_update
+
+    # Large graphs: tapping a cluster node reveals the companies collapsed into it
+    @app.callback(
+        Output('cytoscape-network', 'elements', allow_duplicate=True),
+        [Input('cytoscape-network', 'tapNodeData')],
+        [State('cytoscape-network', 'elements'), State('tree-job', 'data')],
+        prevent_initial_call=True
+    )
+    def expand_cluster(node_data, elements, tree_job):
+        """
+        Expands a tapped cluster node of a large graph.
 
-            return False, [], elements, "", {'display': 'none'}  # Close modal and show network
+        Inputs:
+            node_data: Data of the tapped node.
+            elements: The elements on screen.
+            tree_job: The selected company's name and number.
 
-        return False, [], [], "", {'display': 'none'}
+        Outputs:
+            A patch adding the revealed companies and updating the clusters, or no_update for other nodes.
+        """
+        if not node_data or 'cluster' not in node_data or not tree_job:
+            return no_update
+        try:
+            graph = cached_graph(tree_job['number'])
+        except ValueError as e:
+            logging.warning(f"Can't expand {node_data['id']}: {e}")
+            return no_update
+
+        visible = large_graph.expand_cluster(graph, large_graph.visible_nodes(elements), node_data['cluster'])
+        return patch_elements(elements, large_graph.lod_elements(graph, tree_job['company'], visible))
+
+    @app.callback(
+        Output('job-progress', 'children', allow_duplicate=True),
+        [Input('cancel-job-button', 'n_clicks')],
+        [State('tree-job', 'data')],
+        prevent_initial_call=True
+    )
+    def cancel_tree_job(n_clicks, tree_job):
+        """
+        Cancels the running tree build when the cancel button is clicked.
+
+        Inputs:
+            n_clicks: The number of times the cancel button has been clicked.
+            tree_job: The job's ID, the selected company's name and the number of elements already sent.
+
+        Outputs:
+            The progress line, until the next poll reports the job cancelled.
+        """
+        if n_clicks and tree_job and job_queue.cancel(tree_job['id']):
+            return "Cancelling..."
+        return no_update
     
     # Search history
     @app.callback(
@@ -173,9 +505,21 @@ def register_cytoscape_callbacks(app):
             style: A style dictionary for the node details section.
             options: A list of options for the document dropdown based on the node's company.
         """
+        if node_data and 'cluster' in node_data:
+            details = [html.H4("Collapsed companies"), html.P(f"{node_data['size']} more companies control {node_data['cluster']}, tap to show them.")]
+            return details, {'padding': '20px', 'border': '1px solid #ccc', 'margin-top': '20px', 'display': 'block'}, []
         if node_data:
             link = node_data.get('link', 'N/A')
 
+            # The tree is built lazily, so fetch the profile for companies now (cached after the first tap)
+            node_company_name = node_data.get('label', 'Unknown')
+            node_company_number = node_data.get('number', '')
+            company_profile = {}
+            if node_data.get('link') and node_company_number:
+                company_profile, _ = scraper.get_company_details(node_company_number, node_company_name)
+            period_end = node_data.get('period_end') or company_profile.get('accounts', {}).get('last_accounts', {}).get('period_end_on', '')
+            previous_names = node_data.get('previous_names') or company_profile.get('previous_company_names', [])
+
             details = [
                 html.H4("Company Details"),
                 html.P(f"Name: {node_data.get('label')}"),
@@ -183,7 +527,7 @@ def register_cytoscape_callbacks(app):
                     "Link: ",
                     html.A(f"{link}", href=f'https://{link}', target="_blank")
                 ]),
-                html.P(f"Period Ends: {node_data.get('period_end')}"),
+                html.P(f"Period Ends: {period_end}"),
                 html.Div([
                     html.H5("Previous Names:"),
                     html.Table(
@@ -199,7 +543,7 @@ def register_cytoscape_callbacks(app):
                                 html.Td(name.get("effective_from", "N/A")),
                                 html.Td(name.get("ceased_on", "N/A"))
                             ])
-                            for name in node_data.get("previous_names", [])
+                            for name in previous_names
                         ],
                         style={"width": "100%", "borderCollapse": "collapse"}
                     )
@@ -209,9 +553,7 @@ def register_cytoscape_callbacks(app):
             
             # Document search 
             # Fetch filing history on node tap, populate download that way
-            node_company_name = node_data.get('label', 'Unknown')
-            node_company_number = node_data.get('number', '')
-            data = utils.fetch_document_records(company_name=node_company_name, cache=cache, company_number=node_company_number)
+            data = utils.fetch_document_records(company_name=node_company_name, company_number=node_company_number)
             if not data or 'items' not in data:
                 logging.warning(f"Documents list empty for {node_company_name}")
                 options = []
@@ -264,8 +606,9 @@ def register_cytoscape_callbacks(app):
                 for control in nature_of_control_list
             ]
 
+            # Edges run from the controller to the company it controls
             return [
-                html.P(f"{target_node_name} {description} {source_node_name}") for description in descriptions
+                html.P(f"{source_node_name} {description} {target_node_name}") for description in descriptions
             ]
         return "Click on an edge to see the nature of control information."
 
@@ -295,17 +638,10 @@ def register_cytoscape_callbacks(app):
             #logging.info(f"Trying to download file {selected_document}")
             file_path = scraper.get_document(selected_document)
             if file_path:
-                # Serve the file for download
+                # Serve the file for download. It stays in the document store for the next request.
                 logging.info(f"Serving file {file_path} to user.")
-                return dcc.send_file(file_path)
+                document_id = selected_document.rstrip('/').rsplit('/', 1)[-1]
+                return dcc.send_file(file_path, filename=f"{document_id}.pdf")
         except Exception as e:
             logging.error(f"Failed to process document {selected_document} download: {e}")
             raise RuntimeError(f"Request failed: {e}")
-        finally:
-            # Cleanup file if it exists
-            if 'file_path' in locals() and os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                    logging.info(f"Cleaned up temporary file: {file_path}")
-                except Exception as cleanup_error:
-                    logging.warning(f"Failed to clean up temporary file {file_path}: {cleanup_error}")
@@ -0,0 +1,439 @@
+import os, re, json, time, random, hashlib, logging
+from snapshot_store import SnapshotStore, normalise_name
+from response_cache import ResponseCache
+
+# Endpoint routes understood by local data sources
+COMPANY_ROUTE = re.compile(r'^/?company/(?P<company_number>[^/]+)/?$')
+PSC_ROUTE = re.compile(r'^/?company/(?P<company_number>[^/]+)/persons-with-significant-control/?$')
+FILING_HISTORY_ROUTE = re.compile(r'^/?company/(?P<company_number>[^/]+)/filing-history/?$')
+SEARCH_ROUTE = re.compile(r'^/?(advanced-)?search/companies/?$')
+
+
+class DataSource:
+    """
+    Answers Companies House API endpoints. scraper.make_api_call sends every call to the configured
+    data source, so every scraper function works unchanged on top of any of them.
+
+    Remote sources (remote = True) implement send() and go through the scraper's response cache,
+    rate limiter and status handling. Local sources implement get() with the same contract as
+    scraper.make_api_call: return the decoded JSON body, raise ValueError when the resource
+    doesn't exist. Local sources can add a fixed latency per call to stand in for the network.
+
+    Args:
+        latency (float, optional): Seconds to sleep before answering each call.
+    """
+
+    remote = False
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def simulate_latency(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get(self, endpoint, params=None):
+        raise NotImplementedError
+
+
+class HttpDataSource(DataSource):
+    """
+    Sends calls over HTTP to the live Companies House API, or to any server that speaks the
+    same protocol such as mock_server.py.
+
+    Args:
+        base_url (str): The API root, ending in '/'.
+        session (requests.Session or transport.Transport): What to send requests with, carrying any auth headers.
+    """
+
+    remote = True
+
+    def __init__(self, base_url, session):
+        super().__init__()
+        self.base_url = base_url if base_url.endswith('/') else base_url + '/'
+        self.session = session
+
+    def send(self, endpoint, params=None, headers=None, timeout=30):
+        """
+        Sends a GET request for an endpoint.
+
+        Returns:
+            requests.Response: The raw response, status handling is left to the caller.
+        """
+        return self.session.get(self.base_url + endpoint, params=params, headers=headers, timeout=timeout)
+
+
+def page_items(items, params, total_key='total_results'):
+    """
+    Slices a full item list into the page requested by items_per_page/start_index params,
+    shaped like a Companies House list response.
+
+    Args:
+        items (list): Every item in the list.
+        params (dict): The request params.
+        total_key (str, optional): The name of the total field for this endpoint.
+
+    Returns:
+        dict: The page of items with its paging fields.
+    """
+    params = params or {}
+    start_index = int(params.get('start_index', 0) or 0)
+    items_per_page = int(params.get('items_per_page', 25) or 25)
+
+    return {
+        'items': items[start_index:start_index + items_per_page],
+        'items_per_page': items_per_page,
+        'start_index': start_index,
+        total_key: len(items),
+    }
+
+
+def profile_to_search_item(profile):
+    """Converts a company profile into the shape of a company search result item."""
+    address = profile.get('registered_office_address', {})
+    return {
+        'kind': 'searchresults#company',
+        'company_number': profile['company_number'],
+        'title': profile.get('company_name', ''),
+        'company_status': profile.get('company_status', ''),
+        'date_of_creation': profile.get('date_of_creation'),
+        'address_snippet': ', '.join(filter(None, [
+            address.get('address_line_1'), address.get('locality'), address.get('postal_code')
+        ])),
+        'links': {'self': f"/company/{profile['company_number']}"},
+    }
+
+
+class SnapshotDataSource(DataSource):
+    """
+    Answers company profile, PSC and search endpoints from a local SnapshotStore built from the
+    Companies House bulk data products, with no HTTP calls. The bulk products don't include filing
+    history, so filing history is always empty.
+
+    Args:
+        store (SnapshotStore): The store to read from.
+        latency (float, optional): Seconds to sleep before answering each call.
+    """
+
+    def __init__(self, store, latency=0.0):
+        super().__init__(latency)
+        self.store = store
+
+    def get(self, endpoint, params=None):
+        """
+        Answers an API endpoint from the snapshot.
+
+        Args:
+            endpoint (str): The API endpoint.
+            params (dict, optional): The request params.
+
+        Returns:
+            dict: The response body.
+
+        Raises:
+            ValueError: If the resource isn't in the snapshot.
+        """
+        self.simulate_latency()
+
+        match = COMPANY_ROUTE.match(endpoint)
+        if match:
+            profile = self.store.get_profile(match.group('company_number'))
+            if profile is None:
+                raise ValueError(f"Resource not found in snapshot: {endpoint}")
+            return profile
+
+        match = PSC_ROUTE.match(endpoint)
+        if match:
+            company_number = match.group('company_number')
+            pscs = self.store.get_pscs(company_number)
+            if not pscs and self.store.get_profile(company_number) is None:
+                raise ValueError(f"Resource not found in snapshot: {endpoint}")
+            for psc in pscs:
+                # The bulk file only records ceased_on, the API also sets a ceased flag
+                psc.setdefault('ceased', bool(psc.get('ceased_on')))
+            return page_items(pscs, params)
+
+        if FILING_HISTORY_ROUTE.match(endpoint):
+            return page_items([], params, total_key='total_count')
+
+        if SEARCH_ROUTE.match(endpoint):
+            params = params or {}
+            name = params.get('q') or params.get('company_name_includes', '')
+            profiles = self.store.search(name)
+            return page_items([profile_to_search_item(profile) for profile in profiles], params)
+
+        raise ValueError(f"Resource not available in snapshot: {endpoint}")
+
+
+class FixtureDataSource(DataSource):
+    """
+    Replays API responses recorded to a directory, one JSON file per endpoint and params.
+    Fixtures are recorded by setting CH_RECORD_FIXTURES while using the live API (see
+    scraper.make_api_call), which makes test runs and benchmarks reproducible offline.
+
+    Args:
+        directory (str): The fixture directory.
+        latency (float, optional): Seconds to sleep before answering each call.
+    """
+
+    def __init__(self, directory, latency=0.0):
+        super().__init__(latency)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def fixture_path(self, endpoint, params=None):
+        """Returns the file a response for this endpoint and params is recorded in."""
+        key = ResponseCache.make_key(endpoint, params)
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def record(self, endpoint, params, body):
+        """
+        Records a response.
+
+        Args:
+            endpoint (str): The API endpoint.
+            params (dict): The request params.
+            body (dict): The decoded response, or None to record that the resource was not found.
+        """
+        fixture = {'key': ResponseCache.make_key(endpoint, params), 'found': body is not None, 'body': body}
+        path = self.fixture_path(endpoint, params)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(fixture, f)
+        os.replace(path + '.tmp', path)
+
+    def get(self, endpoint, params=None):
+        """
+        Replays the recorded response for an endpoint.
+
+        Raises:
+            ValueError: If the resource was recorded as not found, or was never recorded.
+        """
+        self.simulate_latency()
+
+        path = self.fixture_path(endpoint, params)
+        if not os.path.exists(path):
+            logging.warning(f"No fixture recorded for {ResponseCache.make_key(endpoint, params)}")
+            raise ValueError(f"Resource not recorded: {endpoint}")
+
+        with open(path) as f:
+            fixture = json.load(f)
+
+        if not fixture['found']:
+            raise ValueError(f"Resource not found: {endpoint}")
+        return fixture['body']
+
+
+# Natures of control handed out to synthetic PSCs
+SYNTHETIC_NATURES_OF_CONTROL = [
+    ['ownership-of-shares-75-to-100-percent', 'voting-rights-75-to-100-percent', 'right-to-appoint-and-remove-directors'],
+    ['ownership-of-shares-50-to-75-percent', 'voting-rights-50-to-75-percent'],
+    ['ownership-of-shares-25-to-50-percent'],
+]
+
+
+class SyntheticDataSource(DataSource):
+    """
+    Generates synthetic corporate groups in memory and answers the profile, PSC, filing history and
+    search endpoints for them. Each group is a root company controlled by `fanout` corporate PSCs,
+    each of which is controlled by `fanout` more, up to `depth` levels, with an individual at the top.
+
+    Args:
+        groups (int, optional): The number of groups (root companies).
+        depth (int, optional): The number of corporate levels above each root.
+        fanout (int, optional): The number of corporate controllers per company.
+        overlap (float, optional): The probability that a controller is shared with an earlier group,
+            so groups converge on the same holding companies.
+        filings (int, optional): The number of filing history items per company.
+        latency (float, optional): Seconds to sleep before answering each call.
+        seed (int, optional): The random seed, the same arguments always give the same groups.
+    """
+
+    def __init__(self, groups=1, depth=3, fanout=2, overlap=0.0, filings=3, latency=0.0, seed=0):
+        super().__init__(latency)
+        self.companies = {}
+        self.pscs = {}
+        self.filings = filings
+        self.roots = []
+
+        rng = random.Random(seed)
+        companies_by_level = {}
+
+        def new_company(level):
+            company_number = f"{len(self.companies) + 1:08d}"
+            self.companies[company_number] = {
+                'company_number': company_number,
+                'company_name': f"SYNTHETIC {company_number} LIMITED",
+                'company_status': 'active',
+                'type': 'ltd',
+                'etag': hashlib.sha1(f"profile-{company_number}".encode('utf-8')).hexdigest(),
+                'registered_office_address': {'address_line_1': f"{len(self.companies)} Synthetic Street", 'locality': 'London',
+                                              'postal_code': 'EC1A 1AA', 'country': 'England'},
+                'accounts': {'last_accounts': {'period_end_on': '2023-12-31', 'made_up_to': '2023-12-31'}},
+                'previous_company_names': [],
+                'links': {'self': f"/company/{company_number}"},
+            }
+            self.pscs[company_number] = []
+            companies_by_level.setdefault(level, []).append(company_number)
+            return company_number
+
+        def add_psc(controlled, controller):
+            name = self.companies[controller]['company_name']
+            etag = hashlib.sha1(f"psc-{controlled}-{controller}".encode('utf-8')).hexdigest()
+            if any(psc['etag'] == etag for psc in self.pscs[controlled]):
+                return
+            self.pscs[controlled].append({
+                'kind': 'corporate-entity-person-with-significant-control',
+                'name': name,
+                'etag': etag,
+                'ceased': False,
+                'notified_on': '2016-04-06',
+                'natures_of_control': rng.choice(SYNTHETIC_NATURES_OF_CONTROL),
+                'address': {'address_line_1': 'Synthetic Street', 'locality': 'London', 'country': 'England'},
+                'identification': {'registration_number': controller, 'country_registered': 'England',
+                                   'place_registered': 'Companies House', 'legal_form': 'Private Limited Company'},
+                'links': {'self': f"/company/{controlled}/persons-with-significant-control/corporate-entity/{controller}"},
+            })
+
+        for _ in range(groups):
+            # Only companies from earlier groups are shared, so each group is still a DAG
+            earlier_counts = {level: len(companies_by_level.get(level, [])) for level in range(1, depth + 1)}
+
+            root = new_company(0)
+            self.roots.append(root)
+            level_companies = [root]
+
+            for level in range(1, depth + 1):
+                next_level = []
+                for controlled in level_companies:
+                    for _ in range(fanout):
+                        if earlier_counts[level] and rng.random() < overlap:
+                            controller = companies_by_level[level][rng.randrange(earlier_counts[level])]
+                            add_psc(controlled, controller)
+                            # Shared controllers already have their own chain
+                            continue
+                        controller = new_company(level)
+                        add_psc(controlled, controller)
+                        next_level.append(controller)
+                level_companies = next_level
+
+            for top in level_companies:
+                self.pscs[top].append({
+                    'kind': 'individual-person-with-significant-control',
+                    'name': f"Synthetic Person {top}",
+                    'etag': hashlib.sha1(f"individual-{top}".encode('utf-8')).hexdigest(),
+                    'ceased': False,
+                    'notified_on': '2016-04-06',
+                    'natures_of_control': SYNTHETIC_NATURES_OF_CONTROL[0],
+                    'address': {'locality': 'London', 'country': 'England'},
+                })
+
+        self._names = {normalise_name(company['company_name']): number for number, company in self.companies.items()}
+
+    def filing_history(self, company_number):
+        """Returns synthetic filing history items for a company."""
+        return [
+            {
+                'category': 'accounts',
+                'type': 'AA',
+                'date': f"{2023 - i}-09-30",
+                'description': 'accounts-with-accounts-type-full',
+                'description_values': {'made_up_date': f"{2022 - i}-12-31"},
+                'transaction_id': f"{company_number}-{i}",
+                'links': {'document_metadata': f"/document/{company_number}-{i}"},
+            }
+            for i in range(self.filings)
+        ]
+
+    def get(self, endpoint, params=None):
+        """
+        Answers an API endpoint for the synthetic groups.
+
+        Raises:
+            ValueError: If the company doesn't exist.
+        """
+        self.simulate_latency()
+
+        match = COMPANY_ROUTE.match(endpoint)
+        if match:
+            company = self.companies.get(match.group('company_number'))
+            if company is None:
+                raise ValueError(f"Resource not found: {endpoint}")
+            return json.loads(json.dumps(company))
+
+        match = PSC_ROUTE.match(endpoint)
+        if match:
+            pscs = self.pscs.get(match.group('company_number'))
+            if pscs is None:
+                raise ValueError(f"Resource not found: {endpoint}")
+            return page_items(json.loads(json.dumps(pscs)), params)
+
+        match = FILING_HISTORY_ROUTE.match(endpoint)
+        if match:
+            company_number = match.group('company_number')
+            if company_number not in self.companies:
+                raise ValueError(f"Resource not found: {endpoint}")
+            return page_items(self.filing_history(company_number), params, total_key='total_count')
+
+        if SEARCH_ROUTE.match(endpoint):
+            params = params or {}
+            name = normalise_name(params.get('q') or params.get('company_name_includes', ''))
+            items = []
+            if name in self._names:
+                items.append(profile_to_search_item(self.companies[self._names[name]]))
+            return page_items(items, params)
+
+        raise ValueError(f"Resource not available: {endpoint}")
+
+
+def data_source_from_env(base_url, session):
+    """
+    Builds the data source selected by the CH_DATA_SOURCE environment variable.
+
+    'api' (the default) sends requests to base_url with session. Point CH_BASE_URL at
+    mock_server.py to use the local stand-in server.
+    'snapshot' reads from the SnapshotStore at CH_SNAPSHOT_DB.
+    'fixtures' replays responses recorded in CH_FIXTURES_DIR.
+    'synthetic' generates groups in memory, shaped by CH_SYNTHETIC_GROUPS, CH_SYNTHETIC_DEPTH,
+    CH_SYNTHETIC_FANOUT and CH_SYNTHETIC_OVERLAP.
+    CH_SOURCE_LATENCY adds a delay in seconds to every call answered by a local source.
+
+    Args:
+        base_url (str): The API root for the 'api' source.
+        session (requests.Session or transport.Transport): The authenticated client for the 'api' source.
+
+    Returns:
+        DataSource: The data source.
+
+    Raises:
+        ValueError: If the configuration is invalid.
+    """
+    source = os.getenv('CH_DATA_SOURCE', 'api').lower()
+    latency = float(os.getenv('CH_SOURCE_LATENCY', '0'))
+
+    if source == 'api':
+        return HttpDataSource(base_url, session)
+
+    if source == 'snapshot':
+        snapshot_db = os.getenv('CH_SNAPSHOT_DB')
+        if not snapshot_db:
+            raise ValueError("CH_SNAPSHOT_DB must be set when CH_DATA_SOURCE is 'snapshot'.")
+        logging.info(f"Answering API calls from snapshot store {snapshot_db}")
+        return SnapshotDataSource(SnapshotStore(snapshot_db), latency=latency)
+
+    if source == 'fixtures':
+        fixtures_dir = os.getenv('CH_FIXTURES_DIR')
+        if not fixtures_dir:
+            raise ValueError("CH_FIXTURES_DIR must be set when CH_DATA_SOURCE is 'fixtures'.")
+        logging.info(f"Answering API calls from fixtures in {fixtures_dir}")
+        return FixtureDataSource(fixtures_dir, latency=latency)
+
+    if source == 'synthetic':
+        return SyntheticDataSource(
+            groups=int(os.getenv('CH_SYNTHETIC_GROUPS', '1')),
+            depth=int(os.getenv('CH_SYNTHETIC_DEPTH', '3')),
+            fanout=int(os.getenv('CH_SYNTHETIC_FANOUT', '2')),
+            overlap=float(os.getenv('CH_SYNTHETIC_OVERLAP', '0')),
+            latency=latency,
+        )
+
+    raise ValueError(f"Unknown CH_DATA_SOURCE: {source}")
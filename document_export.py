@@ -0,0 +1,196 @@
+import os, io, re, csv, sys, logging, argparse, zipfile
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import scraper, utils
+
+# Filing histories read and documents downloaded at once. Every call shares scraper.rate_limiter,
+# so this only bounds how much work is in flight.
+EXPORT_MAX_WORKERS = int(os.getenv('EXPORT_MAX_WORKERS', '4'))
+
+MANIFEST_NAME = 'manifest.csv'
+MANIFEST_COLUMNS = ['company_number', 'company_name', 'date', 'category', 'description', 'label', 'file', 'error']
+
+
+def tree_companies(entity_data):
+    """
+    Lists the Companies House companies in a built tree, each once, root first. Non-UK entities,
+    whose company_id is only their PSC etag and which have no Companies House link, are left out.
+
+    Args:
+        entity_data (list): The tree, as returned by scraper.get_company_tree.
+
+    Returns:
+        dict: Company number to company name.
+    """
+    companies = {}
+    for entity in entity_data:
+        number = entity.get('company_id')
+        if number and entity.get('link') and number not in companies:
+            companies[number] = entity.get('company_name', '')
+    return companies
+
+
+def description_matcher(descriptions):
+    """
+    Turns filing description codes from filing_history_descriptions.yml into a test on filing items.
+    A code also matches the codes it prefixes, e.g. 'accounts-with-accounts-type' matches every type of accounts.
+
+    Args:
+        descriptions (list): Description codes or code prefixes, None to accept every filing.
+
+    Returns:
+        callable: Takes a filing item and returns whether it matches.
+
+    Raises:
+        ValueError: If a code matches nothing in filing_history_descriptions.yml.
+    """
+    if not descriptions:
+        return lambda item: True
+    descriptions = tuple(descriptions)
+    for code in descriptions:
+        if not any(known.startswith(code) for known in utils.DESCRIPTIONS_DICT):
+            raise ValueError(f"Unknown filing description code: {code}")
+    return lambda item: item.get('description', '').startswith(descriptions)
+
+
+def select_filings(company_number, category=None, descriptions=None, since=None, until=None, latest=None):
+    """
+    Picks the filings of a company that have a document, newest first. Filing history is paged
+    newest first, so no further pages are fetched once the filings are older than since or latest were found.
+
+    Args:
+        company_number (str): The company number.
+        category (str, optional): The filing category, e.g. 'accounts' or 'confirmation-statement'.
+        descriptions (list, optional): Description codes (or prefixes) to keep, see description_matcher.
+        since (str, optional): The earliest filing date to keep, as YYYY-MM-DD.
+        until (str, optional): The latest filing date to keep, as YYYY-MM-DD.
+        latest (int, optional): Keep at most this many filings.
+
+    Returns:
+        list: The selected filing history items.
+    """
+    matches = descriptions if callable(descriptions) else description_matcher(descriptions)
+    selected = []
+    with closing(scraper.iter_filing_history(company_number, category=category)) as filings:
+        for item in filings:
+            date = item.get('date', '')
+            if since and date and date < since:
+                break
+            if (until and date > until) or not item.get('links', {}).get('document_metadata') or not matches(item):
+                continue
+            selected.append(item)
+            if latest and len(selected) >= latest:
+                break
+    return selected
+
+
+def archive_name(company_number, company_name, item):
+    """Returns where a filing's document goes in the archive: one folder per company, named by date and description."""
+    def clean(text):
+        return re.sub(r'[^\w.-]+', '_', text).strip('_')
+
+    document_id = item['links']['document_metadata'].rstrip('/').rsplit('/', 1)[-1]
+    folder = clean(f"{company_number} {company_name}") or company_number
+    return f"{folder}/{item.get('date', 'undated')}_{clean(item.get('description', 'document'))}_{clean(document_id)}.pdf"
+
+
+def export_tree_documents(entity_data, out, category='accounts', descriptions=None, since=None, until=None, latest=1,
+                          max_workers=EXPORT_MAX_WORKERS):
+    """
+    Downloads the selected filing documents of every company in a tree into one zip archive.
+
+    Filing histories are read and documents downloaded concurrently, through the document store so
+    documents already downloaded are not fetched again. Each document is copied into the archive from
+    disk as soon as it is ready, so only the documents being downloaded are in flight and the archive
+    can be written to an unseekable stream. A manifest.csv listing every selected filing, and any
+    company or document that failed, is added last. Failures are logged and the export carries on.
+
+    Args:
+        entity_data (list): The tree, as returned by scraper.get_company_tree.
+        out (str or file): The archive path, or a writable binary file object.
+        category (str, optional): The filing category, None for every category.
+        descriptions (list, optional): Description codes (or prefixes) to keep.
+        since (str, optional): The earliest filing date to keep, as YYYY-MM-DD.
+        until (str, optional): The latest filing date to keep, as YYYY-MM-DD.
+        latest (int, optional): Filings kept per company, None or 0 for all.
+        max_workers (int, optional): Filing histories and documents fetched at once.
+
+    Returns:
+        dict: companies, documents (written to the archive) and failed (companies and documents).
+    """
+    companies = tree_companies(entity_data)
+    matches = description_matcher(descriptions)
+    manifest = []
+    summary = {'companies': len(companies), 'documents': 0, 'failed': 0}
+
+    def row(number, item=None, file='', error=''):
+        item = item or {}
+        description = item.get('description', '')
+        # Fill in the placeholders the filing gives values for, e.g. {made_up_date}
+        values = item.get('description_values', {})
+        label = re.sub(r'\{(\w+)\}', lambda m: str(values.get(m.group(1), m.group(0))), utils.DESCRIPTIONS_DICT.get(description, ''))
+        label = utils.clean_yaml_description(label).strip()
+        return {'company_number': number, 'company_name': companies[number], 'date': item.get('date', ''),
+                'category': item.get('category', ''), 'description': description, 'label': label, 'file': file, 'error': error}
+
+    # PDFs are already compressed, so they are stored as they are
+    with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_STORED) as archive, \
+            ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='export') as executor:
+        pending = {executor.submit(select_filings, number, category, matches, since, until, latest): (number, None)
+                   for number in companies}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                number, item = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logging.error(f"Failed to export {'document ' + item['links']['document_metadata'] if item else 'filings'} for {number}: {e}")
+                    summary['failed'] += 1
+                    manifest.append(row(number, item, error=str(e)))
+                    continue
+
+                if item is None:
+                    # The company's filings were selected, download their documents
+                    for filing in result:
+                        pending[executor.submit(scraper.get_document, filing['links']['document_metadata'])] = (number, filing)
+                    if not result:
+                        manifest.append(row(number, error='No matching filings'))
+                    continue
+
+                # Copied from the document store in chunks, never read whole into memory
+                name = archive_name(number, companies[number], item)
+                archive.write(result, name)
+                summary['documents'] += 1
+                manifest.append(row(number, item, file=name))
+
+        text = io.StringIO()
+        writer = csv.DictWriter(text, fieldnames=MANIFEST_COLUMNS)
+        writer.writeheader()
+        order = {number: index for index, number in enumerate(companies)}
+        writer.writerows(sorted(manifest, key=lambda entry: (order[entry['company_number']], entry['file'])))
+        archive.writestr(MANIFEST_NAME, text.getvalue())
+
+    logging.info(f"Exported {summary['documents']} documents for {summary['companies']} companies, {summary['failed']} failed")
+    return summary
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Download filing documents for every company in an ownership tree into one zip archive.")
+    parser.add_argument('company_number', help="The company number of the root company.")
+    parser.add_argument('--out', default='documents.zip', help="The archive to write, - for stdout.")
+    parser.add_argument('--category', default='accounts', help="The filing category, e.g. accounts or confirmation-statement. 'all' for every category.")
+    parser.add_argument('--description', action='append', help="A description code (or prefix) from filing_history_descriptions.yml. Repeat for several.")
+    parser.add_argument('--since', help="The earliest filing date, YYYY-MM-DD.")
+    parser.add_argument('--until', help="The latest filing date, YYYY-MM-DD.")
+    parser.add_argument('--latest', type=int, default=1, help="Filings per company, 0 for all.")
+    parser.add_argument('--workers', type=int, default=EXPORT_MAX_WORKERS, help="Filing histories and documents fetched at once.")
+    args = parser.parse_args()
+
+    tree = scraper.get_company_tree(args.company_number, concurrent=True, company_number=args.company_number, lazy=True)
+    summary = export_tree_documents(tree, sys.stdout.buffer if args.out == '-' else args.out,
+                                    category=None if args.category == 'all' else args.category, descriptions=args.description,
+                                    since=args.since, until=args.until, latest=args.latest, max_workers=args.workers)
+    logging.info(f"Wrote {summary['documents']} documents to {args.out}")
@@ -0,0 +1,186 @@
+import os, hashlib, logging, sqlite3, tempfile, threading, time
+
+# Fraction of the size cap to free when evicting, so a full store doesn't evict on every download
+EVICTION_HEADROOM = 0.1
+# Documents downloaded within this many seconds are never evicted, so a file isn't removed while it is being served
+EVICTION_GRACE = 60
+
+
+class DocumentStore:
+    """
+    Local store of downloaded filing documents, shared by every thread and process using the same directory.
+
+    Documents are streamed to disk and stored under the SHA-256 of their content, so the same file
+    filed under two document IDs is kept once. A SQLite index maps document IDs to their content and
+    tracks when each was last served. The total size is capped and the least recently served
+    documents are evicted first. Concurrent requests for the same document in one process wait for
+    the first download instead of repeating it.
+
+    Args:
+        directory (str): Where documents and the index are kept.
+        max_bytes (int, optional): The maximum total size of stored documents.
+    """
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+        os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(os.path.join(directory, 'index.sqlite3'), timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                document_id TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS documents_last_access ON documents (last_access)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS documents_digest ON documents (digest)")
+
+    def path_for(self, digest):
+        """Returns where the content with a digest is stored."""
+        return os.path.join(self.directory, digest[:2], f"{digest}.pdf")
+
+    def get(self, document_id):
+        """
+        Looks up a stored document.
+
+        Args:
+            document_id (str): The document metadata ID.
+
+        Returns:
+            str: The path of the stored file, or None if it isn't stored.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT digest FROM documents WHERE document_id = ?", (document_id,)).fetchone()
+            if row and os.path.exists(self.path_for(row[0])):
+                self._conn.execute("UPDATE documents SET last_access = ? WHERE document_id = ?", (time.time(), document_id))
+                self._counters['hits'] += 1
+                return self.path_for(row[0])
+            if row:
+                # The file was removed from under the index, e.g. by another process evicting it
+                self._conn.execute("DELETE FROM documents WHERE document_id = ?", (document_id,))
+            self._counters['misses'] += 1
+            return None
+
+    def put(self, document_id, chunks):
+        """
+        Streams a document into the store.
+
+        Args:
+            document_id (str): The document metadata ID.
+            chunks (iterable): The document's content as bytes chunks.
+
+        Returns:
+            str: The path of the stored file.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                for chunk in chunks:
+                    if chunk:
+                        f.write(chunk)
+                        digest.update(chunk)
+                        size += len(chunk)
+            path = self.path_for(digest.hexdigest())
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Identical content from another download lands on the same path, so replacing it is harmless
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents (document_id, digest, size, stored_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (document_id, digest.hexdigest(), size, now, now)
+            )
+            self._evict()
+        logging.info(f"Stored document {document_id} ({size} bytes) as {digest.hexdigest()}")
+        return path
+
+    def fetch(self, document_id, download):
+        """
+        Returns a stored document, downloading it the first time.
+
+        Args:
+            document_id (str): The document metadata ID.
+            download (callable): Called with no arguments to get the content as an iterable of bytes chunks.
+
+        Returns:
+            str: The path of the stored file.
+        """
+        while True:
+            path = self.get(document_id)
+            if path is not None:
+                return path
+
+            with self._lock:
+                event = self._in_flight.get(document_id)
+                owner = event is None
+                if owner:
+                    event = self._in_flight[document_id] = threading.Event()
+
+            if not owner:
+                # Another thread is downloading it, wait and look again
+                event.wait()
+                continue
+
+            try:
+                return self.put(document_id, download())
+            finally:
+                with self._lock:
+                    del self._in_flight[document_id]
+                event.set()
+
+    def _evict(self):
+        """
+        Deletes the least recently served documents until the store is under its size cap.
+        Content shared with a document that is kept stays on disk. Expects the lock to be held.
+        """
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT digest, size FROM documents)").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        target = self.max_bytes * (1 - EVICTION_HEADROOM)
+        cutoff = time.time() - EVICTION_GRACE
+        evicted = 0
+        for document_id, digest, size in self._conn.execute(
+                "SELECT document_id, digest, size FROM documents WHERE last_access < ? ORDER BY last_access", (cutoff,)).fetchall():
+            if total <= target:
+                break
+            self._conn.execute("DELETE FROM documents WHERE document_id = ?", (document_id,))
+            evicted += 1
+            if self._conn.execute("SELECT 1 FROM documents WHERE digest = ?", (digest,)).fetchone():
+                continue
+            try:
+                os.remove(self.path_for(digest))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        self._counters['evictions'] += evicted
+        logging.info(f"Evicted {evicted} documents from {self.directory}")
+
+    def stats(self):
+        """
+        Returns the hit/miss counters for this process along with the current size of the store.
+
+        Returns:
+            dict: hits, misses, evictions, documents and bytes.
+        """
+        with self._lock:
+            documents = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT digest, size FROM documents)").fetchone()[0]
+            return dict(self._counters, documents=documents, bytes=total)
@@ -0,0 +1,389 @@
+import sys
+from array import array
+import numpy as np
+import networkx as nx
+import utils
+
+# Code 0 in every attribute column means the node or edge doesn't have that attribute,
+# which _Column.get reports as _ABSENT_VALUE
+_ABSENT = 0
+_ABSENT_VALUE = object()
+
+
+class _Column:
+    """
+    One attribute across all nodes (or edges), stored as integer codes into a table of distinct
+    values. Repeated values such as natures of control, dates and node types are stored once.
+    List values are stored as tuples so they can be interned, and handed back as lists.
+    """
+
+    def __init__(self):
+        self.values = [None]
+        self.codes = array('I')
+        self.lists = False
+        self._lookup = {}
+
+    def set(self, index, value):
+        if isinstance(value, list):
+            self.lists = True
+            value = tuple(value)
+        try:
+            code = self._lookup[value]
+        except KeyError:
+            code = self._lookup[value] = len(self.values)
+            self.values.append(value)
+        except TypeError:
+            # Unhashable values (e.g. dicts) are stored without interning
+            code = len(self.values)
+            self.values.append(value)
+
+        if index >= len(self.codes):
+            self.codes.extend([_ABSENT] * (index + 1 - len(self.codes)))
+        self.codes[index] = code
+
+    def freeze(self, size):
+        """Converts the codes to a NumPy array of the smallest integer type and drops the lookup."""
+        codes = np.zeros(size, dtype=np.min_scalar_type(max(len(self.values) - 1, 1)))
+        codes[:len(self.codes)] = np.array(self.codes, dtype=np.uint32)
+        self.codes = codes
+        self._lookup = None
+        return self
+
+    def get(self, index):
+        code = self.codes[index]
+        if code == _ABSENT:
+            return _ABSENT_VALUE
+        value = self.values[code]
+        return list(value) if self.lists and isinstance(value, tuple) else value
+
+
+class CompactGraphBuilder:
+    """
+    Collects nodes and edges with the same semantics as networkx.Graph.add_node and add_edge
+    (attributes of repeated nodes and edges are updated), then builds a CompactGraph.
+    """
+
+    def __init__(self):
+        self._node_ids = {}
+        self._node_columns = {}
+        self._edge_ids = {}
+        self._edge_columns = {}
+
+    def add_node(self, node, **attributes):
+        node_id = self._node_ids.setdefault(node, len(self._node_ids))
+        for key, value in attributes.items():
+            column = self._node_columns.get(key)
+            if column is None:
+                column = self._node_columns[key] = _Column()
+            column.set(node_id, value)
+        return node_id
+
+    def add_edge(self, source, target, **attributes):
+        edge_id = self._edge_ids.setdefault((self.add_node(source), self.add_node(target)), len(self._edge_ids))
+        for name, value in attributes.items():
+            column = self._edge_columns.get(name)
+            if column is None:
+                column = self._edge_columns[name] = _Column()
+            column.set(edge_id, value)
+
+    def add_items(self, items):
+        """Adds the ('node', ...) and ('edge', ...) tuples of utils.iter_interlock_network."""
+        for item in items:
+            if item[0] == 'node':
+                self.add_node(item[1], **item[2])
+            else:
+                self.add_edge(item[1], item[2], **item[3])
+        return self
+
+    def build(self):
+        """Returns the CompactGraph. The builder shouldn't be used afterwards."""
+        node_count, edge_count = len(self._node_ids), len(self._edge_ids)
+        edges = np.array(list(self._edge_ids), dtype=np.int32).reshape(edge_count, 2)
+        # Dict order is insertion order, so nodes and edges keep the order they were added in
+        names = list(self._node_ids)
+        edge_ids = np.arange(edge_count, dtype=np.int32)
+
+        def csr(rows, columns):
+            # Neighbours are kept in the order their edges were added, which is the order networkx iterates them in
+            order = np.lexsort((edge_ids, rows))
+            indptr = np.zeros(node_count + 1, dtype=np.int64)
+            np.cumsum(np.bincount(rows, minlength=node_count), out=indptr[1:])
+            return indptr, columns[order], edge_ids[order]
+
+        graph = CompactGraph(
+            names=names,
+            node_columns={key: column.freeze(node_count) for key, column in self._node_columns.items()},
+            edges=edges,
+            edge_columns={key: column.freeze(edge_count) for key, column in self._edge_columns.items()},
+            successors=csr(edges[:, 0], edges[:, 1]),
+            predecessors=csr(edges[:, 1], edges[:, 0]),
+        )
+        self._node_ids = self._node_columns = self._edge_ids = self._edge_columns = None
+        return graph
+
+
+class CompactGraph:
+    """
+    A read-only directed graph with integer node IDs, CSR adjacency in NumPy arrays and columnar,
+    interned attributes, for merged ownership graphs too large to hold as a networkx.DiGraph.
+
+    It implements the parts of the networkx.DiGraph API used by this app (nodes, edges, degrees,
+    successors, predecessors and attribute lookup), so utils.create_cytoscape_elements and
+    utils.calculate_network_metrics accept it unchanged. Use to_networkx() for networkx algorithms.
+    Attribute dicts are built on access, so changing them doesn't change the graph.
+
+    Args:
+        names (list): Node names, indexed by node ID.
+        node_columns (dict): Attribute name to _Column over node IDs.
+        edges (numpy.ndarray): (source ID, target ID) rows, indexed by edge ID.
+        edge_columns (dict): Attribute name to _Column over edge IDs.
+        successors (tuple): (indptr, node IDs, edge IDs) CSR arrays of outgoing edges.
+        predecessors (tuple): The same for incoming edges.
+    """
+
+    def __init__(self, names, node_columns, edges, edge_columns, successors, predecessors):
+        # Graph-level attributes, like networkx's G.graph
+        self.graph = {}
+        self._names = names
+        self._id_lookup = None
+        self._node_columns = node_columns
+        self._edges = edges
+        self._edge_columns = edge_columns
+        self.indptr, self.indices, self._out_edges = successors
+        self.in_indptr, self.in_indices, self._in_edges = predecessors
+
+    @classmethod
+    def from_networkx(cls, graph):
+        """Builds a CompactGraph from a networkx graph. Undirected edges keep the direction networkx reports them in."""
+        builder = CompactGraphBuilder()
+        for node, data in graph.nodes(data=True):
+            builder.add_node(node, **data)
+        for source, target, data in graph.edges(data=True):
+            builder.add_edge(source, target, **data)
+        return builder.build()
+
+    def to_networkx(self):
+        """Returns the graph as a networkx.DiGraph."""
+        graph = nx.DiGraph()
+        graph.add_nodes_from(self.nodes(data=True))
+        graph.add_edges_from(self.edges(data=True))
+        return graph
+
+    @property
+    def _ids(self):
+        # Only built once a node is looked up by name, iterating the graph doesn't need it
+        if self._id_lookup is None:
+            self._id_lookup = {name: node_id for node_id, name in enumerate(self._names)}
+        return self._id_lookup
+
+    # Node and edge access
+
+    def node_id(self, node):
+        """Returns the integer ID of a node, raising KeyError if it isn't in the graph."""
+        return self._ids[node]
+
+    def node_name(self, node_id):
+        return self._names[node_id]
+
+    def node_names(self):
+        """Returns the node names, indexed by node ID."""
+        return self._names
+
+    def edge_array(self):
+        """Returns the (source ID, target ID) rows of every edge as a NumPy array."""
+        return self._edges
+
+    def node_attributes(self, node_id):
+        attributes = {}
+        for key, column in self._node_columns.items():
+            value = column.get(node_id)
+            if value is not _ABSENT_VALUE:
+                attributes[key] = value
+        return attributes
+
+    def edge_attributes(self, edge_id):
+        attributes = {}
+        for key, column in self._edge_columns.items():
+            value = column.get(edge_id)
+            if value is not _ABSENT_VALUE:
+                attributes[key] = value
+        return attributes
+
+    def successor_ids(self, node_id):
+        """Returns the IDs of the nodes a node has edges to, as a NumPy array."""
+        return self.indices[self.indptr[node_id]:self.indptr[node_id + 1]]
+
+    def predecessor_ids(self, node_id):
+        """Returns the IDs of the nodes with edges to a node, as a NumPy array."""
+        return self.in_indices[self.in_indptr[node_id]:self.in_indptr[node_id + 1]]
+
+    def out_degrees(self):
+        """Returns the out-degree of every node as a NumPy array indexed by node ID."""
+        return np.diff(self.indptr)
+
+    def in_degrees(self):
+        """Returns the in-degree of every node as a NumPy array indexed by node ID."""
+        return np.diff(self.in_indptr)
+
+    def degrees(self):
+        """Returns the degree (in plus out) of every node as a NumPy array indexed by node ID."""
+        return self.out_degrees() + self.in_degrees()
+
+    @property
+    def nodes(self):
+        return _NodeView(self)
+
+    @property
+    def edges(self):
+        return _EdgeView(self)
+
+    @property
+    def degree(self):
+        return _DegreeView(self, self.indptr, self.in_indptr)
+
+    @property
+    def in_degree(self):
+        return _DegreeView(self, self.in_indptr)
+
+    @property
+    def out_degree(self):
+        return _DegreeView(self, self.indptr)
+
+    @property
+    def adj(self):
+        return {node: self[node] for node in self._names}
+
+    succ = adj
+
+    def successors(self, node):
+        return iter([self._names[successor] for successor in self.successor_ids(self._ids[node])])
+
+    neighbors = successors
+
+    def predecessors(self, node):
+        return iter([self._names[predecessor] for predecessor in self.predecessor_ids(self._ids[node])])
+
+    def __getitem__(self, node):
+        node_id = self._ids[node]
+        start, end = self.indptr[node_id], self.indptr[node_id + 1]
+        return {self._names[successor]: self.edge_attributes(edge_id)
+                for successor, edge_id in zip(self.indices[start:end], self._out_edges[start:end])}
+
+    def has_node(self, node):
+        return node in self._ids
+
+    def has_edge(self, source, target):
+        if source not in self._ids or target not in self._ids:
+            return False
+        return bool(np.any(self.successor_ids(self._ids[source]) == self._ids[target]))
+
+    def number_of_nodes(self):
+        return len(self._names)
+
+    def number_of_edges(self):
+        return len(self._edges)
+
+    def is_directed(self):
+        return True
+
+    def is_multigraph(self):
+        return False
+
+    def __len__(self):
+        return len(self._names)
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __contains__(self, node):
+        return node in self._ids
+
+    def nbytes(self):
+        """Approximate memory held by the arrays and attribute tables, excluding shared strings."""
+        arrays = [self._edges, self.indptr, self.indices, self._out_edges, self.in_indptr, self.in_indices, self._in_edges]
+        arrays += [column.codes for column in self._node_columns.values()]
+        arrays += [column.codes for column in self._edge_columns.values()]
+        tables = sum(sys.getsizeof(column.values) for column in (*self._node_columns.values(), *self._edge_columns.values()))
+        return sum(a.nbytes for a in arrays) + tables + sys.getsizeof(self._names) + sys.getsizeof(self._id_lookup)
+
+
+class _NodeView:
+    """Supports graph.nodes, graph.nodes(data=True) and graph.nodes[node] like networkx."""
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __call__(self, data=False):
+        if not data:
+            return iter(self._graph._names)
+        return ((name, self._graph.node_attributes(node_id)) for node_id, name in enumerate(self._graph._names))
+
+    def __getitem__(self, node):
+        return self._graph.node_attributes(self._graph._ids[node])
+
+    def __iter__(self):
+        return iter(self._graph._names)
+
+    def __len__(self):
+        return len(self._graph._names)
+
+    def __contains__(self, node):
+        return node in self._graph._ids
+
+
+class _EdgeView:
+    """Supports graph.edges and graph.edges(data=True) like networkx."""
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __call__(self, data=False):
+        graph, names = self._graph, self._graph._names
+        # Walk the successors of each node in turn, like networkx does
+        sources = np.repeat(np.arange(len(names)), graph.out_degrees()).tolist()
+        targets, edge_ids = graph.indices.tolist(), graph._out_edges.tolist()
+        if not data:
+            return ((names[source], names[target]) for source, target in zip(sources, targets))
+        return ((names[source], names[target], graph.edge_attributes(edge_id))
+                for source, target, edge_id in zip(sources, targets, edge_ids))
+
+    def __iter__(self):
+        return self()
+
+    def __len__(self):
+        return len(self._graph._edges)
+
+
+class _DegreeView:
+    """Supports graph.degree[node] and iterating (node, degree) pairs like networkx."""
+
+    def __init__(self, graph, *indptrs):
+        self._graph = graph
+        self._indptrs = indptrs
+
+    def __getitem__(self, node):
+        node_id = self._graph._ids[node]
+        return int(sum(indptr[node_id + 1] - indptr[node_id] for indptr in self._indptrs))
+
+    def __iter__(self):
+        return zip(self._graph._names, sum(np.diff(indptr) for indptr in self._indptrs).tolist())
+
+    def __len__(self):
+        return len(self._graph._names)
+
+
+def create_compact_network(*entity_data_lists):
+    """
+    Builds the interlock network as a CompactGraph, with the same nodes, edges and attributes as
+    utils.create_interlock_network. Several entity lists are merged into one graph.
+
+    Args:
+        *entity_data_lists (list): Entity lists, as returned by scraper.get_company_tree.
+
+    Returns:
+        CompactGraph: The network.
+    """
+    builder = CompactGraphBuilder()
+    for entity_data in entity_data_lists:
+        builder.add_items(utils.iter_interlock_network(entity_data))
+    return builder.build()
@@ -0,0 +1,148 @@
+import os, time, uuid, logging, threading
+from concurrent.futures import ThreadPoolExecutor
+import scraper
+
+# Tree builds run at once. Each also expands its frontier on TREE_MAX_WORKERS threads and every
+# call shares scraper.rate_limiter, so this bounds how many users are served concurrently.
+JOB_MAX_WORKERS = int(os.getenv('JOB_MAX_WORKERS', '4'))
+# Seconds a finished job is kept for its result to be collected
+JOB_RETENTION = int(os.getenv('JOB_RETENTION', '600'))
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class Job:
+    """
+    A tree build submitted to a JobQueue.
+
+    Attributes:
+        id (str): The job ID, passed to the UI to poll with.
+        key (str): What is being built, e.g. the company number. Jobs for the same key are shared.
+        status (str): queued, running, done, failed or cancelled.
+        progress (scraper.TreeProgress): Updated by the build, also used to cancel it.
+        result: The build's return value once done.
+        error (str): The failure message once failed.
+    """
+
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = QUEUED
+        self.progress = scraper.TreeProgress()
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.finished_at = None
+
+    def snapshot(self):
+        """Returns the job's status and progress as a dict, e.g. to render in the UI."""
+        return dict(self.progress.snapshot(), id=self.id, key=self.key, status=self.status, error=self.error,
+                    elapsed=round((self.finished_at or time.time()) - self.submitted_at, 1))
+
+
+class JobQueue:
+    """
+    Runs tree builds in the background on a thread pool, so a request only submits a build and the
+    UI polls for its progress. Threads rather than processes keep one rate limit budget, entity
+    cache and response cache for every build without an external broker. A job submitted while an
+    identical one is queued or running gets the existing job.
+
+    Jobs live in this process, so poll from the process that submitted them. With several worker
+    processes, the finished trees are shared through tree_cache instead.
+
+    Args:
+        max_workers (int, optional): Builds run at once, the rest are queued.
+        retention (float, optional): Seconds a finished job is kept.
+    """
+
+    def __init__(self, max_workers=JOB_MAX_WORKERS, retention=JOB_RETENTION):
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tree-job')
+        self._jobs = {}
+        self._in_flight = {}  # key -> job queued or running
+        self._lock = threading.Lock()
+
+    def submit(self, key, function, *args, **kwargs):
+        """
+        Queues function(*args, progress=job.progress, **kwargs), unless a job for key is already in flight.
+
+        Args:
+            key (str): What is being built, e.g. the company number.
+            function (callable): The build. It must accept a progress keyword, see scraper.get_company_tree.
+
+        Returns:
+            Job: The new job, or the in-flight job for the same key.
+        """
+        with self._lock:
+            self._prune()
+            job = self._in_flight.get(key)
+            if job is not None:
+                logging.info(f"Joining job {job.id} already building {key}")
+                return job
+            job = Job(key)
+            self._jobs[job.id] = job
+            self._in_flight[key] = job
+
+        self._executor.submit(self._run, job, function, args, kwargs)
+        logging.info(f"Queued job {job.id} for {key}")
+        return job
+
+    def _run(self, job, function, args, kwargs):
+        if job.progress.cancelled.is_set():
+            self._finish(job, CANCELLED)
+            return
+        job.status = RUNNING
+        try:
+            job.result = function(*args, progress=job.progress, **kwargs)
+            self._finish(job, DONE)
+        except scraper.TreeBuildCancelled:
+            self._finish(job, CANCELLED)
+        except Exception as e:
+            logging.error(f"Job {job.id} for {job.key} failed: {e}")
+            job.error = str(e)
+            self._finish(job, FAILED)
+
+    def _finish(self, job, status):
+        with self._lock:
+            job.status = status
+            job.finished_at = time.time()
+            if self._in_flight.get(job.key) is job:
+                del self._in_flight[job.key]
+        logging.info(f"Job {job.id} for {job.key} {status} after {job.finished_at - job.submitted_at:.1f}s")
+
+    def get(self, job_id):
+        """Returns a job, or None if it is unknown or was pruned."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancels a job. A queued job never starts, a running build stops at its next entity or API call.
+
+        Returns:
+            bool: Whether the job was still in flight.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in FINISHED:
+                return False
+            job.progress.cancelled.set()
+            # A new request for the same company starts a fresh build rather than joining this one
+            if self._in_flight.get(job.key) is job:
+                del self._in_flight[job.key]
+        return True
+
+    def _prune(self):
+        """Drops finished jobs older than the retention period. Expects the lock to be held."""
+        cutoff = time.time() - self.retention
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished_at and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def shutdown(self, cancel=True):
+        """Stops the worker threads, cancelling running builds unless cancel is False."""
+        if cancel:
+            with self._lock:
+                for job in self._jobs.values():
+                    job.progress.cancelled.set()
+        self._executor.shutdown(wait=True, cancel_futures=cancel)
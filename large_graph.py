@@ -0,0 +1,210 @@
+import os, logging
+import numpy as np
+import utils
+from analytics import graph_arrays, control_depths
+
+# Graphs with more elements (nodes plus edges) than this are drawn in large-graph mode:
+# precomputed positions with the 'preset' layout, collapsed subtrees and slim elements
+LARGE_GRAPH_THRESHOLD = int(os.getenv('LARGE_GRAPH_THRESHOLD', '2000'))
+# Elements drawn at first in large-graph mode, the rest are collapsed into cluster nodes
+LARGE_GRAPH_MAX_ELEMENTS = int(os.getenv('LARGE_GRAPH_MAX_ELEMENTS', '1500'))
+# Companies revealed each time a cluster node is expanded
+LARGE_GRAPH_EXPAND_NODES = int(os.getenv('LARGE_GRAPH_EXPAND_NODES', '300'))
+# Distance between layers of the ownership chain, and between neighbours within a layer
+LAYER_SPACING = 150
+NODE_SPACING = 80
+
+CLUSTER_PREFIX = 'cluster:'
+PRESET_LAYOUT = {'name': 'preset', 'fit': True}
+
+
+def is_large(graph, threshold=LARGE_GRAPH_THRESHOLD):
+    """Whether a graph is too big to draw in full with a force-directed layout."""
+    return graph.number_of_nodes() + graph.number_of_edges() > threshold
+
+
+class _Prepared:
+    """A graph's edge arrays, layered layout and drawing order, computed once per graph."""
+
+    def __init__(self, graph):
+        self.names, self.sources, self.targets = graph_arrays(graph)
+        self.ids = {name: node_id for node_id, name in enumerate(self.names)}
+        n = len(self.names)
+        self.depth = control_depths(n, self.sources, self.targets)
+        # Nodes only reachable through cycles sit above everything else
+        self.depth[self.depth < 0] = self.depth.max() + 1 if n else 0
+        self.x = self._layer_positions(n)
+        self.y = -self.depth * float(LAYER_SPACING)
+        # Nodes are revealed bottom up, left to right
+        self.order = np.lexsort((self.x, self.depth))
+        self.rank = np.empty(n, dtype=np.int64)
+        self.rank[self.order] = np.arange(n)
+
+    def _layer_positions(self, n):
+        """
+        Spreads each layer out horizontally, ordering every node by the mean position of the companies
+        it controls in the layers below (the barycenter heuristic), so edges mostly don't cross.
+        """
+        x = np.zeros(n)
+        if n == 0:
+            return x
+        for level in range(int(self.depth.max()) + 1):
+            layer = np.flatnonzero(self.depth == level)
+            placed = (self.depth[self.sources] == level) & (self.depth[self.targets] < level)
+            totals = np.bincount(self.sources[placed], weights=x[self.targets[placed]], minlength=n)[layer]
+            counts = np.bincount(self.sources[placed], minlength=n)[layer]
+            key = np.divide(totals, counts, out=np.zeros(len(layer)), where=counts > 0)
+            ranks = np.argsort(np.argsort(key, kind='stable'), kind='stable')
+            x[layer] = (ranks - (len(layer) - 1) / 2) * NODE_SPACING
+        return x
+
+    def position(self, node_id):
+        return {'x': round(float(self.x[node_id]), 1), 'y': round(float(self.y[node_id]), 1)}
+
+
+def prepare(graph):
+    """
+    Returns the layout and drawing order for a graph, computing them the first time only. They
+    are stored on the graph (graph.graph['large_graph']), like the analytics.
+    """
+    prepared = graph.graph.get('large_graph')
+    if prepared is None:
+        prepared = graph.graph['large_graph'] = _Prepared(graph)
+    return prepared
+
+
+def get_layout(graph):
+    """
+    Returns server-side positions for every node: a layered layout with the companies that control
+    nothing at the bottom and their controllers above.
+
+    Args:
+        graph (networkx.DiGraph or CompactGraph): The ownership graph.
+
+    Returns:
+        dict: Node to {'x', 'y'}, as Cytoscape's 'preset' layout expects.
+    """
+    prepared = prepare(graph)
+    return {name: prepared.position(node_id) for node_id, name in enumerate(prepared.names)}
+
+
+def initial_visible(graph, max_elements=LARGE_GRAPH_MAX_ELEMENTS):
+    """
+    Picks the nodes drawn first: the bottom layers of the graph, as many as fit in max_elements
+    together with their edges and the cluster nodes standing in for everything above them.
+
+    Returns:
+        set: The visible nodes.
+    """
+    prepared = prepare(graph)
+    n = len(prepared.names)
+    if n == 0:
+        return set()
+    # An edge appears once both its ends are visible
+    edges_by_rank = np.bincount(np.maximum(prepared.rank[prepared.sources], prepared.rank[prepared.targets]), minlength=n)
+    visible_nodes = np.arange(1, n + 1)
+    # Each visible node may also need a cluster node and its edge
+    cost = 3 * visible_nodes + np.cumsum(edges_by_rank)
+    count = max(1, int(np.searchsorted(cost, max_elements, side='right')))
+    return {prepared.names[node_id] for node_id in prepared.order[:count]}
+
+
+def expand_cluster(graph, visible, cluster_of, max_nodes=LARGE_GRAPH_EXPAND_NODES):
+    """
+    Reveals the next companies collapsed into a cluster node, closest to the cluster's company first.
+
+    Args:
+        graph (networkx.DiGraph or CompactGraph): The ownership graph.
+        visible (set): The nodes drawn now.
+        cluster_of (str): The visible node whose cluster is expanded.
+        max_nodes (int, optional): Companies to reveal.
+
+    Returns:
+        set: The visible nodes after expanding.
+    """
+    prepared = prepare(graph)
+    owners = _cluster_owners(prepared, visible)
+    members = np.flatnonzero(owners == prepared.ids[cluster_of])
+    members = members[np.argsort(prepared.rank[members], kind='stable')][:max_nodes]
+    return set(visible) | {prepared.names[node_id] for node_id in members}
+
+
+def _cluster_owners(prepared, visible):
+    """
+    Assigns every hidden node to the visible node its cluster hangs from, by spreading ownership up
+    from the visible nodes to their hidden controllers. Visible nodes own themselves, hidden nodes
+    not connected to anything visible are left at -1.
+    """
+    n = len(prepared.names)
+    owners = np.full(n, -1)
+    visible_ids = np.array([prepared.ids[node] for node in visible if node in prepared.ids], dtype=np.int64)
+    owners[visible_ids] = visible_ids
+    while True:
+        spreading = (owners[prepared.targets] >= 0) & (owners[prepared.sources] < 0)
+        if not spreading.any():
+            return owners
+        owners[prepared.sources[spreading]] = owners[prepared.targets[spreading]]
+
+
+def lod_elements(graph, search_company, visible=None, max_elements=LARGE_GRAPH_MAX_ELEMENTS):
+    """
+    Converts a large graph into slim Cytoscape elements with preset positions, drawing only the
+    visible nodes and collapsing everything above them into one cluster node per visible node.
+    Previous names and accounts are left out, they are fetched when a node is tapped.
+
+    Args:
+        graph (networkx.DiGraph or CompactGraph): The ownership graph.
+        search_company (str): The name of the company to highlight in the graph.
+        visible (set, optional): The nodes to draw, defaults to initial_visible.
+        max_elements (int, optional): The budget for initial_visible.
+
+    Returns:
+        list: Cytoscape elements, to draw with PRESET_LAYOUT. Cluster nodes have the 'cluster' class,
+            and cluster (the node they hang from) and size in their data.
+    """
+    prepared = prepare(graph)
+    if visible is None:
+        visible = initial_visible(graph, max_elements)
+    search_company_normalised = utils.normalise_company_name(search_company)
+    owners = _cluster_owners(prepared, visible)
+    visible_ids = np.array([prepared.ids[node] for node in visible if node in prepared.ids], dtype=np.int64)
+    visible_ids = visible_ids[np.argsort(prepared.rank[visible_ids], kind='stable')]
+
+    elements = []
+    for node_id in visible_ids:
+        node = prepared.names[node_id]
+        attributes = graph.nodes[node]
+        element = utils.cytoscape_node(node, attributes, search_company_normalised)
+        element['data'] = {key: element['data'][key] for key in ('id', 'label', 'number', 'link')}
+        element['position'] = prepared.position(node_id)
+        elements.append(element)
+
+    shown = (owners[prepared.sources] == prepared.sources) & (owners[prepared.targets] == prepared.targets)
+    for source, target in zip(prepared.sources[shown], prepared.targets[shown]):
+        source, target = prepared.names[source], prepared.names[target]
+        elements.append(utils.cytoscape_edge(source, target, graph[source][target]))
+
+    # One cluster per visible node with hidden controllers, drawn just above it
+    hidden_ids = np.flatnonzero((owners != np.arange(len(prepared.names))) & (owners >= 0))
+    if len(hidden_ids):
+        cluster_owners, sizes = np.unique(owners[hidden_ids], return_counts=True)
+        for owner, size in zip(cluster_owners, sizes):
+            node = prepared.names[owner]
+            position = prepared.position(owner)
+            elements.append({
+                'data': {'id': CLUSTER_PREFIX + node, 'label': f"+{size} companies", 'cluster': node, 'size': int(size)},
+                'position': {'x': position['x'], 'y': position['y'] - LAYER_SPACING / 2},
+                'classes': 'cluster'
+            })
+            elements.append({'data': {'source': CLUSTER_PREFIX + node, 'target': node, 'nature_of_control': ''}, 'classes': 'cluster'})
+
+    unreachable = int(np.count_nonzero(owners < 0))
+    if unreachable:
+        logging.info(f"{unreachable} nodes in groups with nothing visible are not drawn")
+    return elements
+
+
+def visible_nodes(elements):
+    """Returns the graph nodes drawn in a list of large-graph elements, leaving out cluster nodes."""
+    return {element['data']['id'] for element in elements
+            if 'source' not in element['data'] and 'cluster' not in element['data']}
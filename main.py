@@ -4,7 +4,7 @@ import dash_bootstrap_components as dbc
 import dash_cytoscape as cyto
 import logging
 import os
-from callbacks import register_callbacks, register_cytoscape_callbacks
+from callbacks import register_callbacks, register_cytoscape_callbacks, JOB_POLL_INTERVAL_MS
 
 app = dash.Dash(__name__)
 
@@ -28,7 +28,9 @@ cytoscape_container = html.Div(
                 {'selector': '.company', 'style': {'background-color': 'red'}},
                 {'selector': '.entity', 'style': {'background-color': 'green'}},
                 {'selector': '.search-company', 'style': {'background-color': 'blue'}},
-                {'selector': 'edge', 'style': {'line-color': '#ccc'}},
+                {'selector': '.incomplete', 'style': {'border-width': 3, 'border-color': 'orange', 'border-style': 'dashed'}},
+                {'selector': '.cluster', 'style': {'background-color': '#999', 'shape': 'round-rectangle', 'line-style': 'dashed'}},
+                {'selector': 'edge', 'style': {'line-color': '#ccc', 'curve-style': 'bezier', 'target-arrow-shape': 'triangle'}},
                 {'selector': '.highlighted', 'style': {'background-color': '#FFD700', 'line-color': '#FFD700', 'width': 3}},
                 {'selector': '.ownership-of-shares', 'style': {'line-color': 'red'}},
                 {'selector': '.voting-rights', 'style': {'line-color': 'blue'}},
@@ -141,6 +143,17 @@ app.layout = html.Div(
                         ]
                     ),
                     html.Div(id='message', style={'padding': '20px', 'border': '1px solid #ccc', 'margin-top': '20px', 'display': 'none'}),
+                    # Progress of the background tree build, polled while it runs
+                    html.Div(
+                        [
+                            html.Span(id='job-progress'),
+                            html.Button("Cancel", id='cancel-job-button', n_clicks=0, style={'margin-left': '10px'}),
+                        ],
+                        id='job-status',
+                        style={'display': 'none'}
+                    ),
+                    dcc.Store(id='tree-job'),
+                    dcc.Interval(id='job-poll', interval=JOB_POLL_INTERVAL_MS, disabled=True),
                     html.Div(id='dummy-output', style={'display': 'none'}),
 
                     
@@ -0,0 +1,158 @@
+import json, time, logging, argparse, threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+from data_sources import SyntheticDataSource
+
+
+class MockCompaniesHouseServer:
+    """
+    A local stand-in for the Companies House API. Serves any local DataSource (usually a
+    SyntheticDataSource) over HTTP, so traversal throughput and rate-limit behaviour can be measured
+    without network access. Point the scraper at it with CH_BASE_URL=server.url.
+
+    Args:
+        source (DataSource): The local data source answering the requests.
+        host (str, optional): The host to bind to.
+        port (int, optional): The port to bind to, 0 picks a free port.
+        latency (float, optional): Seconds to sleep before answering each request.
+        rate_limit (int, optional): Answer 429 once this many requests have been made in the window.
+        time_window (float, optional): The rate limit window in seconds.
+    """
+
+    def __init__(self, source, host='127.0.0.1', port=0, latency=0.0, rate_limit=None, time_window=300):
+        self.source = source
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.time_window = time_window
+        self.request_count = 0
+        self.rate_limited_count = 0
+        self._timestamps = deque()
+        self._lock = threading.Lock()
+        self._thread = None
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.handle(self)
+
+            def log_message(self, format, *args):
+                logging.debug(format % args)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        """The base URL of the server, ending in '/'."""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def _check_rate_limit(self):
+        """Records a request, returning the Retry-After seconds if it is over the limit, else None."""
+        with self._lock:
+            self.request_count += 1
+            if not self.rate_limit:
+                return None
+
+            now = time.time()
+            while self._timestamps and now - self._timestamps[0] >= self.time_window:
+                self._timestamps.popleft()
+
+            if len(self._timestamps) >= self.rate_limit:
+                self.rate_limited_count += 1
+                return self._timestamps[0] + self.time_window - now
+
+            self._timestamps.append(now)
+            return None
+
+    def _respond(self, handler, status, body=None, headers=None):
+        payload = json.dumps(body).encode('utf-8') if body is not None else b''
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+    def handle(self, handler):
+        """Answers one request from the data source."""
+        if self.latency:
+            time.sleep(self.latency)
+
+        retry_after = self._check_rate_limit()
+        if retry_after is not None:
+            self._respond(handler, 429, {'errors': [{'error': 'rate-limit-exceeded'}]},
+                          {'Retry-After': str(max(1, int(retry_after + 1)))})
+            return
+
+        url = urlsplit(handler.path)
+        endpoint = url.path.lstrip('/')
+        params = dict(parse_qsl(url.query))
+
+        try:
+            body = self.source.get(endpoint, params=params)
+        except ValueError as e:
+            self._respond(handler, 404, {'errors': [{'error': str(e)}]})
+            return
+        except Exception as e:
+            logging.error(f"Mock server failed to answer {handler.path}: {e}")
+            self._respond(handler, 500, {'errors': [{'error': str(e)}]})
+            return
+
+        etag = body.get('etag') if isinstance(body, dict) else None
+        if etag and handler.headers.get('If-None-Match') == etag:
+            self._respond(handler, 304)
+            return
+
+        self._respond(handler, 200, body, {'ETag': etag} if etag else None)
+
+    def start(self):
+        """Starts serving on a background thread and returns the server."""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        logging.info(f"Mock Companies House server listening on {self.url}")
+        return self
+
+    def stop(self):
+        """Stops the server."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Serve synthetic corporate groups over a local stand-in for the Companies House API.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--groups', type=int, default=1, help="Number of corporate groups.")
+    parser.add_argument('--depth', type=int, default=3, help="Corporate levels above each root company.")
+    parser.add_argument('--fanout', type=int, default=2, help="Corporate controllers per company.")
+    parser.add_argument('--overlap', type=float, default=0.0, help="Probability a controller is shared with an earlier group.")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds of latency per request.")
+    parser.add_argument('--rate-limit', type=int, default=None, help="Requests allowed per window before answering 429.")
+    parser.add_argument('--time-window', type=float, default=300, help="Rate limit window in seconds.")
+    args = parser.parse_args()
+
+    source = SyntheticDataSource(groups=args.groups, depth=args.depth, fanout=args.fanout, overlap=args.overlap)
+    server = MockCompaniesHouseServer(source, host=args.host, port=args.port, latency=args.latency,
+                                      rate_limit=args.rate_limit, time_window=args.time_window)
+    logging.info(f"Serving {len(source.companies)} companies, root companies: {', '.join(source.companies[root]['company_name'] for root in source.roots[:5])}")
+    logging.info(f"Run the app with CH_BASE_URL={server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
@@ -0,0 +1,332 @@
+import os, json, logging, time, threading
+from collections import deque
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+
+class MemoryRateLimitBackend:
+    """
+    Keeps the sliding window state in process memory. Shared by every thread using the same limiter.
+    """
+
+    def __init__(self):
+        self.timestamps = deque()
+        self.paused_until = 0.0
+
+    @contextmanager
+    def locked(self):
+        """Yields the mutable state. The limiter's thread lock is already held by the caller."""
+        yield self
+
+    def save(self):
+        pass
+
+
+class FileRateLimitBackend:
+    """
+    Keeps the sliding window state in a local JSON file guarded by an exclusive flock,
+    so several processes (e.g. multiple Dash workers) share one request budget.
+    """
+
+    def __init__(self, path):
+        # fcntl is POSIX only, so only import it when a file backend is requested
+        import fcntl
+        self._fcntl = fcntl
+        self.path = path
+        self.timestamps = deque()
+        self.paused_until = 0.0
+        self._file = None
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def locked(self):
+        """Locks the state file, loads it, and yields the state for the duration of the block."""
+        with open(self.path, 'a+') as f:
+            self._fcntl.flock(f, self._fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                raw = f.read()
+                try:
+                    state = json.loads(raw) if raw else {}
+                except ValueError:
+                    logging.warning(f"Rate limit state file {self.path} is corrupt, starting a fresh window.")
+                    state = {}
+
+                self.timestamps = deque(state.get('timestamps', []))
+                self.paused_until = state.get('paused_until', 0.0)
+                self._file = f
+                yield self
+            finally:
+                self._file = None
+                self._fcntl.flock(f, self._fcntl.LOCK_UN)
+
+    def save(self):
+        """Writes the state back while the file lock is still held."""
+        self._file.seek(0)
+        self._file.truncate()
+        json.dump({'timestamps': list(self.timestamps), 'paused_until': self.paused_until}, self._file)
+        self._file.flush()
+
+
+class RateLimiter:
+    """
+    Thread-safe sliding window rate limiter.
+
+    Allows at most max_requests in any time_window seconds. The state lives in a backend, so the
+    same budget can be shared across threads (MemoryRateLimitBackend) or processes (FileRateLimitBackend).
+
+    Args:
+        max_requests (int): The maximum number of requests in the window.
+        time_window (float): The window length in seconds.
+        backend (optional): The state backend, defaults to an in-memory backend.
+    """
+
+    def __init__(self, max_requests, time_window, backend=None):
+        self.max_requests = max_requests
+        self.time_window = time_window
+        self.backend = backend or MemoryRateLimitBackend()
+        self._lock = threading.Lock()
+
+        # Total seconds callers have spent blocked in acquire, useful for progress reporting
+        self.waited_seconds = 0.0
+
+    def _prune(self, state, now):
+        while state.timestamps and now - state.timestamps[0] >= self.time_window:
+            state.timestamps.popleft()
+
+    def _wait_time(self, state, now, n=1):
+        """Returns how long until n requests can be made, given state that has already been pruned."""
+        wait = max(0.0, state.paused_until - now)
+
+        overflow = len(state.timestamps) + n - self.max_requests
+        if overflow > 0:
+            if n > self.max_requests:
+                raise ValueError(f"Cannot wait for {n} requests, the window only allows {self.max_requests}.")
+            # The window frees up once the overflow-th oldest request leaves it
+            wait = max(wait, state.timestamps[overflow - 1] + self.time_window - now)
+
+        return wait
+
+    def acquire(self, block=True, timeout=None):
+        """
+        Takes one request from the budget, sleeping until one is available if needed.
+
+        Args:
+            block (bool, optional): If False, return immediately when no request is available.
+            timeout (float, optional): The maximum number of seconds to wait.
+
+        Returns:
+            bool: True if a request was taken, False if block is False or the timeout expired.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            with self._lock, self.backend.locked() as state:
+                now = time.time()
+                self._prune(state, now)
+                wait = self._wait_time(state, now)
+
+                if wait <= 0:
+                    state.timestamps.append(now)
+                    self.backend.save()
+                    return True
+
+            # Sleep outside the locks so other threads can still check headroom
+            if not block:
+                return False
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+
+            logging.info(f"Rate limit reached, sleeping for {wait:.2f} seconds.")
+            time.sleep(wait)
+            with self._lock:
+                self.waited_seconds += wait
+
+    def headroom(self):
+        """
+        Returns the number of requests that can be made right now without waiting.
+        """
+        with self._lock, self.backend.locked() as state:
+            now = time.time()
+            if state.paused_until > now:
+                return 0
+            self._prune(state, now)
+            return max(0, self.max_requests - len(state.timestamps))
+
+    def time_until_available(self, n=1):
+        """
+        Returns the number of seconds until n requests can be made, 0 if they can be made now.
+
+        Args:
+            n (int, optional): The number of requests the caller wants to make.
+        """
+        with self._lock, self.backend.locked() as state:
+            now = time.time()
+            self._prune(state, now)
+            return self._wait_time(state, now, n)
+
+    def pause(self, seconds):
+        """
+        Stops every caller sharing this limiter from making requests for the given number of seconds,
+        e.g. when the API responds 429 with a Retry-After header.
+
+        Args:
+            seconds (float): How long to pause for.
+        """
+        with self._lock, self.backend.locked() as state:
+            state.paused_until = max(state.paused_until, time.time() + seconds)
+            self.backend.save()
+        logging.warning(f"Rate limiter paused for {seconds:.2f} seconds.")
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker that stops every caller when the upstream keeps failing.
+
+    After failure_threshold failures in a row the circuit opens: callers wait in acquire for
+    reset_timeout seconds instead of adding load to a failing server. Then a single probe call is
+    let through (half-open). If it succeeds the circuit closes, if it fails the circuit opens again
+    for twice as long, up to max_reset_timeout. With a limiter, opening also pauses it, so other
+    processes sharing its budget hold off too.
+
+    Args:
+        failure_threshold (int): Failures in a row that open the circuit.
+        reset_timeout (float): Seconds the circuit stays open the first time.
+        max_reset_timeout (float, optional): The longest the circuit stays open.
+        limiter (RateLimiter, optional): Paused whenever the circuit opens.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, failure_threshold, reset_timeout, max_reset_timeout=None, limiter=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout if max_reset_timeout is not None else reset_timeout * 8
+        self.limiter = limiter
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self._timeout = reset_timeout
+        self._open_until = 0.0
+        self._probing = False
+        # The thread sending the half-open probe, only it can end the probe
+        self._probe_owner = None
+        self._changed = threading.Condition()
+
+    def acquire(self, timeout=None):
+        """
+        Waits until a call may be made: the circuit is closed, or this caller is the half-open probe.
+        Every successful acquire must be followed by success, failure or release.
+
+        Args:
+            timeout (float, optional): The maximum number of seconds to wait.
+
+        Returns:
+            bool: True if the call may be made, False if the timeout expired first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._changed:
+            while True:
+                now = time.monotonic()
+                if self.state == self.CLOSED:
+                    return True
+                if self.state == self.OPEN and now >= self._open_until:
+                    self.state = self.HALF_OPEN
+                if self.state == self.HALF_OPEN and not self._probing:
+                    self._probing = True
+                    self._probe_owner = threading.get_ident()
+                    logging.info("Circuit half-open, sending a probe request")
+                    return True
+
+                wait = self._open_until - now if self.state == self.OPEN else None
+                if deadline is not None:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        return False
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._changed.wait(wait)
+
+    def success(self):
+        """Records a call the upstream answered, closing the circuit if it was the probe."""
+        with self._changed:
+            self.failures = 0
+            if self.state != self.CLOSED:
+                logging.info("Circuit closed, the upstream is answering again")
+                self.state = self.CLOSED
+                self._timeout = self.reset_timeout
+            # Closed, so there is no probe left to wait for
+            self._end_probe(force=True)
+            self._changed.notify_all()
+
+    def failure(self):
+        """Records an upstream failure, opening the circuit after failure_threshold in a row or a failed probe."""
+        with self._changed:
+            self.failures += 1
+            if self.state == self.HALF_OPEN:
+                self._timeout = min(self._timeout * 2, self.max_reset_timeout)
+                self._open()
+            elif self.state == self.CLOSED and self.failures >= self.failure_threshold:
+                self._open()
+            self._end_probe()
+            self._changed.notify_all()
+
+    def release(self):
+        """
+        Gives up an acquired call without a verdict, e.g. it was cancelled. If it was the half-open
+        probe another caller may probe instead, otherwise the probe in flight is left alone.
+        """
+        with self._changed:
+            self._end_probe()
+            self._changed.notify_all()
+
+    def _end_probe(self, force=False):
+        """Clears the probe if this thread sent it (or force is set). Expects the lock to be held."""
+        if force or self._probe_owner == threading.get_ident():
+            self._probing = False
+            self._probe_owner = None
+
+    def _open(self):
+        """Opens the circuit for the current timeout. Expects the lock to be held."""
+        self.state = self.OPEN
+        self.trips += 1
+        self._open_until = time.monotonic() + self._timeout
+        logging.warning(f"Circuit open after {self.failures} failures in a row, pausing requests for {self._timeout:.0f} seconds")
+        if self.limiter is not None:
+            self.limiter.pause(self._timeout)
+
+    def snapshot(self):
+        """Returns the state, failures in a row and times opened as a dict."""
+        with self._changed:
+            return {'state': self.state, 'failures': self.failures, 'trips': self.trips}
+
+
+def parse_retry_after(value):
+    """
+    Parses a Retry-After header, which is either a number of seconds or an HTTP date.
+
+    Args:
+        value (str): The header value.
+
+    Returns:
+        float: The number of seconds to wait, or None if the header is missing or invalid.
+    """
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        logging.warning(f"Could not parse Retry-After header: {value}")
+        return None
+
+    return max(0.0, retry_at.timestamp() - time.time())
@@ -0,0 +1,331 @@
+import os, re, json, logging, argparse, tempfile
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+import scraper
+
+STATE_VERSION = 1
+
+# Streaming API resource kinds and the part of a stored tree they affect
+PSC_RESOURCE_KINDS = ('company-psc-', 'company-persons-with-significant-control')
+PROFILE_RESOURCE_KIND = 'company-profile'
+FILING_RESOURCE_KIND = 'filing-history'
+
+COMPANY_URI_PATTERN = re.compile(r'^/?company/([^/?]+)')
+
+
+def build_tree_state(company_number, company_name=None):
+    """
+    Builds a company tree and keeps every response used to build it, so it can be refreshed later.
+
+    Args:
+        company_number (str): The company number of the root company.
+        company_name (str, optional): The name of the root company, used for logging until it is resolved.
+
+    Returns:
+        dict: The stored tree, with company_number, company_name, entity_data and the cached responses.
+    """
+    company_number = scraper.normalise_company_number(company_number)
+    entity_cache = scraper.EntityCache()
+    entity_data = scraper.get_company_tree(company_name or company_number, concurrent=True,
+                                           company_number=company_number, entity_cache=entity_cache)
+    root = entity_data[0] if entity_data else {}
+    now = datetime.now(timezone.utc).isoformat()
+    return {
+        'version': STATE_VERSION,
+        'company_number': company_number,
+        'company_name': root.get('company_name', company_name or company_number),
+        'built_at': now,
+        'refreshed_at': now,
+        'timepoint': None,
+        'entity_data': entity_data,
+        'responses': prune_responses(entity_cache, company_number, entity_data).entries(),
+        # Etag of the first page of each company's PSC list, filled in by refresh_tree
+        'psc_etags': {},
+    }
+
+
+def load_state(path):
+    """Reads a stored tree written by save_state."""
+    with open(path) as f:
+        state = json.load(f)
+    if state.get('version') != STATE_VERSION:
+        raise ValueError(f"Unsupported tree state version {state.get('version')} in {path}")
+    return state
+
+
+def save_state(state, path):
+    """Writes a stored tree atomically, so an interrupted refresh never leaves a partial file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def prune_responses(entity_cache, root_company_number, entity_data):
+    """
+    Drops cached responses for companies that are no longer part of the tree.
+
+    Args:
+        entity_cache (scraper.EntityCache): The responses used to build the tree.
+        root_company_number (str): The company number of the root company.
+        entity_data (list): The tree's entity list.
+
+    Returns:
+        scraper.EntityCache: A cache holding only the responses the tree still uses.
+    """
+    company_numbers = {entity['company_id'] for entity in entity_data} | {root_company_number}
+    etags = {entity['etag'] for entity in entity_data}
+
+    def wanted(namespace, key):
+        if namespace == 'company':
+            # Keyed on (name, PSC etag), or (name or number, None) for the root company
+            return key[1] in etags or key[1] is None
+        return key in company_numbers
+
+    return scraper.EntityCache.from_entries(
+        [namespace, key, value] for namespace, key, value in entity_cache.entries() if wanted(namespace, key)
+    )
+
+
+def read_stream_events(path, since=None):
+    """
+    Reads a local recording of Companies House streaming API events, one JSON event per line.
+
+    Args:
+        path (str): The path to the JSON lines file.
+        since (int, optional): Skip events at or before this timepoint.
+
+    Yields:
+        dict: Each event, oldest first as recorded.
+    """
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            event = json.loads(line)
+            timepoint = event.get('event', {}).get('timepoint')
+            if since is not None and timepoint is not None and timepoint <= since:
+                continue
+            yield event
+
+
+def changes_from_events(entity_cache, events):
+    """
+    Works out which companies in a stored tree are affected by streaming API events.
+    Events for companies outside the tree, or whose etag matches the stored response, are ignored.
+
+    Args:
+        entity_cache (scraper.EntityCache): The responses used to build the tree.
+        events (iterable): Streaming API events.
+
+    Returns:
+        tuple: (company numbers whose PSCs changed, company numbers whose profile or filings changed,
+            the latest timepoint seen or None).
+    """
+    psc_numbers = set(entity_cache.keys('psc'))
+    detail_numbers = set(entity_cache.keys('details'))
+    psc_changed, details_changed = set(), set()
+    latest_timepoint = None
+
+    for event in events:
+        timepoint = event.get('event', {}).get('timepoint')
+        if timepoint is not None:
+            latest_timepoint = timepoint if latest_timepoint is None else max(latest_timepoint, timepoint)
+
+        match = COMPANY_URI_PATTERN.match(event.get('resource_uri', ''))
+        if not match:
+            continue
+        company_number = match.group(1).upper()
+        resource_kind = event.get('resource_kind', '')
+        data = event.get('data') or {}
+        deleted = event.get('event', {}).get('type') == 'deleted'
+
+        if resource_kind.startswith(PSC_RESOURCE_KINDS) and company_number in psc_numbers:
+            stored_etags = {person.get('etag') for person in entity_cache.get('psc', company_number) or []}
+            if deleted or data.get('etag') not in stored_etags:
+                psc_changed.add(company_number)
+
+        elif resource_kind == PROFILE_RESOURCE_KIND and company_number in detail_numbers:
+            profile = (entity_cache.get('details', company_number) or [{}])[0] or {}
+            if deleted or data.get('etag') != profile.get('etag'):
+                details_changed.add(company_number)
+
+        elif resource_kind == FILING_RESOURCE_KIND and company_number in detail_numbers:
+            details = entity_cache.get('details', company_number) or [{}, {}]
+            filing_history = details[1] if len(details) > 1 and details[1] else {}
+            stored_transactions = {item.get('transaction_id') for item in filing_history.get('items', [])}
+            if deleted or data.get('transaction_id') not in stored_transactions:
+                details_changed.add(company_number)
+
+    return psc_changed, details_changed, latest_timepoint
+
+
+def refresh_tree(state, events=None, revalidate_details=False, max_workers=scraper.TREE_MAX_WORKERS):
+    """
+    Refreshes a stored tree, fetching only what changed since it was built.
+
+    Without events, each company's PSC list is revalidated with a conditional request (a 304 when
+    nothing changed) and compared against the stored PSC etags. The etag sent is the one kept in the
+    state by the previous refresh, so this works with the response cache disabled or evicted; lists
+    refreshed for the first time are downloaded once. With streaming API events, only the
+    companies they name are fetched again. The tree is then re-walked from the stored responses, so
+    unchanged branches cost no API calls and only new controllers are fetched.
+
+    Args:
+        state (dict): A stored tree from build_tree_state or load_state. It is updated in place.
+        events (iterable, optional): Streaming API events to drive the refresh instead of revalidating every company.
+        revalidate_details (bool, optional): Without events, also revalidate each company's profile and filing history.
+        max_workers (int, optional): The number of worker threads used for revalidation.
+
+    Returns:
+        dict: added, removed and changed entity lists, keyed on the PSC etag, plus the company numbers refetched.
+    """
+    entity_cache = scraper.EntityCache.from_entries(state['responses'])
+    company_number = state['company_number']
+
+    if events is not None:
+        psc_candidates, details_candidates, latest_timepoint = changes_from_events(entity_cache, events)
+        if latest_timepoint is not None:
+            state['timepoint'] = latest_timepoint
+    else:
+        psc_candidates = set(entity_cache.keys('psc'))
+        details_candidates = set(entity_cache.keys('details')) if revalidate_details else set()
+
+    psc_etags = state.setdefault('psc_etags', {})
+    # PSC lists confirmed unchanged by a 304, and those with no etag kept yet
+    not_modified, without_etag = [], []
+
+    def refresh_pscs(number):
+        stored_etags = [person.get('etag') for person in entity_cache.get('psc', number) or []]
+        link = f"/company/{number}"
+        # The first page, requested as iter_paginated does so it shares the response cache's entry
+        params = {'register_view': 'false', 'items_per_page': str(scraper.PAGE_SIZE), 'start_index': '0'}
+        stored = scraper.CacheEntry(None, psc_etags[number], False) if psc_etags.get(number) else None
+        if stored is None:
+            without_etag.append(number)
+        page = scraper.rate_limited_make_api_call(f"{link}/persons-with-significant-control", params=params,
+                                                  revalidate=True, stored=stored, entry=True)
+        if page is stored:
+            not_modified.append(number)
+            return False
+        if page.etag:
+            psc_etags[number] = page.etag
+
+        items = (page.body or {}).get('items', []) or []
+        total = (page.body or {}).get('total_results')
+        if (int(total) > len(items)) if total is not None else len(items) >= scraper.PAGE_SIZE:
+            controllers = scraper.get_active_sig_persons(link, revalidate=True)
+        else:
+            controllers = [person for person in items if not person.get('ceased')]
+        entity_cache.put('psc', number, controllers)
+        return [person.get('etag') for person in controllers] != stored_etags
+
+    def refresh_details(number):
+        stored_profile, stored_filing_history = (entity_cache.get('details', number) or [{}, {}])[:2]
+        try:
+            profile = scraper.rate_limited_make_api_call(f"company/{number}", revalidate=True)
+        except Exception as e:
+            logging.error(f"Failed to refresh company profile for {number}: {e}")
+            profile = stored_profile
+        try:
+            filing_history = scraper.rate_limited_make_api_call(f"company/{number}/filing-history", revalidate=True)
+        except Exception as e:
+            logging.info(f"Failed to refresh filing history for {number}: {e}")
+            filing_history = stored_filing_history
+        entity_cache.put('profile', number, profile)
+        entity_cache.put('details', number, [profile, filing_history])
+        return (profile or {}).get('etag') != (stored_profile or {}).get('etag') or filing_history != stored_filing_history
+
+    def changed(refresh, number):
+        try:
+            return refresh(number)
+        except Exception as e:
+            # Leave the stored response in place, the next refresh tries again
+            logging.error(f"Failed to revalidate {number}: {e}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        psc_results = dict(zip(psc_candidates, executor.map(lambda number: changed(refresh_pscs, number), psc_candidates)))
+        details_results = dict(zip(details_candidates, executor.map(lambda number: changed(refresh_details, number), details_candidates)))
+
+    refetched = sorted(number for number, result in {**psc_results, **details_results}.items() if result)
+    if without_etag:
+        logging.info(f"{len(without_etag)} PSC lists had no etag kept from an earlier refresh and were downloaded")
+    logging.info(f"{len(not_modified)} PSC lists unchanged since the last refresh (304)")
+    logging.info(f"Revalidated {len(psc_candidates)} PSC lists and {len(details_candidates)} company details, "
+                 f"{len(refetched)} companies changed")
+
+    previous = state['entity_data']
+    if refetched:
+        # Unchanged branches are answered from the stored responses, only new controllers are fetched
+        entity_data = scraper.get_company_tree(state['company_name'], concurrent=True, max_workers=max_workers,
+                                               company_number=company_number, entity_cache=entity_cache)
+    else:
+        entity_data = previous
+
+    diff = diff_entities(previous, entity_data)
+    diff['refetched'] = refetched
+
+    state['entity_data'] = entity_data
+    responses = prune_responses(entity_cache, company_number, entity_data)
+    psc_numbers = set(responses.keys('psc'))
+    state['responses'] = responses.entries()
+    state['psc_etags'] = {number: etag for number, etag in psc_etags.items() if number in psc_numbers}
+    state['refreshed_at'] = datetime.now(timezone.utc).isoformat()
+    return diff
+
+
+def diff_entities(previous, current):
+    """
+    Compares two entity lists of the same tree.
+
+    Args:
+        previous (list): The entity list before the refresh.
+        current (list): The entity list after the refresh.
+
+    Returns:
+        dict: added, removed and changed entities, matched on their etag.
+    """
+    previous_by_etag = {entity['etag']: entity for entity in previous}
+    current_by_etag = {entity['etag']: entity for entity in current}
+    return {
+        'added': [entity for etag, entity in current_by_etag.items() if etag not in previous_by_etag],
+        'removed': [entity for etag, entity in previous_by_etag.items() if etag not in current_by_etag],
+        'changed': [entity for etag, entity in current_by_etag.items()
+                    if etag in previous_by_etag and previous_by_etag[etag] != entity],
+    }
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Build a company tree once, then refresh only what changed.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="Build a tree and store it.")
+    build_parser.add_argument('company_number')
+    build_parser.add_argument('--state', required=True, help="Path to write the stored tree to.")
+
+    refresh_parser = subparsers.add_parser('refresh', help="Refresh a stored tree.")
+    refresh_parser.add_argument('--state', required=True, help="Path of the stored tree, updated in place.")
+    refresh_parser.add_argument('--events', help="A JSON lines recording of streaming API events to drive the refresh.")
+    refresh_parser.add_argument('--details', action='store_true', help="Without --events, also revalidate profiles and filing histories.")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        state = build_tree_state(args.company_number)
+        save_state(state, args.state)
+        logging.info(f"Stored tree of {len(state['entity_data'])} entities for {state['company_name']} in {args.state}")
+    else:
+        state = load_state(args.state)
+        events = read_stream_events(args.events, since=state.get('timepoint')) if args.events else None
+        diff = refresh_tree(state, events=events, revalidate_details=args.details)
+        save_state(state, args.state)
+        logging.info(f"Refreshed {state['company_name']}: {len(diff['added'])} added, {len(diff['removed'])} removed, "
+                     f"{len(diff['changed'])} changed, {len(diff['refetched'])} companies refetched")
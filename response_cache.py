@@ -0,0 +1,240 @@
+import os, re, json, logging, sqlite3, time, threading
+from urllib.parse import urlencode
+
+# Seconds a cached response is served without contacting the API, matched in order against the endpoint.
+# Anything not listed falls back to DEFAULT_TTL.
+ENDPOINT_TTLS = [
+    (re.compile(r'^(advanced-)?search/'), 60 * 60),
+    (re.compile(r'/persons-with-significant-control'), 24 * 60 * 60),
+    (re.compile(r'/filing-history'), 24 * 60 * 60),
+    (re.compile(r'/registers'), 7 * 24 * 60 * 60),
+    (re.compile(r'^/?company/[^/]+/?$'), 24 * 60 * 60),
+]
+DEFAULT_TTL = 24 * 60 * 60
+
+# Fraction of the size cap to free when evicting, so a full cache doesn't evict on every insert
+EVICTION_HEADROOM = 0.1
+# Inserts between recounts of the cache size. Other processes sharing the file change it too, so the
+# running total kept by each process is only an estimate between recounts.
+SIZE_RECOUNT_INTERVAL = 1000
+
+
+class CacheEntry:
+    """
+    A cached API response.
+
+    Attributes:
+        body (dict): The decoded JSON response.
+        etag (str): The etag sent with the response, used to revalidate it once stale.
+        fresh (bool): Whether the entry is still within its TTL.
+        fetched_at (float): When the response was fetched or last revalidated, as a Unix time.
+    """
+
+    def __init__(self, body, etag, fresh, fetched_at=None):
+        self.body = body
+        self.etag = etag
+        self.fresh = fresh
+        self.fetched_at = fetched_at
+
+
+class ResponseCache:
+    """
+    Persistent SQLite-backed cache of Companies House API responses.
+
+    Responses are keyed on endpoint and params, and on a scope such as the API base URL so servers
+    sharing the file (the live API, mock_server.py) never answer for each other. They expire after a per-endpoint TTL and can then be
+    revalidated with their etag. The total size is capped and the least recently used responses are
+    evicted first. The database file can be shared between threads and processes.
+
+    Args:
+        path (str): The path of the SQLite database file.
+        max_bytes (int, optional): The maximum total size of cached response bodies.
+        ttls (list, optional): (compiled regex, seconds) pairs overriding ENDPOINT_TTLS.
+    """
+
+    def __init__(self, path, max_bytes=512 * 1024 * 1024, ttls=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = ttls if ttls is not None else ENDPOINT_TTLS
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'stale': 0, 'revalidated': 0, 'evictions': 0}
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                body TEXT NOT NULL,
+                etag TEXT,
+                fetched_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                size INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._bytes = self._total_size()
+        self._inserts = 0
+
+    @staticmethod
+    def make_key(endpoint, params=None, scope=None):
+        """
+        Builds the cache key for an endpoint and its params, independent of param order.
+
+        Args:
+            endpoint (str): The API endpoint.
+            params (dict, optional): The query parameters.
+            scope (str, optional): Where the response came from, e.g. the API base URL.
+
+        Returns:
+            str: The cache key.
+        """
+        key = endpoint.lstrip('/')
+        if params:
+            key = f"{key}?{urlencode(sorted((str(k), str(v)) for k, v in params.items()))}"
+        return f"{scope} {key}" if scope else key
+
+    def ttl_for(self, endpoint):
+        """Returns the TTL in seconds for an endpoint."""
+        for pattern, ttl in self.ttls:
+            if pattern.search(endpoint):
+                return ttl
+        return DEFAULT_TTL
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def get(self, endpoint, params=None, scope=None):
+        """
+        Looks up a cached response.
+
+        Args:
+            endpoint (str): The API endpoint.
+            params (dict, optional): The query parameters.
+            scope (str, optional): Where the response came from, see make_key.
+
+        Returns:
+            CacheEntry: The cached entry, which may be stale, or None if nothing is cached.
+        """
+        key = self.make_key(endpoint, params, scope)
+        now = time.time()
+
+        with self._lock:
+            row = self._conn.execute("SELECT body, etag, fetched_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row:
+                self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+
+        if row is None:
+            self._count('misses')
+            return None
+
+        body, etag, fetched_at = row
+        fresh = now - fetched_at < self.ttl_for(endpoint)
+        self._count('hits' if fresh else 'stale')
+
+        return CacheEntry(json.loads(body), etag, fresh, fetched_at)
+
+    def set(self, endpoint, params, body, etag=None, scope=None):
+        """
+        Stores a response, evicting least recently used entries if the cache is over its size cap.
+
+        Args:
+            endpoint (str): The API endpoint.
+            params (dict): The query parameters.
+            body (dict): The decoded JSON response.
+            etag (str, optional): The response etag, defaults to the etag in the body if there is one.
+            scope (str, optional): Where the response came from, see make_key.
+        """
+        key = self.make_key(endpoint, params, scope)
+        encoded = json.dumps(body)
+        if etag is None and isinstance(body, dict):
+            etag = body.get('etag')
+        now = time.time()
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                replaced = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, endpoint, body, etag, fetched_at, last_access, size) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, endpoint, encoded, etag, now, now, len(encoded))
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._bytes += len(encoded) - (replaced[0] if replaced else 0)
+            self._inserts += 1
+            if self._inserts % SIZE_RECOUNT_INTERVAL == 0:
+                self._bytes = self._total_size()
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def revalidated(self, endpoint, params=None, scope=None):
+        """
+        Marks a stale entry as fresh again after the API confirmed it is unchanged (HTTP 304).
+
+        Args:
+            endpoint (str): The API endpoint.
+            params (dict, optional): The query parameters.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("UPDATE responses SET fetched_at = ?, last_access = ? WHERE key = ?",
+                               (now, now, self.make_key(endpoint, params, scope)))
+            self._counters['revalidated'] += 1
+
+    def invalidate(self, endpoint, params=None, scope=None):
+        """Removes a single response from the cache."""
+        key = self.make_key(endpoint, params, scope)
+        with self._lock:
+            deleted = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if deleted:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._bytes -= deleted[0]
+
+    def clear(self):
+        """Removes every response from the cache."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._bytes = 0
+
+    def _total_size(self):
+        """Sums the size of every cached response. Scans the whole table, so set() keeps a running total instead."""
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def _evict(self):
+        """Deletes least recently used entries until the cache is under its size cap. Expects the lock to be held."""
+        # Recount first, other processes may have evicted (or added) responses since the last recount
+        total = self._bytes = self._total_size()
+        if total <= self.max_bytes:
+            return
+
+        target = self.max_bytes * (1 - EVICTION_HEADROOM)
+        evicted = 0
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+            if total <= target:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        self._bytes = total
+
+        self._counters['evictions'] += evicted
+        logging.info(f"Evicted {evicted} responses from cache {self.path}")
+
+    def stats(self):
+        """
+        Returns the hit/miss counters for this process along with the current size of the cache.
+
+        Returns:
+            dict: hits, misses, stale, revalidated, evictions, entries and bytes.
+        """
+        with self._lock:
+            entries, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            return dict(self._counters, entries=entries, bytes=total)
@@ -1,8 +1,15 @@
-import requests, os, tempfile
-import logging, time
-from collections import deque
+import requests, os, re, json, tempfile
+import logging, time, random, threading, contextvars
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import base64
+from urllib.parse import urlsplit
 import pandas as pd
+from rate_limiter import RateLimiter, MemoryRateLimitBackend, FileRateLimitBackend, CircuitBreaker, parse_retry_after
+from response_cache import ResponseCache, CacheEntry
+from document_store import DocumentStore
+from transport import Transport, CH_DOMAIN
+from data_sources import data_source_from_env, HttpDataSource, FixtureDataSource
 
 logging.basicConfig(level=logging.INFO)
 
@@ -12,94 +19,427 @@ logging.basicConfig(level=logging.INFO)
 # Add a prelim screen for users to select the correct company from a list after the search
 
 api_key = os.getenv('API_KEY')
-ch_base_url = 'https://api.company-information.service.gov.uk/'
+ch_base_url = os.getenv('CH_BASE_URL', 'https://api.company-information.service.gov.uk/')
 
 # Validate API key at module load
 if not api_key:
     logging.warning("API_KEY environment variable not set. API calls will fail.")
 
-session = requests.Session()
 # Use proper Basic auth format: base64("api_key:")
+auth_headers = {}
 if api_key:
     credentials = f"{api_key}:"
     encoded_credentials = base64.b64encode(credentials.encode('utf-8')).decode('utf-8')
-    session.headers.update({"Authorization": f"Basic {encoded_credentials}"})
+    auth_headers["Authorization"] = f"Basic {encoded_credentials}"
 
-# Global list to store request timestamps
-request_timestamps = deque()
+# One pooled, kept-alive client for the API and the document API. See transport.py.
+# Auth also follows redirects to the API host, for servers such as mock_server.py.
+transport = Transport.from_env(headers=auth_headers, auth_domains=(CH_DOMAIN, urlsplit(ch_base_url).hostname or CH_DOMAIN))
+session = transport.session
 
 # Define the rate limit and time window
 MAX_REQUESTS = 600  # Maximum number of requests
 TIME_WINDOW = 5 * 60  # 5 minutes (in seconds)
 
+# How many times a call is retried after a 429, and how long to wait if no Retry-After is sent
+MAX_RATE_LIMIT_RETRIES = 3
+DEFAULT_RETRY_AFTER = 30
+
+# How many times a call is retried after a 5xx, timeout or dropped connection, with exponential backoff
+# and full jitter starting at RETRY_BASE_DELAY seconds and capped at RETRY_MAX_DELAY
+MAX_RETRIES = int(os.getenv('CH_MAX_RETRIES', '4'))
+RETRY_BASE_DELAY = float(os.getenv('CH_RETRY_BASE_DELAY', '0.5'))
+RETRY_MAX_DELAY = float(os.getenv('CH_RETRY_MAX_DELAY', '30'))
+# Status codes worth retrying, anything else (bar 404 and 429) is a permanent failure
+TRANSIENT_STATUS_CODES = {500, 502, 503, 504}
+# Failures in a row that stop every worker, and how long they stop for the first time
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CH_CIRCUIT_FAILURES', '5'))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv('CH_CIRCUIT_RESET', '30'))
+
+# Set RATE_LIMIT_FILE to share one budget between processes (e.g. several Dash workers)
+rate_limit_file = os.getenv('RATE_LIMIT_FILE')
+rate_limiter = RateLimiter(
+    MAX_REQUESTS,
+    TIME_WINDOW,
+    backend=FileRateLimitBackend(rate_limit_file) if rate_limit_file else MemoryRateLimitBackend()
+)
+# Shared by every thread. Opening it also pauses rate_limiter, so other processes sharing it back off too.
+circuit_breaker = CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT, limiter=rate_limiter)
+
+# Persistent response cache, shared by every session and process using the same file.
+# Set CH_CACHE=0 to disable it.
+if os.getenv('CH_CACHE', '1') != '0':
+    response_cache = ResponseCache(
+        os.getenv('CH_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'ch_response_cache.sqlite3')),
+        max_bytes=int(os.getenv('CH_CACHE_MAX_MB', '512')) * 1024 * 1024
+    )
+else:
+    response_cache = None
+
+# Downloaded filing documents, served from disk once fetched and shared by every process using the directory
+document_store = DocumentStore(
+    os.getenv('CH_DOCUMENT_DIR', os.path.join(tempfile.gettempdir(), 'ch_documents')),
+    max_bytes=int(os.getenv('CH_DOCUMENT_STORE_MAX_MB', '1024')) * 1024 * 1024
+)
+# Bytes read from the network at a time when downloading a document
+DOCUMENT_CHUNK_SIZE = 64 * 1024
+
+# Where API calls are answered from, selected by CH_DATA_SOURCE. See data_sources.py
+data_source = data_source_from_env(ch_base_url, transport)
+
+# Set CH_RECORD_FIXTURES to a directory to record every response for replay with CH_DATA_SOURCE=fixtures
+fixture_recorder = FixtureDataSource(os.getenv('CH_RECORD_FIXTURES')) if os.getenv('CH_RECORD_FIXTURES') else None
+
+# Largest page the Companies House API serves for list endpoints
+PAGE_SIZE = 100
+
+# Number of worker threads used when expanding the ownership frontier concurrently
+TREE_MAX_WORKERS = int(os.getenv('TREE_MAX_WORKERS', '8'))
+
+# Default traversal budgets, 0 means no limit: levels of controllers above the root company,
+# entities in the tree, and seconds spent building it
+TREE_MAX_DEPTH = int(os.getenv('TREE_MAX_DEPTH', '0'))
+TREE_MAX_NODES = int(os.getenv('TREE_MAX_NODES', '0'))
+TREE_TIME_BUDGET = float(os.getenv('TREE_TIME_BUDGET', '0'))
+
+
+class TransientAPIError(RuntimeError):
+    """
+    Raised for failures that may succeed if the call is retried: 5xx responses, timeouts and dropped connections.
+
+    Attributes:
+        retry_after (float): Seconds to wait from the Retry-After header, or None if it was not sent.
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimitError(TransientAPIError):
+    """
+    Raised when the API responds with 429 Too Many Requests.
+
+    Attributes:
+        retry_after (float): Seconds to wait from the Retry-After header, or None if it was not sent.
+    """
+
+
+class TreeBuildCancelled(RuntimeError):
+    """Raised inside get_company_tree when its TreeProgress is cancelled."""
+
+
+class TreeProgress:
+    """
+    Progress of a tree build, updated by get_company_tree and the API calls made for it, and read
+    from other threads (e.g. a UI polling a background job). Setting cancelled stops the build.
+
+    Attributes:
+        phase (str): 'starting', 'prefetching', 'walking' or 'done'.
+        nodes (int): Entities discovered so far.
+        entities (list): The entities discovered so far, in the order found, each after the company it
+            controls. Read it with entities_after, the final tree may still differ (see get_company_tree).
+        api_calls (int): API calls made, responses served from response_cache are not counted.
+        rate_limit_wait (float): Seconds spent waiting for the rate limit.
+        retries (int): API calls retried after a transient failure.
+        incomplete (list): What couldn't be fetched, as dicts of name, company_number, controlled_company_id,
+            missing ('controllers' or 'details') and error. The tree is still built without them.
+        cancelled (threading.Event): Set to stop the build at the next entity or API call.
+    """
+
+    def __init__(self):
+        self.phase = 'starting'
+        self.nodes = 0
+        self.api_calls = 0
+        self.rate_limit_wait = 0.0
+        self.retries = 0
+        self.incomplete = []
+        self.cancelled = threading.Event()
+        self.entities = []
+        self.finished = False
+        self._etags = set()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def discovered(self, nodes):
+        """Records the number of entities found, which only ever grows across phases."""
+        with self._lock:
+            self.nodes = max(self.nodes, nodes)
+
+    def found(self, entity):
+        """Adds a discovered entity, once per etag."""
+        with self._changed:
+            if entity['etag'] in self._etags:
+                return
+            self._etags.add(entity['etag'])
+            self.entities.append(entity)
+            self.nodes = max(self.nodes, len(self.entities))
+            self._changed.notify_all()
+
+    def finish(self):
+        """Marks the build as over, successful or not, waking anyone waiting in entities_after."""
+        with self._changed:
+            self.finished = True
+            self._changed.notify_all()
+
+    def entities_after(self, count, timeout=None):
+        """
+        Returns the entities discovered after the first `count`, waiting up to timeout seconds for
+        some if there are none yet and the build isn't finished.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: len(self.entities) > count or self.finished, timeout)
+            return self.entities[count:]
+
+    def api_call(self, waited=0.0):
+        with self._lock:
+            self.api_calls += 1
+            self.rate_limit_wait += waited
+
+    def retried(self):
+        with self._lock:
+            self.retries += 1
+
+    def missed(self, name, missing, error, company_number='', controlled_company_id=''):
+        """Records an entity whose controllers or details couldn't be fetched, once per entity and kind."""
+        with self._lock:
+            if any(entry['name'] == name and entry['missing'] == missing for entry in self.incomplete):
+                return
+            self.incomplete.append({'name': name, 'company_number': company_number, 'controlled_company_id': controlled_company_id,
+                                    'missing': missing, 'error': str(error)})
+
+    def check(self):
+        """Raises TreeBuildCancelled if the build was cancelled."""
+        if self.cancelled.is_set():
+            raise TreeBuildCancelled("Tree build cancelled")
+
+    def snapshot(self):
+        """Returns the progress as a dict."""
+        with self._lock:
+            return {'phase': self.phase, 'nodes': self.nodes, 'api_calls': self.api_calls,
+                    'rate_limit_wait': round(self.rate_limit_wait, 1), 'retries': self.retries,
+                    'incomplete': len(self.incomplete), 'cancelled': self.cancelled.is_set()}
+
+
+# The TreeProgress of the tree being built on this thread, if any, so API calls are counted against it
+current_progress = contextvars.ContextVar('current_progress', default=None)
+
 
 # changed all calls to use this and below, easier to debug and opti
-def make_api_call(endpoint, params=None, method="GET"):
+def make_api_call(endpoint, params=None, method="GET", cached=None, entry=False):
     """
     Makes an API call to the specified endpoint with the given parameters and HTTP method.
+    The call is sent to the configured data_source. Successful HTTP responses are stored in response_cache.
 
     Args:
         endpoint (str): The API endpoint to make the request to.
         params (dict, optional): A dictionary of parameters to include in the request.
         method (str, optional): The HTTP method to use for the request (default is "GET").
+        cached (CacheEntry, optional): A stale cache entry. Its etag is sent so the API can answer 304
+            and the cached body is returned instead of downloading it again.
+        entry (bool, optional): Return a CacheEntry carrying the response's etag instead of the body.
+            On a 304 the `cached` entry itself is returned.
 
     Returns:
         dict: The JSON response from the API if the request is successful.
 
     Raises:
         RuntimeError: If the API call fails or returns a non-200 status code.
+        TransientAPIError: If the API responds with a 5xx, or the request times out or loses its connection.
+        RateLimitError: If the API responds with 429.
         ValueError: If the resource is not found (404).
     """
+    source = data_source
+    if not source.remote:
+        data = source.get(endpoint, params=params)
+        return _response_entry(data) if entry else data
 
-    # Use session auth (already set up with proper Basic auth)
-    url = ch_base_url + endpoint
+    url = source.base_url + endpoint
+
+    headers = {}
+    if cached is not None and cached.etag:
+        headers['If-None-Match'] = cached.etag
 
     try:
         if method == "GET":
-            r = session.get(url, params=params, timeout=30)
+            r = source.send(endpoint, params=params, headers=headers, timeout=30)
         else:
             raise NotImplementedError(f"HTTP method {method} not supported.")
 
         if r.status_code == 200:
-            return r.json()
+            data = r.json()
+            if response_cache is not None:
+                response_cache.set(endpoint, params, data, etag=r.headers.get('ETag'), scope=source.base_url)
+            if fixture_recorder is not None:
+                fixture_recorder.record(endpoint, params, data)
+            return _response_entry(data, r.headers.get('ETag')) if entry else data
+        elif r.status_code == 304 and cached is not None:
+            if response_cache is not None:
+                response_cache.revalidated(endpoint, params, scope=source.base_url)
+            # An etag kept without its body (see refresh.py) has nothing to record
+            if fixture_recorder is not None and cached.body is not None:
+                fixture_recorder.record(endpoint, params, cached.body)
+            return cached if entry else cached.body
         elif r.status_code == 404:
+            if fixture_recorder is not None:
+                fixture_recorder.record(endpoint, params, None)
             raise ValueError(f"Resource not found: {url}")
+        elif r.status_code == 429:
+            raise RateLimitError(f"Rate limited by API: {url}", retry_after=parse_retry_after(r.headers.get('Retry-After')))
+        elif r.status_code in TRANSIENT_STATUS_CODES:
+            raise TransientAPIError(f"API call failed with status {r.status_code}: {url}",
+                                    retry_after=parse_retry_after(r.headers.get('Retry-After')))
         else:
             raise RuntimeError(f"API call failed with status {r.status_code}: {r.text}")
+    except (requests.ConnectionError, requests.Timeout) as e:
+        raise TransientAPIError(f"Request failed: {e}")
     except requests.RequestException as e:
         raise RuntimeError(f"Request failed: {e}")
 
+def _response_entry(data, etag=None):
+    """Wraps a fetched response in a fresh CacheEntry, taking the etag from the body if there is no header."""
+    if etag is None and isinstance(data, dict):
+        etag = data.get('etag')
+    return CacheEntry(data, etag, True, time.time())
+
+def set_data_source(source=None):
+    """
+    Switches where API calls are answered from.
+
+    Args:
+        source (DataSource, optional): The data source, e.g. a SnapshotDataSource or an HttpDataSource
+            pointed at mock_server.py. None restores the live API.
+    """
+    global data_source
+    data_source = source if source is not None else HttpDataSource(ch_base_url, transport)
+
 # added rate limiting automatically
-def rate_limited_make_api_call(endpoint, params=None, method="GET"):
+def rate_limited_make_api_call(endpoint, params=None, method="GET", revalidate=False, stored=None, entry=False):
     """
     Makes an API call while adhering to rate limiting (600 requests per 5 minutes).
 
+    The budget is shared through rate_limiter, so it holds across threads and, when RATE_LIMIT_FILE
+    is set, across processes. A 429 pauses every caller for the Retry-After period before retrying.
+    Fresh responses in response_cache are returned without using any of the budget, and local data
+    sources (snapshot, fixtures, synthetic) answer directly without the cache or the budget.
+
     Args:
         endpoint (str): The API endpoint to make the request to.
         params (dict, optional): A dictionary of parameters to include in the request.
         method (str, optional): The HTTP method to use for the request (default is "GET").
+        revalidate (bool, optional): Send a conditional request even if the cached response is still fresh,
+            so changes are picked up without downloading unchanged responses again.
+        stored (CacheEntry, optional): A response kept by the caller, revalidated with its etag when
+            response_cache has no copy (or is disabled). Its body may be None if only the etag was kept.
+        entry (bool, optional): Return a CacheEntry carrying the response's etag instead of the body.
+            When the API answers 304 the entry revalidated (from response_cache, or `stored`) is returned.
 
     Returns:
         dict: The JSON response from the API if the request is successful.
+
+    Transient failures (5xx, timeouts, dropped connections) are retried up to MAX_RETRIES times with
+    exponential backoff and jitter, or after the Retry-After period if the server sent one. They also
+    feed circuit_breaker, which stops every worker for a while when the upstream keeps failing.
+
+    Raises:
+        RateLimitError: If the API is still rate limiting after MAX_RATE_LIMIT_RETRIES retries.
+        TransientAPIError: If the call still fails after MAX_RETRIES retries.
     """
-    # Check if exceeded the rate limit
-    current_time = time.time()
-    
-    # Remove old timestamps that are outside the window
-    while request_timestamps and current_time - request_timestamps[0] > TIME_WINDOW:
-        request_timestamps.popleft()
-    
-    if len(request_timestamps) >= MAX_REQUESTS:
-        # Wait until next request
-        sleep_time = TIME_WINDOW - (current_time - request_timestamps[0])
-        logging.info(f"Rate limit exceeded, sleeping for {sleep_time:.2f} seconds.")
-        time.sleep(sleep_time)
+    progress = current_progress.get()
+    if progress is not None:
+        progress.check()
+
+    if not data_source.remote:
+        if progress is not None:
+            progress.api_call()
+        data = data_source.get(endpoint, params=params)
+        return _response_entry(data) if entry else data
+
+    cached = None
+    if response_cache is not None and method == "GET":
+        # Scoped to the server, so responses from mock_server.py are never served as the live API's
+        cached = response_cache.get(endpoint, params, scope=data_source.base_url)
+        if cached is not None and cached.fresh and not revalidate:
+            # Recorded as if fetched, so a recording made with a warm cache still replays in full
+            if fixture_recorder is not None:
+                fixture_recorder.record(endpoint, params, cached.body)
+            return cached if entry else cached.body
+    if (cached is None or not cached.etag) and stored is not None and stored.etag:
+        cached = stored
+
+    rate_limit_retries, retries = 0, 0
+    while True:
+        # Blocks every worker while the circuit is open, still noticing if the build is cancelled
+        while not circuit_breaker.acquire(timeout=1):
+            if progress is not None:
+                progress.check()
 
-    # Add the current time to the request queue
-    request_timestamps.append(current_time)
+        try:
+            waiting_since = time.monotonic()
+            rate_limiter.acquire()
+            if progress is not None:
+                progress.api_call(time.monotonic() - waiting_since)
+                progress.check()
+            data = make_api_call(endpoint, params=params, method=method, cached=cached, entry=entry)
+        except RateLimitError as e:
+            # Says nothing about the upstream's health, the limiter pause below holds everyone off
+            circuit_breaker.release()
+            if rate_limit_retries == MAX_RATE_LIMIT_RETRIES:
+                raise
+            rate_limit_retries += 1
+            retry_after = e.retry_after if e.retry_after is not None else DEFAULT_RETRY_AFTER
+            logging.warning(f"429 received for {endpoint}, retrying in {retry_after:.2f} seconds.")
+            rate_limiter.pause(retry_after)
+            continue
+        except TransientAPIError as e:
+            circuit_breaker.failure()
+            if retries == MAX_RETRIES:
+                logging.error(f"Giving up on {endpoint} after {retries} retries: {e}")
+                raise
+            delay = retry_delay(retries, e.retry_after)
+            retries += 1
+            if progress is not None:
+                progress.retried()
+            logging.warning(f"{e}, retry {retries} of {MAX_RETRIES} in {delay:.2f} seconds.")
+            if e.retry_after is not None:
+                # The server said when to come back, so nobody else should call it before then either
+                rate_limiter.pause(delay)
+            elif progress is not None:
+                progress.cancelled.wait(delay)
+            else:
+                time.sleep(delay)
+            continue
+        except TreeBuildCancelled:
+            circuit_breaker.release()
+            raise
+        except (ValueError, RuntimeError):
+            # 404s and other client errors mean the upstream is answering
+            circuit_breaker.success()
+            raise
+        except BaseException:
+            # Cancelled before the call was made
+            circuit_breaker.release()
+            raise
+
+        circuit_breaker.success()
+        return data
+
+def retry_delay(attempt, retry_after=None):
+    """
+    Returns how long to wait before retrying a transient failure: the server's Retry-After if it
+    sent one, otherwise exponential backoff with full jitter, so workers that failed together
+    don't all retry at the same moment.
 
-    # Now make the API call
-    return make_api_call(endpoint, params=params, method=method)
+    Args:
+        attempt (int): The number of retries already made.
+        retry_after (float, optional): Seconds from the Retry-After header.
+
+    Returns:
+        float: Seconds to wait.
+    """
+    if retry_after is not None:
+        return min(retry_after, RETRY_MAX_DELAY)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
 
 def search_ch(name):
     """
@@ -198,9 +538,115 @@ def adv_search_ch(name_includes, name_excludes='', company_status='', company_su
 
     return rate_limited_make_api_call("advanced-search/companies", params=params)
 
+def iter_paginated(endpoint, params=None, page_size=PAGE_SIZE, max_items=None, prefetch=True, revalidate=False):
+    """
+    Lazily yields the items of a paginated list endpoint (PSCs, filing history, search results) page by page.
+
+    While the caller works through one page the next is fetched in the background. Iteration stops
+    when the last page is reached, when max_items have been yielded, or when the caller stops
+    consuming the generator, so no further pages are requested once the caller has what it needs.
+
+    Args:
+        endpoint (str): The API endpoint to page through.
+        params (dict, optional): Extra parameters sent with every page.
+        page_size (int, optional): The number of items requested per page.
+        max_items (int, optional): Stop after yielding this many items.
+        prefetch (bool, optional): Fetch the next page while the current one is consumed (default is True).
+        revalidate (bool, optional): Check cached pages with the API even if they are still fresh.
+
+    Yields:
+        dict: Each item from the endpoint's 'items' list, in order.
+    """
+
+    def fetch_page(start_index):
+        page_params = dict(params or {}, items_per_page=str(page_size), start_index=str(start_index))
+        return rate_limited_make_api_call(endpoint, params=page_params, revalidate=revalidate)
+
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    try:
+        start_index = 0
+        yielded = 0
+        page = fetch_page(start_index)
+
+        while page:
+            items = page.get('items', []) or []
+            # PSC and search responses use total_results, filing history uses total_count
+            total = page.get('total_results', page.get('total_count'))
+            next_index = start_index + len(items)
+
+            if total is not None:
+                has_more = bool(items) and next_index < int(total)
+            else:
+                has_more = len(items) >= page_size
+            if max_items is not None and yielded + len(items) >= max_items:
+                has_more = False
+
+            # The prefetch runs in a copy of the caller's context, so its API call counts against the caller's tree
+            next_page = executor.submit(contextvars.copy_context().run, fetch_page, next_index) if has_more and executor else None
+
+            for item in items:
+                if max_items is not None and yielded >= max_items:
+                    return
+                yield item
+                yielded += 1
+
+            if not has_more:
+                return
+
+            page = next_page.result() if next_page else fetch_page(next_index)
+            start_index = next_index
+    finally:
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+def iter_persons_with_control(company_link, **kwargs):
+    """
+    Lazily yields every person with significant control (PSC) for a company, across all pages.
+
+    Args:
+        company_link (str): The link to the company's details in the Companies House API.
+        **kwargs: Passed to iter_paginated, e.g. max_items.
+
+    Yields:
+        dict: Each PSC record.
+    """
+    return iter_paginated(f"{company_link}/persons-with-significant-control", params={"register_view": 'false'}, **kwargs)
+
+def iter_filing_history(company_number, category=None, **kwargs):
+    """
+    Lazily yields the filing history of a company, newest first, across all pages.
+
+    Args:
+        company_number (str): The company number of the company.
+        category (str, optional): Only return filings in this category, e.g. 'accounts'.
+        **kwargs: Passed to iter_paginated, e.g. max_items.
+
+    Yields:
+        dict: Each filing history item.
+    """
+    params = {"category": category} if category else None
+    return iter_paginated(f"company/{company_number}/filing-history", params=params, **kwargs)
+
+def iter_search_results(name, **kwargs):
+    """
+    Lazily yields company search results for a name, across all pages.
+
+    Args:
+        name (str): The name of the company to search for.
+        **kwargs: Passed to iter_paginated, e.g. max_items.
+
+    Yields:
+        dict: Each search result item.
+    """
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError("Company name must be a non-empty string.")
+
+    return iter_paginated('search/companies', params={"q": name}, **kwargs)
+
 def get_persons_with_control_info(company_link):
     """
     Retrieves information about persons with significant control (PSC) for a company using its link.
+    Every page is fetched, so companies with more PSCs than fit on one page are not truncated.
 
     Args:
         company_link (str): The link to the company's details in the Companies House API.
@@ -209,11 +655,9 @@ def get_persons_with_control_info(company_link):
         dict: A dictionary containing information about persons with significant control (PSC).
     """
 
-    params = {"items_per_page" : '10',
-              "start_index" : '0',
-              "register_view": 'false'}
-    
-    return rate_limited_make_api_call(f"{company_link}/persons-with-significant-control", params=params)
+    items = list(iter_persons_with_control(company_link))
+
+    return {'items': items, 'total_results': len(items)}
 
 def get_entity_information(self_link):
     """
@@ -257,64 +701,63 @@ def get_company_registers(company_number):
 def get_document(document_metadata, method='GET'):
     """
     Retrieves and downloads a document from the Companies House API using document metadata.
+    The document is streamed to disk in document_store, and served from there on later requests.
 
     Args:
         document_metadata (str): The metadata of the document to be retrieved.
         method (str, optional): The HTTP method to use for the request (default is "GET").
 
     Returns:
-        str: The file path where the document was saved.
+        str: The file path where the document was saved. It belongs to document_store, so don't remove it.
 
     Raises:
         RuntimeError: If the request for the document fails.
         ValueError: If the document retrieval fails.
     """
-    
-    # Use proper Basic auth format: base64("api_key:")
-    if not api_key:
-        raise ValueError("API_KEY environment variable not set. Cannot download document.")
-    credentials = f"{api_key}:"
-    encoded_credentials = base64.b64encode(credentials.encode('utf-8')).decode('utf-8')
-    headers = {"Authorization": f"Basic {encoded_credentials}"}
-    
-    url = f"{document_metadata}/content"
+    document_id = document_metadata.rstrip('/').rsplit('/', 1)[-1]
 
-    # always initialise
-    temp_dir = tempfile.gettempdir()
-    file_path = ''
-
-    try:
-        #logging.info(f"Requesting document {document_metadata} from URL: {url}")
-        r = requests.get(url, headers=headers, timeout=30)
-        
-        # handle redirects, as this will send to AWS I think?
+    def download():
+        if not api_key:
+            raise ValueError("API_KEY environment variable not set. Cannot download document.")
 
-        if r.status_code == 302:  # Redirect response
-            redirected_url = r.headers.get("Location")  # Get the redirect location
-            logging.info(f"Redirected to {redirected_url}")
-            # Follow the redirect manually and include the Auth header
-            r = requests.get(redirected_url, headers=headers, )
+        # Document downloads count against the same API key budget as every other call
+        rate_limiter.acquire()
+        # The redirect to where the document is stored is followed on the same pooled connections
+        r = transport.get(f"{document_metadata}/content", timeout=30, stream=True)
 
         # Check the response status
-        if r.status_code == 200:
-            logging.info(f"Document {document_metadata} exists. Starting download.")
-            
-            # Save the document locally
-            file_path = os.path.join(temp_dir, f"document.pdf")
-            with open(file_path, "wb") as f:
-                f.write(r.content)
-                logging.info(f"Wrote document {document_metadata} to {file_path}")
-            
-            # Return the path to serve the file later
-            return file_path
-        else:
+        if r.status_code != 200:
+            r.close()
             raise ValueError(f"Failed to download document: HTTP {r.status_code}")
-    
+
+        logging.info(f"Document {document_metadata} exists. Starting download.")
+        # Written to disk chunk by chunk, the whole document is never held in memory
+        with r:
+            yield from r.iter_content(chunk_size=DOCUMENT_CHUNK_SIZE)
+
+    try:
+        file_path = document_store.fetch(document_id, download)
+        logging.info(f"Document {document_metadata} is at {file_path}")
+        return file_path
     except requests.RequestException as e:
         # Handle general request exceptions
         logging.error(f"Request for document {document_metadata} failed: {e}")
         raise RuntimeError(f"Request failed: {e}")
 
+def get_active_sig_persons(company_link, revalidate=False):
+    """
+    Retrieves a list of active persons with significant control (PSC) for a company using its link.
+
+    Args:
+        company_link (str): The link to the company's details in the Companies House API.
+        revalidate (bool, optional): Check cached responses with the API even if they are still fresh.
+
+    Returns:
+        list: A list of active persons with significant control (PSC) for the company.
+    """
+
+    return [person for person in iter_persons_with_control(company_link, revalidate=revalidate) if not person.get('ceased')]
+
 def get_active_sig_persons_from_name(company_name):
     """
     Retrieves a list of active persons with significant control (PSC) for a company using the company name.
@@ -330,18 +773,173 @@ def get_active_sig_persons_from_name(company_name):
 
     company_link = res['items'][0]['links']['self']
 
-    persons_sig = get_persons_with_control_info(company_link)
+    return get_active_sig_persons(company_link)
+
+# Names of the UK and its countries, as normalise_place leaves them
+UK_COUNTRIES = frozenset({
+    'united kingdom', 'uk', 'gb', 'great britain', 'britain', 'england', 'wales', 'scotland',
+    'northern ireland', 'england and wales', 'united kingdom of great britain and northern ireland',
+})
+# The UK registers a corporate PSC's place_registered names, as normalise_place leaves them
+UK_REGISTERS = frozenset({
+    'companies house', 'uk companies house', 'companies house uk', 'companies house england and wales',
+    'companies house cardiff', 'companies house edinburgh', 'companies house belfast', 'companies house london',
+    # A bare 'registrar of companies' is left out, Crown Dependencies' registers go by it too
+    'registrar of companies england and wales', 'registrar of companies for england and wales',
+    'registrar of companies for scotland', 'registrar of companies for northern ireland',
+    'register of companies england and wales', 'register of companies for england and wales',
+    'register of companies for scotland', 'register of companies for northern ireland',
+})
+
+def normalise_place(place):
+    """
+    Normalises a free-text country or register name for comparison: lower case, '&' read as 'and',
+    dots dropped (so 'U.K.' is 'uk'), other punctuation as spaces, and a leading 'the' removed.
+
+    Args:
+        place (str): The name as filed.
+
+    Returns:
+        str: The normalised name.
+    """
+    place = (place or '').lower().replace('&', ' and ').replace('.', '')
+    place = ' '.join(re.sub(r'[^\w]+', ' ', place).split())
+    return place[4:] if place.startswith('the ') else place
+
+def _matches_place(place, names):
+    """Checks a place against normalised names, as a whole or by its first part, e.g. 'Companies House, Cardiff'."""
+    if not place:
+        return False
+    first = re.split(r'[,(;/]', place, maxsplit=1)[0]
+    return normalise_place(place) in names or normalise_place(first) in names
+
+def is_uk_country(country_str):
+    """
+    Checks if a country string represents a UK country. The whole name is matched, so 'Ukraine'
+    and 'New South Wales' are not UK countries.
+
+    Args:
+        country_str (str): The country, e.g. from a PSC address or identification.
+
+    Returns:
+        bool: True if the string names the UK or one of its countries.
+    """
+    return _matches_place(country_str, UK_COUNTRIES)
+
+def is_uk_register(register_str):
+    """
+    Checks if a place_registered string names a UK register, i.e. Companies House or a UK country.
+
+    Args:
+        register_str (str): The place_registered of a corporate PSC's identification.
+
+    Returns:
+        bool: True if the company is registered with Companies House.
+    """
+    return _matches_place(register_str, UK_REGISTERS) or is_uk_country(register_str)
+
+def normalise_company_number(registration_number):
+    """
+    Normalises a registration number from a PSC record into a Companies House company number,
+    e.g. '1234567' -> '01234567' and 'sc 12345' -> 'SC012345'.
+
+    Args:
+        registration_number (str): The registration number as filed.
+
+    Returns:
+        str: The company number, or None if it doesn't look like a Companies House number.
+    """
+    if not registration_number:
+        return None
+
+    cleaned = re.sub(r'\s', '', str(registration_number)).upper()
+    match = re.fullmatch(r'([A-Z]{2})?(\d{1,8})', cleaned)
+    if not match:
+        return None
+
+    prefix = match.group(1) or ''
+    digits = match.group(2)
+    if len(prefix) + len(digits) > 8:
+        return None
+
+    return prefix + digits.zfill(8 - len(prefix))
+
+def company_info_from_profile(profile, company_number=None):
+    """
+    Builds a search-result-shaped company info dict from a company profile.
+
+    Args:
+        profile (dict): The company profile.
+        company_number (str, optional): The company number to use if the profile doesn't include one.
+
+    Returns:
+        dict: company_number, title, links and address_snippet.
+    """
+    company_number = profile.get('company_number', company_number)
+    address = profile.get('registered_office_address', {})
+    return {
+        'company_number': company_number,
+        'title': profile.get('company_name', ''),
+        'links': {'self': profile.get('links', {}).get('self', f"/company/{company_number}")},
+        'address_snippet': ', '.join(filter(None, [address.get('address_line_1'), address.get('locality'), address.get('postal_code')])),
+    }
+
+def get_company_info(company_number):
+    """
+    Retrieves search-result-shaped company info for a company number.
+
+    Args:
+        company_number (str): The company number of the company.
+
+    Returns:
+        dict: company_number, title, links and address_snippet, or None if the company doesn't exist.
+    """
+    try:
+        return company_info_from_profile(get_company_profile(company_number), company_number)
+    except ValueError:
+        logging.warning(f"Company {company_number} not found")
+        return None
+
+def get_company_from_psc(psc):
+    """
+    Resolves the company behind a corporate PSC record.
+
+    UK-registered corporate PSCs carry their company number in identification.registration_number,
+    so the profile is fetched directly. A single name search is only used when that is missing,
+    isn't a Companies House number, or doesn't exist.
 
-    if persons_sig == None:
-        return []
+    Args:
+        psc (dict): A corporate PSC record from the persons-with-significant-control endpoint.
+
+    Returns:
+        tuple: (company_info, company_profile). company_info is shaped like a search result item
+        (company_number, title, links, address_snippet). company_profile is the full profile when it
+        was fetched by number, otherwise None. Both are None if the company can't be found.
+    """
+    identification = psc.get('identification', {}) or {}
+    company_number = normalise_company_number(identification.get('registration_number'))
+    registered_in_uk = (
+        is_uk_country(identification.get('country_registered', ''))
+        or is_uk_register(identification.get('place_registered', ''))
+    )
+
+    if company_number and registered_in_uk:
+        try:
+            profile = get_company_profile(company_number)
+        except ValueError:
+            logging.info(f"Registration number {company_number} for {psc.get('name', 'Unknown')} not found, falling back to search")
+        else:
+            return company_info_from_profile(profile, company_number), profile
 
-    active_sig_persons = []
+    name = psc.get('name', '')
+    if not name:
+        return None, None
 
-    for i in range(0, len(persons_sig['items'])):
-        if not persons_sig['items'][i]['ceased']:
-            active_sig_persons.append(persons_sig['items'][i])
+    search_result = search_ch(name)
+    if not search_result or not search_result.get('items'):
+        return None, None
 
-    return active_sig_persons
+    return search_result['items'][0], None
 
 def construct_ch_link(company_number):
     """
@@ -357,98 +955,465 @@ def construct_ch_link(company_number):
     new_url = f"find-and-update.company-information.service.gov.uk/company/{company_number}/"
     return new_url
 
-def get_addresses(csv_path):
-    """
-    Reads a list of companies in a CSV, and returns their addresses in the same file
-    """
-    
-    df = pd.read_csv(csv_path, dtype={
-    'company_number': str,
-    'company_name': str,
-    'full_address': str,
-    'address_line_1': str,
-    'address_line_2': str,
-    'country': str,
-    'postal_code': str,
-    'locality': str,
-    'region': str,
-    'previous_name' : str
-    })
-
-    # needed as csv is full and doesnt contain full address column
-    if 'full_address' not in df.columns:
-        df['full_address'] = ''  
-
-    for index, row in df.iterrows():
-        company_number = row["company_number"]
-        company_number = str(company_number).strip()
+# Columns get_addresses fills in, in the order they are added to a CSV that lacks them
+ADDRESS_COLUMNS = ['company_name', 'full_address', 'address_line_1', 'address_line_2', 'country',
+                   'postal_code', 'locality', 'region', 'previous_name']
+ADDRESS_CHUNK_SIZE = int(os.getenv('ADDRESS_CHUNK_SIZE', '1000'))
 
-        try:
-            data = get_company_profile(company_number)
-            address_data = data.get('registered_office_address', {})
-        except ValueError as e:
-            logging.warning(f"Company {company_number} not found: {e}")
-            continue
-        except Exception as e:
-            logging.error(f"Unexpected error for {company_number}: {e}")
-            continue
 
-        # Store results in the DataFrame
-        df.at[index, 'company_name'] = data.get('company_name', '')
+def address_fields(profile):
+    """
+    Extracts the columns get_addresses fills in from a company profile.
+
+    Args:
+        profile (dict): The company profile.
 
-        # Should concat these into one line with commas
-        # and change csv to jsut "address"
-        full_address = ', '.join(filter(None, [
+    Returns:
+        dict: Values for each of ADDRESS_COLUMNS.
+    """
+    address_data = profile.get('registered_office_address', {}) or {}
+    previous_names = profile.get('previous_company_names') or []
+    return {
+        'company_name': profile.get('company_name', ''),
+        'full_address': ', '.join(filter(None, [
             address_data.get('address_line_1', ''),
             address_data.get('address_line_2', ''),
             address_data.get('locality', ''),
             address_data.get('region', ''),
             address_data.get('postal_code', ''),
             address_data.get('country', '')
-        ]))
-        
-        df.at[index, 'full_address'] = full_address
-        df.at[index, 'address_line_1'] = address_data.get('address_line_1', '')
-        df.at[index, 'address_line_2'] = address_data.get('address_line_2', '')
-        df.at[index, 'country'] = address_data.get('country', '')
-        df.at[index, 'postal_code'] = address_data.get('postal_code', '')
-        df.at[index, 'locality'] = address_data.get('locality', '')
-        df.at[index, 'region'] = address_data.get('region', '')
+        ])),
+        'address_line_1': address_data.get('address_line_1', ''),
+        'address_line_2': address_data.get('address_line_2', ''),
+        'country': address_data.get('country', ''),
+        'postal_code': address_data.get('postal_code', ''),
+        'locality': address_data.get('locality', ''),
+        'region': address_data.get('region', ''),
+        'previous_name': previous_names[0].get('name', '') if previous_names else '',
+    }
+
 
+def get_addresses(csv_path, out_path=None, chunk_size=ADDRESS_CHUNK_SIZE, max_workers=TREE_MAX_WORKERS, resume=True):
+    """
+    Reads a list of companies in a CSV, and returns their addresses in the same file (or out_path).
+
+    The CSV is streamed in chunks. Each chunk's profiles are fetched concurrently through
+    rate_limited_make_api_call, once per distinct company number across the whole file, and the
+    enriched chunk is appended to a partial output file next to a checkpoint. If the run is
+    interrupted, the next run resumes after the last checkpointed chunk, provided the partial file
+    still holds the rows the checkpoint records, and starts again otherwise. The partial file replaces
+    the output once every chunk is written. Companies that aren't found are left as they were.
+
+    Args:
+        csv_path (str): The CSV to enrich, with a company_number column.
+        out_path (str, optional): Where to write the enriched CSV, defaults to csv_path.
+        chunk_size (int, optional): Rows read, fetched and written at a time.
+        max_workers (int, optional): Profiles fetched concurrently.
+        resume (bool, optional): Continue from a checkpoint left by an interrupted run of the same file.
 
-        if 'previous_company_names' in data and data['previous_company_names']:
-            df.at[index, 'previous_name'] = data['previous_company_names'][0].get('name', '')
+    Returns:
+        int: The number of rows enriched.
+    """
+    out_path = out_path or csv_path
+    partial_path = out_path + '.partial'
+    checkpoint_path = out_path + '.checkpoint'
+    source_stat = os.stat(csv_path)
+    source = {'path': os.path.abspath(csv_path), 'size': source_stat.st_size, 'mtime': source_stat.st_mtime}
+
+    rows_done, enriched_rows = 0, 0
+    checkpoint = None
+    if resume and os.path.exists(checkpoint_path) and os.path.exists(partial_path):
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('source') != source:
+            logging.warning(f"{csv_path} changed since the checkpoint was written, starting again")
+            checkpoint = None
+    if checkpoint:
+        # Drop anything written after the checkpoint, e.g. a chunk interrupted half way through
+        if os.path.getsize(partial_path) < checkpoint['bytes']:
+            written_rows = None
         else:
-            df.at[index, 'previous_name'] = ''
-    
-    df.to_csv(csv_path, index=False)
+            with open(partial_path, 'r+b') as f:
+                f.truncate(checkpoint['bytes'])
+            written_rows = _count_csv_rows(partial_path, chunk_size)
+        if written_rows != checkpoint['rows']:
+            logging.warning(f"{partial_path} holds {written_rows} rows but the checkpoint says {checkpoint['rows']}, starting again")
+            checkpoint = None
+    if checkpoint:
+        rows_done, enriched_rows = checkpoint['rows'], checkpoint['enriched']
+        logging.info(f"Resuming {csv_path} after {rows_done} rows")
+    else:
+        open(partial_path, 'w').close()
+
+    # Field values per company number, None for companies not found. Repeated numbers are fetched once.
+    fetched = {}
+
+    def fetch(company_number):
+        try:
+            fields = address_fields(get_company_profile(company_number))
+            return tuple(fields[column] for column in ADDRESS_COLUMNS)
+        except ValueError as e:
+            logging.warning(f"Company {company_number} not found: {e}")
+        except Exception as e:
+            logging.error(f"Unexpected error for {company_number}: {e}")
+        return None
+
+    chunks = pd.read_csv(csv_path, dtype={column: str for column in ['company_number'] + ADDRESS_COLUMNS}, chunksize=chunk_size)
+
+    # The rows already written are skipped as parsed records, not lines, as quoted fields can span lines
+    skip = rows_done
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for chunk in chunks:
+            if skip:
+                if len(chunk) <= skip:
+                    skip -= len(chunk)
+                    continue
+                chunk, skip = chunk.iloc[skip:], 0
+            company_numbers = chunk['company_number'].astype(str).str.strip()
+            missing = [number for number in company_numbers.unique() if number not in fetched]
+            fetched.update(zip(missing, executor.map(fetch, missing)))
+
+            # needed as csv is full and doesnt contain full address column
+            for column in ADDRESS_COLUMNS:
+                if column not in chunk.columns:
+                    chunk[column] = '' if column == 'full_address' else None
+
+            # Fill every found company's columns at once
+            found = company_numbers.map(lambda number: fetched[number] is not None).astype(bool)
+            if found.any():
+                fields = pd.DataFrame([fetched[number] for number in company_numbers[found]], index=chunk.index[found], columns=ADDRESS_COLUMNS)
+                chunk.loc[found, ADDRESS_COLUMNS] = fields
+
+            with open(partial_path, 'a', newline='') as f:
+                chunk.to_csv(f, index=False, header=rows_done == 0)
+                f.flush()
+                os.fsync(f.fileno())
+                written = f.tell()
+
+            rows_done += len(chunk)
+            enriched_rows += int(found.sum())
+            _write_checkpoint(checkpoint_path, {'source': source, 'rows': rows_done, 'enriched': enriched_rows, 'bytes': written})
+            logging.info(f"Enriched {enriched_rows} of {rows_done} rows of {csv_path}, {rate_limiter.headroom()} requests of headroom")
+
+    if rows_done == 0:
+        # No rows, keep the header
+        header = pd.read_csv(csv_path, nrows=0)
+        header.reindex(columns=list(header.columns) + [column for column in ADDRESS_COLUMNS if column not in header.columns]).to_csv(partial_path, index=False)
+
+    os.replace(partial_path, out_path)
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return enriched_rows
+
+
+def _count_csv_rows(path, chunk_size=ADDRESS_CHUNK_SIZE):
+    """Counts the records (not lines) of a CSV written by get_addresses, 0 if it is empty."""
+    if os.path.getsize(path) == 0:
+        return 0
+    return sum(len(chunk) for chunk in pd.read_csv(path, usecols=[0], dtype=str, chunksize=chunk_size))
+
+
+def _write_checkpoint(path, checkpoint):
+    """Writes a checkpoint atomically, so a crash leaves either the old one or the new one."""
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(temp_path, path)
+
+
+# Marks a missing key where None is a valid cached value
+_MISSING = object()
+
+
+class EntityCache:
+    """
+    Thread-safe memo of the responses used to build company trees. Pass one to several
+    get_company_tree calls to share it, so ownership chains converging on the same holding
+    companies are only fetched once. Concurrent requests for the same key wait for the first
+    fetch instead of repeating it.
+
+    A cache private to one tree is unbounded. A long-lived one (e.g. details_cache) can be capped
+    at max_entries, evicting the least recently used values, and values can expire after ttl seconds.
+
+    Args:
+        max_entries (int, optional): The most values kept, None for no limit.
+        ttl (float, optional): Seconds a value is served for, None for as long as the cache lives.
+    """
+
+    def __init__(self, max_entries=None, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._values = OrderedDict()
+        self._stored_at = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, cache_key):
+        """Returns a cached value or _MISSING, dropping it if expired. Expects the lock to be held."""
+        if cache_key not in self._values:
+            return _MISSING
+        if self.ttl is not None and time.monotonic() - self._stored_at.get(cache_key, 0) >= self.ttl:
+            del self._values[cache_key]
+            self._stored_at.pop(cache_key, None)
+            return _MISSING
+        self._values.move_to_end(cache_key)
+        return self._values[cache_key]
+
+    def _store(self, cache_key, value):
+        """Stores a value, evicting the least recently used if over max_entries. Expects the lock to be held."""
+        self._values[cache_key] = value
+        self._values.move_to_end(cache_key)
+        if self.ttl is not None:
+            self._stored_at[cache_key] = time.monotonic()
+        while self.max_entries is not None and len(self._values) > self.max_entries:
+            evicted, _ = self._values.popitem(last=False)
+            self._stored_at.pop(evicted, None)
+
+    def get(self, namespace, key, default=None):
+        """Returns a cached value, or default if it hasn't been fetched."""
+        with self._lock:
+            value = self._lookup((namespace, key))
+            return default if value is _MISSING else value
+
+    def put(self, namespace, key, value):
+        """Stores a value fetched elsewhere."""
+        with self._lock:
+            self._store((namespace, key), value)
+
+    def fetch(self, namespace, key, fetch):
+        """
+        Returns the cached value for a key, calling fetch() to get it the first time.
+
+        Args:
+            namespace (str): The kind of value, e.g. 'psc' or 'details'.
+            key: The key within the namespace, e.g. a company number.
+            fetch (callable): Called with no arguments to get the value.
+
+        Returns:
+            The value. If fetch() raises, nothing is cached and the exception propagates.
+        """
+        cache_key = (namespace, key)
+        while True:
+            with self._lock:
+                value = self._lookup(cache_key)
+                if value is not _MISSING:
+                    return value
+                event = self._in_flight.get(cache_key)
+                owner = event is None
+                if owner:
+                    event = self._in_flight[cache_key] = threading.Event()
+
+            if not owner:
+                # Another thread is fetching it, wait and re-check
+                event.wait()
+                continue
+
+            try:
+                value = fetch()
+                with self._lock:
+                    self._store(cache_key, value)
+                return value
+            finally:
+                with self._lock:
+                    del self._in_flight[cache_key]
+                event.set()
+
+    def invalidate(self, namespace, key):
+        """Drops a cached value so the next fetch() gets it again."""
+        with self._lock:
+            self._values.pop((namespace, key), None)
+            self._stored_at.pop((namespace, key), None)
+
+    def keys(self, namespace):
+        """Returns the keys cached in a namespace."""
+        with self._lock:
+            return [key for cached_namespace, key in self._values if cached_namespace == namespace]
+
+    def entries(self):
+        """
+        Returns every cached value as [namespace, key, value] lists, e.g. to store as JSON.
+        """
+        with self._lock:
+            return [[namespace, key, value] for (namespace, key), value in self._values.items()]
+
+    @classmethod
+    def from_entries(cls, entries):
+        """
+        Rebuilds a cache from the output of entries(), including after a JSON round trip.
+        """
+        cache = cls()
+        for namespace, key, value in entries:
+            # JSON turns tuple keys into lists
+            cache._values[(namespace, tuple(key) if isinstance(key, list) else key)] = value
+        return cache
+
+    def __len__(self):
+        with self._lock:
+            return len(self._values)
+
+
+# Details fetched on demand, e.g. when a node of a lazily built tree is tapped. Bounded and expiring,
+# as it lives as long as the server does. Refetches are usually answered by response_cache.
+DETAILS_CACHE_ENTRIES = int(os.getenv('DETAILS_CACHE_ENTRIES', '5000'))
+DETAILS_CACHE_TTL = float(os.getenv('DETAILS_CACHE_TTL', str(60 * 60)))
+details_cache = EntityCache(max_entries=DETAILS_CACHE_ENTRIES, ttl=DETAILS_CACHE_TTL)
+
+
+def get_company_details(company_number, company_title='Unknown', entity_cache=None):
+    """
+    Retrieves the profile and filing history of a company, once per company number.
+
+    Args:
+        company_number (str): The company number of the company.
+        company_title (str, optional): The company name, used in log messages.
+        entity_cache (EntityCache, optional): The cache to use, defaults to the module-level details_cache.
+
+    Returns:
+        tuple: (profile, filing history), each an empty dict if it couldn't be fetched.
+    """
+    cache = entity_cache if entity_cache is not None else details_cache
+    failures = []
+
+    def fetch():
+        company_profile = cache.get('profile', company_number)
+        if company_profile is None:
+            try:
+                company_profile = get_company_profile(company_number)
+            except Exception as e:
+                logging.error(f"Failed to get company profile for {company_title}: {e}")
+                company_profile = {}
+                if isinstance(e, TransientAPIError):
+                    failures.append(e)
+
+        filing_history = {}
+        try:
+            filing_history = get_filing_history(company_number)
+        except Exception as e:
+            logging.info(f"Filing history not found for: {company_title}: {e}")
+            if isinstance(e, TransientAPIError):
+                failures.append(e)
+
+        return company_profile, filing_history
+
+    details = cache.fetch('details', company_number, fetch)
+    if failures:
+        # Served empty this time, but fetched again next time rather than cached as missing
+        cache.invalidate('details', company_number)
+        progress = current_progress.get()
+        if progress is not None:
+            progress.missed(company_title, 'details', failures[0], company_number=company_number)
+    return details
+
 
-def get_company_tree(company_name):
+def enrich_entities(entity_data, entity_cache=None, max_workers=TREE_MAX_WORKERS):
+    """
+    Fills in accounts, previous_names and filing_history for the entities of a tree built with lazy=True,
+    e.g. before exporting it. Entities without a company number (non-UK controllers) are left as they are.
+
+    Args:
+        entity_data (list): The tree's entity list, updated in place.
+        entity_cache (EntityCache, optional): The cache to use, defaults to the module-level details_cache.
+        max_workers (int, optional): The number of worker threads fetching details.
+
+    Returns:
+        list: entity_data.
+    """
+    companies = [entity for entity in entity_data if entity.get('link')]
+
+    def enrich(entity):
+        company_profile, filing_history = get_company_details(entity['company_id'], entity.get('company_name', 'Unknown'), entity_cache)
+        entity['accounts'] = company_profile.get('accounts', {}) if company_profile else {}
+        entity['previous_names'] = company_profile.get('previous_company_names', []) if company_profile else []
+        entity['filing_history'] = filing_history
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(enrich, companies))
+
+    return entity_data
+
+
+def get_company_tree(company_name, concurrent=False, max_workers=TREE_MAX_WORKERS, company_number=None, entity_cache=None,
+                     max_depth=TREE_MAX_DEPTH, max_nodes=TREE_MAX_NODES, time_budget=TREE_TIME_BUDGET, lazy=False, progress=None):
     """
     Recursively fetches the company tree of significant controllers (SIGs) for a given company name.
 
     Args:
         company_name (str): The name of the company for which the significant controllers' network is to be retrieved.
+        concurrent (bool, optional): If True, each level of the ownership frontier is fetched in parallel
+            before the tree is walked. The API calls still go through rate_limited_make_api_call.
+        max_workers (int, optional): The number of worker threads used when concurrent is True.
+        company_number (str, optional): The company number of the root company. When given, the root is
+            fetched by number instead of searching for company_name.
+        entity_cache (EntityCache, optional): A cache shared between trees, so companies that appear in
+            several trees are only fetched once. Defaults to a cache private to this tree.
+        max_depth (int, optional): Levels of controllers to follow above the company, 0 for no limit.
+            Entities whose controllers were not followed are marked with 'truncated'.
+        max_nodes (int, optional): Stop once the tree has this many entities, 0 for no limit.
+        time_budget (float, optional): Stop after this many seconds, 0 for no limit.
+        lazy (bool, optional): Only gather the ownership structure. Profiles and filing histories are not
+            fetched, leaving accounts, previous_names and filing_history empty unless the profile was already
+            fetched to resolve the company. Fill them in later with get_company_details or enrich_entities.
+        progress (TreeProgress, optional): Updated with the entities found, API calls made and rate limit waits
+            while the tree is built. Cancelling it raises TreeBuildCancelled.
 
     Returns:
         list: A list of dictionaries, each representing an entity with significant control over the company or its subsidiaries.
+            The root company comes first. Every other entity has controlled_company_id and controlled_company_name,
+            the company it is a significant controller of.
+
+    Raises:
+        TreeBuildCancelled: If progress is cancelled before the tree is built.
     """
+    if progress is None:
+        progress = TreeProgress()
+    if current_progress.get() is not progress:
+        # Build in a copy of the context with progress set, so API calls made for this tree are counted against it
+        context = contextvars.copy_context()
+        context.run(current_progress.set, progress)
+        return context.run(get_company_tree, company_name, concurrent, max_workers, company_number, entity_cache,
+                           max_depth, max_nodes, time_budget, lazy, progress)
+
+    # Responses are memoised so the concurrent prefetch and the walk below share them, and a company
+    # reached through two PSC records (or, with a shared entity_cache, two trees) is only fetched once
+    cache = entity_cache if entity_cache is not None else EntityCache()
+    deadline = time.monotonic() + time_budget if time_budget else None
+
+    def with_progress(function):
+        """Wraps a function run on a worker thread so its API calls are counted against this tree too."""
+        def run(*args):
+            token = current_progress.set(progress)
+            try:
+                return function(*args)
+            finally:
+                current_progress.reset(token)
+        return run
+
+    def fetch_active_controllers(company_info):
+        """Fetch the active significant controllers of a resolved company, once per company number."""
+        return cache.fetch('psc', company_info['company_number'], lambda: get_active_sig_persons(company_info['links']['self']))
+
+    def resolve_company(company_name, entity):
+        """Find the company for a PSC record, or by name for the root company."""
+        if entity:
+            company_info, company_profile = get_company_from_psc(entity)
+            if company_profile:
+                # Keep the profile so process_entity doesn't fetch it again
+                cache.put('profile', company_info['company_number'], company_profile)
+            return company_info
 
-    def fetch_significant_controllers(company_name):
-        """Fetch significant controllers for a company by name."""
         search_result = search_ch(company_name)
+        return search_result['items'][0] if search_result and search_result.get('items') else None
 
+    def fetch_significant_controllers(company_name, entity=None):
+        """Fetch significant controllers for a company by name, or for the company behind a PSC record."""
+        cache_key = (company_name, entity.get('etag')) if entity else (company_name, None)
+        company_info = cache.fetch('company', cache_key, lambda: resolve_company(company_name, entity))
 
-        if not search_result or not search_result.get('items'):
+        if not company_info:
             print(f"No search results found for term {company_name}")
             return None, None
 
-        company_info = search_result['items'][0]
-
-        if not company_info:
-            logging.error(f"No info found for {company_name}")
-
-        significant_controllers = get_active_sig_persons_from_name(company_info['title'])
+        significant_controllers = fetch_active_controllers(company_info)
         if not significant_controllers:
             logging.error(f"No significant controllers found for {company_name}")
             significant_controllers = {}
@@ -456,20 +1421,16 @@ def get_company_tree(company_name):
         logging.info(f"Sig controllers for {company_name} found: {significant_controllers}")
 
         return company_info, significant_controllers
-    
+
+    def fetch_company_details(company_number, company_title):
+        """Fetch the profile and filing history for a company, or only use a profile already fetched when lazy."""
+        if lazy:
+            return cache.get('profile', company_number) or {}, {}
+        return get_company_details(company_number, company_title, entity_cache=cache)
+
     def process_entity(entity, company_info):
         """Process and structure information for a single significant control entity."""
-        try:
-            company_profile = get_company_profile(company_info['company_number'])
-        except Exception as e:
-            logging.error(f"Failed to get company profile for {company_info.get('title', 'Unknown')}: {e}")
-            company_profile = {}
-
-        filing_history = {}
-        try:
-            filing_history = get_filing_history(company_info['company_number'])
-        except Exception as e:
-            logging.info(f"Filing history not found for: {company_info.get('title', 'Unknown')}: {e}")
+        company_profile, filing_history = fetch_company_details(company_info['company_number'], company_info.get('title', 'Unknown'))
 
         accounts = company_profile.get('accounts', {}) if company_profile else {}
         previous_names = company_profile.get("previous_company_names", []) if company_profile else []
@@ -489,152 +1450,255 @@ def get_company_tree(company_name):
             'filing_history': filing_history
         }
     
-    def is_uk_country(country_str):
-        """Check if a country string represents a UK country."""
-        if not country_str:
-            return False
-        country_lower = country_str.lower()
-        uk_variations = [
-            'united kingdom', 'uk', 'england', 'wales', 'scotland', 
-            'northern ireland', 'england and wales', 'great britain',
-            'gb', 'britain'
-        ]
-        return any(uk_var in country_lower for uk_var in uk_variations)
-
-    def traverse_entities(entities, root_company_info, entity_data=None):
-        """Traverse through entities recursively to build the tree."""
-
-        ### need a queue to track controllers 
-        # Otherwise, if a company has 2 sig controllers, only one is looped.
-        queue = [(root_company_info, entities)]
-
-        while queue:
-
-            current_company_info, current_entities = queue.pop(0)
-
-            if entity_data is None:
-                entity_data = []
-
-            logging.info(f"Traversing entities for {root_company_info['title']}")
-
-            for entity in current_entities:
-                logging.info(f"Processing entity: {entity.get('name', 'Unknown')} of kind: {entity.get('kind', 'Unknown')}")
-
-                # Safely check address and country
-                entity_address = entity.get('address', {})
-                entity_country = entity_address.get('country', '').lower() if entity_address else ''
-
-                if not entity.get('ceased') and entity.get('kind') == 'corporate-entity-person-with-significant-control' and is_uk_country(entity_country): # As we only care about companies, not individuals
-                    
-                    logging.info(f"Entity {entity.get('name', 'Unknown')} added as kind corporate-entity-person-with-significant-control")
-                    
-                    if entity.get('etag') and entity['etag'] not in visited_entities:
-                        visited_entities.add(entity['etag'])
-                        
-                        # First, fetch the company info for this entity (not the current company being controlled)
-                        other_company_name = entity.get('name', '')
-                        if not other_company_name:
-                            logging.warning(f"Entity has no name, skipping")
-                            continue
-                        
-                        try:
-                            other_company_info, other_controllers = fetch_significant_controllers(other_company_name)
-                        except Exception as e:
-                            logging.error(f"Failed to fetch significant controllers for {other_company_name}: {e}")
-                            other_company_info, other_controllers = None, None
-
-                        if other_company_info:
-                            country_registered = other_company_info.get('identification', {}).get('country_registered', '')
-                            
-                            # Check if company is UK-registered (using expanded UK check)
-                            if country_registered and not is_uk_country(country_registered):
-                                logging.info(f"Skipping for non-UK company: {other_company_info['title']} registered in {country_registered}")
-                                continue
-                            
-                            # Now process the entity using the correct company_info (the entity's own company info)
-                            structured_data = process_entity(entity, other_company_info)
-                            entity_data.append(structured_data)
-                            logging.info(f"{structured_data['company_name']} added to list.")
-
-                            # ALWAYS traverse its controllers if any, regardless of address country
-                            # This ensures we go up the full chain
-                            if other_controllers:
-                                logging.info(f"Traversing controllers for {structured_data['company_name']}")
-                                traverse_entities(other_controllers, other_company_info, entity_data)
-                            # If no controllers, the entity is already added above, so we're done
-                        else:
-                            logging.warning(f"Entity {entity.get('name', 'Unknown')} not being traversed due to no company info found")
-                
-                elif entity.get('kind') == 'individual-beneficial-owner':
-                    logging.info(f"Skipping for individual beneficial owner: {entity.get('name', 'Unknown')}")
-
-                    # need to pass details in entity_data here too
+    def prefetch_entity(entity, controlled_company_info):
+        """
+        Fetch everything traverse_entities will need for a corporate controller, returning its company
+        and its own controllers. Entities the walk will add are reported to progress as they are found.
+        """
+        entity_address = entity.get('address', {})
+        entity_country = entity_address.get('country', '').lower() if entity_address else ''
 
+        try:
+            other_company_info, other_controllers = fetch_significant_controllers(entity['name'], entity)
+        except TreeBuildCancelled:
+            raise
+        except Exception as e:
+            logging.error(f"Failed to prefetch significant controllers for {entity['name']}: {e}")
+            return None, []
+
+        if not other_company_info:
+            return None, []
+
+        # Mirror the checks in traverse_entities so details are only fetched for entities that get added
+        country_registered = other_company_info.get('identification', {}).get('country_registered', '')
+        if is_uk_country(entity_country):
+            wanted = not (country_registered and not is_uk_country(country_registered))
+        else:
+            wanted = is_uk_country(country_registered)
+
+        if wanted:
+            progress.found(dict(process_entity(entity, other_company_info),
+                                controlled_company_id=controlled_company_info.get('company_number', ''),
+                                controlled_company_name=controlled_company_info.get('title', '')))
+
+        return other_company_info, other_controllers or []
+
+    def prefetch_tree(root_company_info, root_controllers):
+        """Expand the ownership frontier one level at a time, fetching each level in parallel."""
+        seen_etags = set()
+        # (controller, the company it controls) pairs
+        frontier = [(entity, root_company_info) for entity in root_controllers]
+        progress.phase = 'prefetching'
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # The root details are needed at the end, so fetch them alongside the first level
+            root_details = executor.submit(with_progress(fetch_company_details), root_company_info.get('company_number', ''), root_company_info.get('title', 'Unknown')) if not lazy else None
+
+            level = 0
+            # Stop where the walk would, the walk then fetches anything left over itself
+            while frontier and not (max_depth and level >= max_depth) and not (deadline and time.monotonic() >= deadline):
+                progress.check()
+                expandable = []
+                for entity, controlled_company_info in frontier:
+                    if max_nodes and len(seen_etags) + 1 >= max_nodes:
+                        break
+                    entity_address = entity.get('address', {})
+                    entity_country = entity_address.get('country', '') if entity_address else ''
+                    if (not entity.get('ceased') and entity.get('kind') == 'corporate-entity-person-with-significant-control'
+                            and entity_country and entity.get('name') and entity.get('etag') and entity['etag'] not in seen_etags):
+                        seen_etags.add(entity['etag'])
+                        expandable.append((entity, controlled_company_info))
+
+                logging.info(f"Prefetching {len(expandable)} controllers at level {level}, {rate_limiter.headroom()} requests of headroom")
+                results = executor.map(with_progress(prefetch_entity), *zip(*expandable)) if expandable else []
+                frontier = [(controller, company_info) for company_info, controllers in results for controller in controllers]
+                level += 1
+                progress.discovered(len(seen_etags) + 1)
+
+            if root_details:
+                root_details.result()
+
+    def missed(entity, missing, error, controlled_company_info):
+        """
+        Record a controller the walk had to leave out after a transient failure, against the company it controls.
+        Permanent failures (e.g. a 404) are not recorded, rebuilding the tree wouldn't find them either.
+        """
+        identification = entity.get('identification', {}) or {}
+        progress.missed(entity.get('name', 'Unknown'), missing, error,
+                        company_number=normalise_company_number(identification.get('registration_number')) or '',
+                        controlled_company_id=controlled_company_info.get('company_number', ''))
+
+    def traverse_entities(entities, root_company_info):
+        """
+        Walk the ownership chain iteratively, depth first, so each controller is followed
+        directly by its own controllers. An explicit stack replaces recursion, so chains
+        hundreds of levels deep don't hit the recursion limit, and the depth, node and
+        time budgets are checked as each entity is reached.
+        """
+        entity_data = []
+        visited_entities = set()
+        out_of_time = False
+        # Each frame is (iterator over a company's controllers, the company, depth of those controllers)
+        stack = deque([(iter(entities), root_company_info, 1)])
+        progress.phase = 'walking'
+
+        logging.info(f"Traversing entities for {root_company_info['title']}")
+
+        while stack:
+            progress.check()
+            current_entities, current_company_info, depth = stack[-1]
+            entity = next(current_entities, None)
+            if entity is None:
+                stack.pop()
+                continue
+
+            # The root company is added after the walk, so it counts towards the budget
+            if max_nodes and len(entity_data) + 1 >= max_nodes:
+                logging.warning(f"Stopping traversal for {root_company_info['title']} at the budget of {max_nodes} entities")
+                break
+            if deadline and time.monotonic() >= deadline and cache.get('company', (entity.get('name', ''), entity.get('etag')), _MISSING) is _MISSING:
+                # Out of time, only entities already fetched (e.g. by the prefetch) are still added
+                if not out_of_time:
+                    logging.warning(f"Time budget of {time_budget}s spent for {root_company_info['title']}, "
+                                    f"only adding entities already fetched")
+                    out_of_time = True
+                continue
+
+            logging.info(f"Processing entity: {entity.get('name', 'Unknown')} of kind: {entity.get('kind', 'Unknown')}")
+
+            # Safely check address and country
+            entity_address = entity.get('address', {})
+            entity_country = entity_address.get('country', '').lower() if entity_address else ''
+            structured_data, other_company_info, other_controllers = None, None, None
+
+            if not entity.get('ceased') and entity.get('kind') == 'corporate-entity-person-with-significant-control' and is_uk_country(entity_country): # As we only care about companies, not individuals
+
+                logging.info(f"Entity {entity.get('name', 'Unknown')} added as kind corporate-entity-person-with-significant-control")
+
+                if not entity.get('etag') or entity['etag'] in visited_entities:
                     continue
+                visited_entities.add(entity['etag'])
 
-                # Handling entities with non-UK addresses but might be UK-registered
-                # We still want to check if they're UK-registered and traverse their controllers
-                elif not entity.get('ceased') and entity.get('kind') == 'corporate-entity-person-with-significant-control' and entity_country and not is_uk_country(entity_country):
-                    logging.info(f"Processing entity with non-UK address: {entity.get('name', 'Unknown')} in {entity_country}")
-                    
-                    # Still try to fetch company info - it might be UK-registered even if address is elsewhere
-                    other_company_name = entity.get('name', '')
-                    if other_company_name and entity.get('etag') and entity['etag'] not in visited_entities:
-                        visited_entities.add(entity['etag'])
-                        
-                        try:
-                            other_company_info, other_controllers = fetch_significant_controllers(other_company_name)
-                        except Exception as e:
-                            logging.error(f"Failed to fetch company info for {other_company_name}: {e}")
-                            other_company_info, other_controllers = None, None
-                        
-                        if other_company_info:
-                            country_registered = other_company_info.get('identification', {}).get('country_registered', '')
-                            
-                            # If UK-registered, process normally and traverse controllers
-                            if is_uk_country(country_registered):
-                                logging.info(f"Entity {other_company_name} is UK-registered, processing normally")
-                                structured_data = process_entity(entity, other_company_info)
-                                entity_data.append(structured_data)
-                                logging.info(f"{structured_data['company_name']} added to list.")
-                                
-                                # Traverse controllers
-                                if other_controllers:
-                                    logging.info(f"Traversing controllers for {structured_data['company_name']}")
-                                    traverse_entities(other_controllers, other_company_info, entity_data)
-                                continue
-                        
-                        # If not UK-registered or no company info, add as non-UK entity
-                        entity_data.append({
-                            'company_id': entity.get('etag', 'Unknown'),
-                            'company_name': entity.get('name', 'Unknown'),
-                            'etag': entity.get('etag', 'Unknown'),
-                            'nature_of_control': entity.get('natures_of_control', []),
-                            'link': '',
-                            'kind': entity.get('kind', 'Unknown'),
-                            'notified_on': entity.get('notified_on', 'No data found'),
-                            'locality': entity_address.get('locality', 'No locality found'),
-                            'accounts': {'last_accounts': {'period_end_on': 'NA'}},
-                            'previous_names': [],
-                            'filing_history': []
-                        })
+                # First, fetch the company info for this entity (not the current company being controlled)
+                other_company_name = entity.get('name', '')
+                if not other_company_name:
+                    logging.warning(f"Entity has no name, skipping")
                     continue
 
-                # Handling non-companies             
+                try:
+                    other_company_info, other_controllers = fetch_significant_controllers(other_company_name, entity)
+                except TreeBuildCancelled:
+                    raise
+                except Exception as e:
+                    logging.error(f"Failed to fetch significant controllers for {other_company_name}: {e}")
+                    if isinstance(e, TransientAPIError):
+                        missed(entity, 'controllers', e, current_company_info)
+
+                if not other_company_info:
+                    logging.warning(f"Entity {entity.get('name', 'Unknown')} not being traversed due to no company info found")
+                    continue
+
+                country_registered = other_company_info.get('identification', {}).get('country_registered', '')
+
+                # Check if company is UK-registered (using expanded UK check)
+                if country_registered and not is_uk_country(country_registered):
+                    logging.info(f"Skipping for non-UK company: {other_company_info['title']} registered in {country_registered}")
+                    continue
+
+                # Now process the entity using the correct company_info (the entity's own company info)
+                structured_data = process_entity(entity, other_company_info)
+
+            elif entity.get('kind') == 'individual-beneficial-owner':
+                logging.info(f"Skipping for individual beneficial owner: {entity.get('name', 'Unknown')}")
+
+                # need to pass details in entity_data here too
+
+                continue
+
+            # Handling entities with non-UK addresses but might be UK-registered
+            # We still want to check if they're UK-registered and traverse their controllers
+            elif not entity.get('ceased') and entity.get('kind') == 'corporate-entity-person-with-significant-control' and entity_country and not is_uk_country(entity_country):
+                logging.info(f"Processing entity with non-UK address: {entity.get('name', 'Unknown')} in {entity_country}")
+
+                # Still try to fetch company info - it might be UK-registered even if address is elsewhere
+                other_company_name = entity.get('name', '')
+                if not other_company_name or not entity.get('etag') or entity['etag'] in visited_entities:
+                    continue
+                visited_entities.add(entity['etag'])
+
+                try:
+                    other_company_info, other_controllers = fetch_significant_controllers(other_company_name, entity)
+                except TreeBuildCancelled:
+                    raise
+                except Exception as e:
+                    logging.error(f"Failed to fetch company info for {other_company_name}: {e}")
+                    if isinstance(e, TransientAPIError):
+                        # Don't add it as a non-UK entity, it may well be a UK company
+                        missed(entity, 'controllers', e, current_company_info)
+                        continue
+
+                # If UK-registered, process normally and traverse controllers
+                if other_company_info and is_uk_country(other_company_info.get('identification', {}).get('country_registered', '')):
+                    logging.info(f"Entity {other_company_name} is UK-registered, processing normally")
+                    structured_data = process_entity(entity, other_company_info)
+                else:
+                    # If not UK-registered or no company info, add as non-UK entity
+                    entity_data.append({
+                        'company_id': entity.get('etag', 'Unknown'),
+                        'company_name': entity.get('name', 'Unknown'),
+                        'etag': entity.get('etag', 'Unknown'),
+                        'nature_of_control': entity.get('natures_of_control', []),
+                        'link': '',
+                        'kind': entity.get('kind', 'Unknown'),
+                        'notified_on': entity.get('notified_on', 'No data found'),
+                        'locality': entity_address.get('locality', 'No locality found'),
+                        'accounts': {'last_accounts': {'period_end_on': 'NA'}},
+                        'previous_names': [],
+                        'filing_history': [],
+                        'controlled_company_id': current_company_info.get('company_number', ''),
+                        'controlled_company_name': current_company_info.get('title', '')
+                    })
+                    progress.found(entity_data[-1])
+                    continue
+
+            # Handling non-companies
+            else:
+                logging.info(f"Significant controllers for {current_company_info['title']} are non-company")
+                continue
+
+            # The company this entity controls, so the network doesn't have to infer edges from list order
+            structured_data['controlled_company_id'] = current_company_info.get('company_number', '')
+            structured_data['controlled_company_name'] = current_company_info.get('title', '')
+            entity_data.append(structured_data)
+            progress.found(structured_data)
+            logging.info(f"{structured_data['company_name']} added to list.")
+
+            # ALWAYS traverse its controllers if any, regardless of address country
+            # This ensures we go up the full chain
+            if other_controllers:
+                if max_depth and depth >= max_depth:
+                    logging.warning(f"Not traversing controllers of {structured_data['company_name']}, depth limit of {max_depth} reached")
+                    structured_data['truncated'] = True
                 else:
-                    logging.info(f"Significant controllers for {root_company_info['title']} are non-company")
-                    
+                    logging.info(f"Traversing controllers for {structured_data['company_name']}")
+                    stack.append((iter(other_controllers), other_company_info, depth + 1))
 
         return entity_data
     
     
     # Initial fetch for the root company
-    root_company_info, root_controllers = fetch_significant_controllers(company_name)
+    if company_number:
+        root_company_info = cache.fetch('company', (company_number, None), lambda: get_company_info(company_number))
+        root_controllers = fetch_active_controllers(root_company_info) if root_company_info else None
+        company_name = root_company_info.get('title', company_name) if root_company_info else company_name
+    else:
+        root_company_info, root_controllers = fetch_significant_controllers(company_name)
 
     # Handle cases where no sig controlers exist by returning base info
     
     if not root_controllers:
         logging.info(f"No significant controllers found for {company_name}")
+        progress.phase = 'done'
         return [{
         'company_id': root_company_info.get('company_number', 'Unknown'),
         'company_name': root_company_info.get('title', company_name),
@@ -646,10 +1710,30 @@ def get_company_tree(company_name):
         'locality': root_company_info.get('address_snippet', 'Unknown'),
         'accounts': {'last_accounts': {'period_end_on': 'NA'}},
         'previous_names': root_company_info.get('previous_company_names', []),
-        'filing_history': get_filing_history(root_company_info.get('company_number', 'Unknown')) if root_company_info.get('company_number') else {}
+        'filing_history': get_filing_history(root_company_info.get('company_number', 'Unknown')) if root_company_info.get('company_number') and not lazy else {}
         }] if root_company_info else []
 
-    visited_entities = set()
+    # Show the root straight away, its profile is filled in with the finished tree
+    if root_company_info:
+        root_company_number = root_company_info.get('company_number', '')
+        progress.found({
+            'company_id': root_company_number,
+            'company_name': root_company_info.get('title', company_name),
+            'etag': root_company_info.get('etag', f"root-{root_company_number}"),
+            'name': root_company_info.get('title', company_name),
+            'nature_of_control': [],
+            'link': construct_ch_link(root_company_number),
+            'kind': 'root',
+            'notified_on': 'N/A',
+            'locality': root_company_info.get('address_snippet', 'Unknown'),
+            'accounts': {},
+            'previous_names': [],
+            'filing_history': {}
+        })
+
+    # Fill the caches in parallel, the walk below then runs from memory in the same order as the sequential path
+    if concurrent and root_company_info:
+        prefetch_tree(root_company_info, root_controllers)
 
     # Traverse to get all entities
     entity_data = traverse_entities(root_controllers, root_company_info)
@@ -666,17 +1750,7 @@ def get_company_tree(company_name):
         )
         
         if not root_already_added:
-            try:
-                root_company_profile = get_company_profile(root_company_number)
-            except Exception as e:
-                logging.warning(f"Failed to get company profile for root company {root_company_info.get('title', 'Unknown')}: {e}")
-                root_company_profile = {}
-            
-            try:
-                root_filing_history = get_filing_history(root_company_number)
-            except Exception as e:
-                logging.info(f"Filing history not found for root company {root_company_info.get('title', 'Unknown')}: {e}")
-                root_filing_history = {}
+            root_company_profile, root_filing_history = fetch_company_details(root_company_number, root_company_info.get('title', 'Unknown'))
             
             root_entity = {
                 'company_id': root_company_number,
@@ -701,4 +1775,67 @@ def get_company_tree(company_name):
     for entity in entity_data:
         logging.info(f"Entity: {entity['company_name']} found in scraper.")
 
-    return entity_data
\ No newline at end of file
+    # Companies with controllers missing from the tree, or details missing, are marked so it's clear the tree is partial
+    incomplete_ids = {entry['controlled_company_id'] for entry in progress.incomplete if entry['missing'] == 'controllers'}
+    incomplete_ids |= {entry['company_number'] for entry in progress.incomplete if entry['missing'] == 'details'}
+    for entity in entity_data:
+        if entity.get('company_id') in incomplete_ids:
+            entity['incomplete'] = True
+    if progress.incomplete:
+        logging.warning(f"Tree for {company_name} is incomplete, {len(progress.incomplete)} entities couldn't be fetched: "
+                        f"{', '.join(entry['name'] for entry in progress.incomplete)}")
+
+    progress.discovered(len(entity_data))
+    progress.phase = 'done'
+    return entity_data
+
+def iter_company_tree(company_name, progress=None, **kwargs):
+    """
+    Builds a company tree on a background thread, yielding its entities as they are discovered, so
+    callers can show the first layer of controllers long before the whole tree is built. Closing the
+    generator early cancels the build.
+
+    Args:
+        company_name (str): The name of the company, as for get_company_tree.
+        progress (TreeProgress, optional): Tracks the build, a new one is used if not given.
+        **kwargs: Passed to get_company_tree.
+
+    Yields:
+        dict: Each entity as it is discovered, the root company first and every other entity after the
+            company it controls. Entities are provisional: the root's profile is only in the final tree.
+
+    Returns:
+        list: The finished tree, as returned by get_company_tree (the generator's StopIteration value).
+
+    Raises:
+        Whatever get_company_tree raised, once the entities found before the failure have been yielded.
+    """
+    progress = progress if progress is not None else TreeProgress()
+    outcome = {}
+
+    def build():
+        try:
+            outcome['tree'] = get_company_tree(company_name, progress=progress, **kwargs)
+        except BaseException as e:
+            outcome['error'] = e
+        finally:
+            progress.finish()
+
+    builder = threading.Thread(target=build, name='tree-stream', daemon=True)
+    builder.start()
+    yielded = 0
+    try:
+        while True:
+            new_entities = progress.entities_after(yielded)
+            yield from new_entities
+            yielded += len(new_entities)
+            if progress.finished and len(progress.entities) == yielded:
+                break
+    finally:
+        if builder.is_alive():
+            progress.cancelled.set()
+        builder.join()
+
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['tree']
@@ -0,0 +1,289 @@
+import os, io, re, csv, json, logging, sqlite3, zipfile, argparse, threading
+from datetime import datetime
+
+# Rows written per transaction while ingesting
+INGEST_BATCH_SIZE = 10000
+
+
+def normalise_name(name):
+    """
+    Normalises a company name for exact-match lookups, mirroring utils.normalise_company_name.
+
+    Args:
+        name (str): The company name.
+
+    Returns:
+        str: The name in lowercase with non-alphanumeric characters removed.
+    """
+    return re.sub(r'[^a-zA-Z0-9]', '', name or '').lower()
+
+
+def open_snapshot_file(path):
+    """
+    Opens a bulk data file as text for streaming. Zipped files (as published by Companies House)
+    are read from their first member without extracting them.
+
+    Args:
+        path (str): The path of a .csv, .txt/.json(l) or .zip file.
+
+    Returns:
+        file: A text file object.
+    """
+    if zipfile.is_zipfile(path):
+        archive = zipfile.ZipFile(path)
+        member = archive.namelist()[0]
+        logging.info(f"Reading {member} from {path}")
+        return io.TextIOWrapper(archive.open(member), encoding='utf-8-sig', newline='')
+    return open(path, 'r', encoding='utf-8-sig', newline='')
+
+
+def _iso_date(value):
+    """Converts the dd/mm/yyyy dates used in the company data product to the API's yyyy-mm-dd."""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value.strip(), '%d/%m/%Y').strftime('%Y-%m-%d')
+    except ValueError:
+        return value.strip()
+
+
+def company_row_to_profile(row):
+    """
+    Converts a row of the Companies House company data product (BasicCompanyData CSV) into the
+    shape returned by the company profile endpoint.
+
+    Args:
+        row (dict): The CSV row, with column names already stripped of whitespace.
+
+    Returns:
+        dict: A company profile.
+    """
+    company_number = row.get('CompanyNumber', '').strip()
+
+    previous_names = []
+    for i in range(1, 11):
+        name = row.get(f'PreviousName_{i}.CompanyName', '').strip()
+        if name:
+            previous_names.append({'name': name, 'ceased_on': _iso_date(row.get(f'PreviousName_{i}.CONDATE'))})
+
+    return {
+        'company_number': company_number,
+        'company_name': row.get('CompanyName', '').strip(),
+        'company_status': row.get('CompanyStatus', '').strip().lower(),
+        'company_category': row.get('CompanyCategory', '').strip(),
+        'country_of_origin': row.get('CountryOfOrigin', '').strip(),
+        'date_of_creation': _iso_date(row.get('IncorporationDate')),
+        'date_of_cessation': _iso_date(row.get('DissolutionDate')),
+        'registered_office_address': {
+            'care_of': row.get('RegAddress.CareOf', '').strip(),
+            'po_box': row.get('RegAddress.POBox', '').strip(),
+            'address_line_1': row.get('RegAddress.AddressLine1', '').strip(),
+            'address_line_2': row.get('RegAddress.AddressLine2', '').strip(),
+            'locality': row.get('RegAddress.PostTown', '').strip(),
+            'region': row.get('RegAddress.County', '').strip(),
+            'country': row.get('RegAddress.Country', '').strip(),
+            'postal_code': row.get('RegAddress.PostCode', '').strip(),
+        },
+        'accounts': {
+            'next_due': _iso_date(row.get('Accounts.NextDueDate')),
+            'last_accounts': {
+                'made_up_to': _iso_date(row.get('Accounts.LastMadeUpDate')),
+                'period_end_on': _iso_date(row.get('Accounts.LastMadeUpDate')),
+                'type': row.get('Accounts.AccountCategory', '').strip().lower(),
+            },
+        },
+        'sic_codes': [row[key].strip() for key in row if key.startswith('SICCode.') and row[key] and row[key].strip()],
+        'previous_company_names': previous_names,
+        'links': {'self': f"/company/{company_number}"},
+    }
+
+
+class SnapshotStore:
+    """
+    Local, indexed store of Companies House bulk data (company profiles and PSC records),
+    backed by SQLite so it can be queried without loading the files into memory.
+
+    Args:
+        path (str): The path of the SQLite database file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS companies (
+                company_number TEXT PRIMARY KEY,
+                company_name TEXT NOT NULL,
+                name_key TEXT NOT NULL,
+                profile TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS companies_name_key ON companies (name_key);
+            CREATE TABLE IF NOT EXISTS pscs (
+                company_number TEXT NOT NULL,
+                etag TEXT NOT NULL,
+                ceased INTEGER NOT NULL,
+                record TEXT NOT NULL,
+                PRIMARY KEY (company_number, etag)
+            );
+        """)
+
+    def _write_batches(self, sql, rows):
+        """Writes rows in batches of INGEST_BATCH_SIZE, returning the number written."""
+        count = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= INGEST_BATCH_SIZE:
+                with self._lock, self._conn:
+                    self._conn.executemany(sql, batch)
+                count += len(batch)
+                logging.info(f"Ingested {count} rows into {self.path}")
+                batch = []
+        if batch:
+            with self._lock, self._conn:
+                self._conn.executemany(sql, batch)
+            count += len(batch)
+        return count
+
+    def ingest_companies(self, path):
+        """
+        Streams a company data product file (BasicCompanyData CSV, optionally zipped) into the store.
+
+        Args:
+            path (str): The path of the file.
+
+        Returns:
+            int: The number of companies ingested.
+        """
+        def rows():
+            with open_snapshot_file(path) as f:
+                reader = csv.DictReader(f)
+                # Some published headers have a leading space, e.g. ' CompanyNumber'
+                reader.fieldnames = [name.strip() for name in reader.fieldnames]
+                for row in reader:
+                    profile = company_row_to_profile(row)
+                    if not profile['company_number']:
+                        continue
+                    yield (profile['company_number'], profile['company_name'], normalise_name(profile['company_name']), json.dumps(profile))
+
+        count = self._write_batches(
+            "INSERT OR REPLACE INTO companies (company_number, company_name, name_key, profile) VALUES (?, ?, ?, ?)",
+            rows()
+        )
+        logging.info(f"Ingested {count} companies from {path}")
+        return count
+
+    def ingest_pscs(self, path):
+        """
+        Streams a PSC snapshot file (one JSON object per line, optionally zipped) into the store.
+
+        Each line is {"company_number": ..., "data": {...PSC record...}}. Summary lines
+        (kind 'totals#...') are skipped.
+
+        Args:
+            path (str): The path of the file.
+
+        Returns:
+            int: The number of PSC records ingested.
+        """
+        def rows():
+            with open_snapshot_file(path) as f:
+                for line_number, line in enumerate(f, start=1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        logging.warning(f"Skipping invalid JSON on line {line_number} of {path}")
+                        continue
+
+                    data = record.get('data', {})
+                    company_number = record.get('company_number')
+                    if not company_number or data.get('kind', '').startswith('totals#'):
+                        continue
+
+                    etag = data.get('etag') or data.get('links', {}).get('self', f"{company_number}-{line_number}")
+                    yield (company_number, etag, 1 if data.get('ceased_on') or data.get('ceased') else 0, json.dumps(data))
+
+        count = self._write_batches(
+            "INSERT OR REPLACE INTO pscs (company_number, etag, ceased, record) VALUES (?, ?, ?, ?)",
+            rows()
+        )
+        logging.info(f"Ingested {count} PSC records from {path}")
+        return count
+
+    def get_profile(self, company_number):
+        """
+        Returns the stored profile for a company, or None if it isn't in the snapshot.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT profile FROM companies WHERE company_number = ?", (company_number,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_pscs(self, company_number):
+        """
+        Returns every stored PSC record for a company, active ones first.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT record FROM pscs WHERE company_number = ? ORDER BY ceased, rowid", (company_number,)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def search(self, name, limit=20):
+        """
+        Finds companies by name. Exact matches on the normalised name come first, followed by
+        names starting with it.
+
+        Args:
+            name (str): The name to search for.
+            limit (int, optional): The maximum number of profiles to return.
+
+        Returns:
+            list: Matching company profiles.
+        """
+        name_key = normalise_name(name)
+        if not name_key:
+            return []
+
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT profile FROM companies WHERE name_key = ? LIMIT ?", (name_key, limit)
+            ).fetchall()
+            if len(rows) < limit:
+                rows += self._conn.execute(
+                    "SELECT profile FROM companies WHERE name_key > ? AND name_key < ? ORDER BY name_key LIMIT ?",
+                    (name_key, name_key + '\uffff', limit - len(rows))
+                ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def counts(self):
+        """Returns the number of companies and PSC records in the store."""
+        with self._lock:
+            companies = self._conn.execute("SELECT COUNT(*) FROM companies").fetchone()[0]
+            pscs = self._conn.execute("SELECT COUNT(*) FROM pscs").fetchone()[0]
+        return {'companies': companies, 'pscs': pscs}
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Ingest Companies House bulk data files into a local snapshot store.")
+    parser.add_argument('--db', required=True, help="Path of the SQLite snapshot store to create or update.")
+    parser.add_argument('--companies', nargs='*', default=[], help="Company data product CSV/zip files.")
+    parser.add_argument('--psc', nargs='*', default=[], help="PSC snapshot JSON lines/zip files.")
+    args = parser.parse_args()
+
+    store = SnapshotStore(args.db)
+    for companies_path in args.companies:
+        store.ingest_companies(companies_path)
+    for psc_path in args.psc:
+        store.ingest_pscs(psc_path)
+    logging.info(f"Snapshot store {args.db} now holds {store.counts()}")
@@ -0,0 +1,20 @@
+import os, sys
+import pytest
+
+# Keep the suite off the disk caches and importable from the repository root
+os.environ.setdefault('CH_CACHE', '0')
+os.environ.setdefault('TREE_CACHE_SPILL', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from snapshot_store import SnapshotStore
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+@pytest.fixture
+def store(tmp_path):
+    """A snapshot store holding the company and PSC fixtures."""
+    store = SnapshotStore(str(tmp_path / 'snapshot.db'))
+    store.ingest_companies(os.path.join(FIXTURES, 'companies.csv'))
+    store.ingest_pscs(os.path.join(FIXTURES, 'psc.jsonl'))
+    return store
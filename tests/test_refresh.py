@@ -0,0 +1,63 @@
+import json, hashlib
+import pytest
+import scraper, refresh
+from data_sources import SnapshotDataSource, HttpDataSource, PSC_ROUTE
+from mock_server import MockCompaniesHouseServer
+
+
+class EtagSnapshotSource(SnapshotDataSource):
+    """Gives PSC list pages an etag, as the API does, so the mock server can answer 304."""
+
+    def get(self, endpoint, params=None):
+        body = super().get(endpoint, params)
+        if PSC_ROUTE.match(endpoint):
+            body['etag'] = hashlib.sha1(json.dumps(body, sort_keys=True).encode('utf-8')).hexdigest()
+        return body
+
+
+class RecordingSource(HttpDataSource):
+    """Keeps the status code of every response."""
+
+    def __init__(self, base_url, session):
+        super().__init__(base_url, session)
+        self.statuses = []
+
+    def send(self, endpoint, params=None, headers=None, timeout=30):
+        response = super().send(endpoint, params=params, headers=headers, timeout=timeout)
+        self.statuses.append(response.status_code)
+        return response
+
+
+@pytest.fixture
+def source(store, monkeypatch):
+    # Etags kept in the state must be enough, without the response cache
+    monkeypatch.setattr(scraper, 'response_cache', None)
+    with MockCompaniesHouseServer(EtagSnapshotSource(store)) as server:
+        source = RecordingSource(server.url, scraper.transport)
+        scraper.set_data_source(source)
+        yield source
+    scraper.set_data_source()
+
+
+def test_refresh_sends_kept_etags(source, store, tmp_path):
+    state = refresh.build_tree_state('00000001')
+    assert refresh.refresh_tree(state)['refetched'] == []
+    assert set(state['psc_etags']) == {'00000001', '00000002', 'SC000003'}
+
+    # Nothing changed, so every PSC list is answered with a 304
+    source.statuses.clear()
+    diff = refresh.refresh_tree(state)
+    assert diff == {'added': [], 'removed': [], 'changed': [], 'refetched': []}
+    assert source.statuses == [304, 304, 304]
+
+    # A new controller of BETA GROUP is picked up
+    new_psc = tmp_path / 'new_psc.jsonl'
+    new_psc.write_text(json.dumps({'company_number': '00000002', 'data': {
+        'kind': 'corporate-entity-person-with-significant-control', 'name': 'OLD PARENT LIMITED', 'etag': 'etag-beta-old',
+        'natures_of_control': ['ownership-of-shares-25-to-50-percent'], 'address': {'country': 'England'},
+        'identification': {'place_registered': 'Companies House', 'country_registered': 'England', 'registration_number': '4'},
+    }}) + '\n')
+    store.ingest_pscs(str(new_psc))
+    diff = refresh.refresh_tree(state)
+    assert diff['refetched'] == ['00000002']
+    assert [entity['company_id'] for entity in diff['added']] == ['00000004']
@@ -0,0 +1,44 @@
+import pytest
+import scraper
+from data_sources import SnapshotDataSource, HttpDataSource, FixtureDataSource
+from response_cache import ResponseCache
+from mock_server import MockCompaniesHouseServer
+
+TREE = {'00000001': None, '00000002': '00000001', 'SC000003': '00000002', 'etag-alpha-kyiv': '00000001'}
+
+
+def tree_controllers():
+    tree = scraper.get_company_tree('ALPHA HOLDINGS LIMITED', company_number='00000001')
+    return {entity['company_id']: entity.get('controlled_company_id') for entity in tree}
+
+
+@pytest.fixture
+def server(store, tmp_path, monkeypatch):
+    """Serves the snapshot over HTTP, with the scraper pointed at it through a fresh response cache."""
+    monkeypatch.setattr(scraper, 'response_cache', ResponseCache(str(tmp_path / 'cache.sqlite3')))
+    monkeypatch.setattr(scraper, 'fixture_recorder', None)
+    with MockCompaniesHouseServer(SnapshotDataSource(store)) as server:
+        scraper.set_data_source(HttpDataSource(server.url, scraper.transport))
+        yield server
+    scraper.set_data_source()
+
+
+def test_record_then_replay(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(scraper, 'fixture_recorder', FixtureDataSource(str(tmp_path / 'fixtures')))
+    assert tree_controllers() == TREE
+
+    scraper.set_data_source(FixtureDataSource(str(tmp_path / 'fixtures')))
+    assert tree_controllers() == TREE
+
+
+def test_record_with_warm_cache(server, tmp_path, monkeypatch):
+    assert tree_controllers() == TREE
+    requests_made = server.request_count
+
+    # Every response now comes from the cache, and must still be recorded
+    monkeypatch.setattr(scraper, 'fixture_recorder', FixtureDataSource(str(tmp_path / 'fixtures')))
+    assert tree_controllers() == TREE
+    assert server.request_count == requests_made
+
+    scraper.set_data_source(FixtureDataSource(str(tmp_path / 'fixtures')))
+    assert tree_controllers() == TREE
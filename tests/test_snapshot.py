@@ -0,0 +1,41 @@
+import pytest
+import scraper
+from data_sources import SnapshotDataSource
+
+
+@pytest.fixture
+def snapshot_source(store):
+    scraper.set_data_source(SnapshotDataSource(store))
+    yield store
+    scraper.set_data_source()
+
+
+def test_ingest(store):
+    # The blank company row, the totals line and the invalid line are skipped
+    assert store.counts() == {'companies': 4, 'pscs': 5}
+
+    profile = store.get_profile('00000001')
+    assert profile['company_name'] == 'ALPHA HOLDINGS LIMITED'
+    assert profile['date_of_creation'] == '2010-02-01'
+    assert profile['previous_company_names'] == [{'name': 'ALPHA TRADING LIMITED', 'ceased_on': '2015-06-15'}]
+
+    # Active PSCs come before ceased ones
+    names = [psc['name'] for psc in store.get_pscs('00000001')]
+    assert names[-1] == 'OLD PARENT LIMITED'
+    assert [profile['company_number'] for profile in store.search('gamma plc')] == ['SC000003']
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_tree_from_snapshot(snapshot_source, lazy):
+    tree = scraper.get_company_tree('ALPHA HOLDINGS LIMITED', concurrent=lazy, company_number='00000001', lazy=lazy)
+    controllers = {entity['company_id']: entity.get('controlled_company_id') for entity in tree}
+
+    assert tree[0]['company_id'] == '00000001'
+    # The ceased parent and the individual are left out, the Ukrainian company is a leaf without a link
+    assert controllers == {'00000001': None, '00000002': '00000001', 'SC000003': '00000002', 'etag-alpha-kyiv': '00000001'}
+    assert [entity['link'] for entity in tree if entity['company_id'] == 'etag-alpha-kyiv'] == ['']
+
+
+def test_tree_by_name(snapshot_source):
+    tree = scraper.get_company_tree('Alpha Holdings Limited')
+    assert [entity['company_id'] for entity in tree][:3] == ['00000001', '00000002', 'SC000003']
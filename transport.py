@@ -0,0 +1,163 @@
+import os, logging, threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+# Connections kept alive, and requests in flight, per host. Callers beyond the limit wait for a
+# free connection instead of opening one that is thrown away afterwards.
+TRANSPORT_MAX_PER_HOST = int(os.getenv('TRANSPORT_MAX_PER_HOST', '16'))
+# Per-host overrides as host=limit pairs, e.g. "document-api.company-information.service.gov.uk=4"
+TRANSPORT_HOST_LIMITS = os.getenv('TRANSPORT_HOST_LIMITS', '')
+# Redirects followed per request
+TRANSPORT_MAX_REDIRECTS = 5
+
+# The API and the document API live under this domain, so auth headers follow redirects within it
+CH_DOMAIN = 'company-information.service.gov.uk'
+
+
+def parse_host_limits(value):
+    """Parses "host=limit,host=limit" into a dict, ignoring malformed pairs."""
+    limits = {}
+    for pair in value.split(','):
+        host, _, limit = pair.strip().partition('=')
+        if host and limit.strip().isdigit():
+            limits[host.strip().lower()] = int(limit)
+        elif pair.strip():
+            logging.warning(f"Ignoring malformed host limit: {pair}")
+    return limits
+
+
+class _Session(requests.Session):
+    """A session that keeps the Authorization header on redirects between trusted hosts."""
+
+    def __init__(self, auth_domains):
+        super().__init__()
+        self.auth_domains = auth_domains
+
+    def should_strip_auth(self, old_url, new_url):
+        host = (urlsplit(new_url).hostname or '').lower()
+        if any(host == domain or host.endswith('.' + domain) for domain in self.auth_domains):
+            return False
+        return super().should_strip_auth(old_url, new_url)
+
+
+class _HostSlot:
+    """A host's connection pool size and the semaphore bounding its requests in flight."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.semaphore = threading.BoundedSemaphore(limit)
+
+
+class Transport:
+    """
+    One HTTP client for the JSON API and the document API, so every request reuses kept-alive
+    connections instead of paying a TLS handshake each time.
+
+    Each host gets its own connection pool, sized to its concurrency limit, and at most that many
+    requests are in flight to it at once. A streamed response holds its slot until it is closed, so
+    large downloads can't open more connections than the pool keeps. Redirects are followed automatically,
+    and the auth headers are kept when the redirect stays within auth_domains. Elsewhere, e.g. the
+    pre-signed storage URLs documents are served from, they are dropped as requests normally does.
+    Safe to share between threads.
+
+    Args:
+        headers (dict, optional): Headers sent with every request, e.g. Authorization.
+        auth_domains (iterable, optional): Domains (and their subdomains) that auth headers are forwarded to on redirects.
+        max_per_host (int, optional): The default connections and requests in flight per host.
+        host_limits (dict, optional): Host to limit, overriding max_per_host.
+        max_redirects (int, optional): Redirects followed per request.
+    """
+
+    def __init__(self, headers=None, auth_domains=(CH_DOMAIN,), max_per_host=TRANSPORT_MAX_PER_HOST, host_limits=None,
+                 max_redirects=TRANSPORT_MAX_REDIRECTS):
+        self.session = _Session(tuple(domain.lower() for domain in auth_domains))
+        self.session.max_redirects = max_redirects
+        if headers:
+            self.session.headers.update(headers)
+        # Hosts only reached through redirects share these pools, kept alive like the others
+        for prefix in ('https://', 'http://'):
+            self.session.mount(prefix, HTTPAdapter(pool_maxsize=max_per_host))
+        self.max_per_host = max_per_host
+        self.host_limits = {host.lower(): limit for host, limit in (host_limits or {}).items()}
+        self._hosts = {}
+        self._lock = threading.Lock()
+        self._counters = {'requests': 0, 'waits': 0}
+
+    @classmethod
+    def from_env(cls, headers=None, auth_domains=(CH_DOMAIN,)):
+        """Builds the transport from the TRANSPORT_* environment variables."""
+        return cls(headers=headers, auth_domains=auth_domains, host_limits=parse_host_limits(TRANSPORT_HOST_LIMITS))
+
+    def _slot(self, url):
+        """Returns a URL's host slot, mounting a connection pool for the host the first time."""
+        parts = urlsplit(url)
+        host = (parts.hostname or '').lower()
+        with self._lock:
+            slot = self._hosts.get(host)
+            if slot is None:
+                slot = self._hosts[host] = _HostSlot(self.host_limits.get(host, self.max_per_host))
+                prefix = f"{parts.scheme}://{parts.netloc}/"
+                self.session.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=slot.limit))
+                logging.info(f"Opened a pool of {slot.limit} connections to {host}")
+            self._counters['requests'] += 1
+        return slot
+
+    def request(self, method, url, stream=False, **kwargs):
+        """
+        Sends a request, waiting first if the host already has its limit of requests in flight.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The full URL.
+            stream (bool, optional): Leave the body unread, to iterate it with iter_content. Close the
+                response (or use it as a context manager) to release the host's slot.
+            **kwargs: Passed to requests, e.g. params, headers, timeout, allow_redirects.
+
+        Returns:
+            requests.Response: The final response after any redirects.
+        """
+        slot = self._slot(url)
+        if not slot.semaphore.acquire(blocking=False):
+            with self._lock:
+                self._counters['waits'] += 1
+            slot.semaphore.acquire()
+
+        try:
+            response = self.session.request(method, url, stream=stream, **kwargs)
+        except BaseException:
+            slot.semaphore.release()
+            raise
+
+        if not stream:
+            slot.semaphore.release()
+            return response
+
+        # The connection is busy until the response is closed
+        released = threading.Event()
+        close = response.close
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                if not released.is_set():
+                    released.set()
+                    slot.semaphore.release()
+
+        response.close = close_and_release
+        return response
+
+    def get(self, url, **kwargs):
+        """Sends a GET request, see request."""
+        return self.request('GET', url, **kwargs)
+
+    def stats(self):
+        """
+        Returns request counters and the limit of every host used so far.
+
+        Returns:
+            dict: requests, waits (requests that queued for a slot) and hosts.
+        """
+        with self._lock:
+            return dict(self._counters, hosts={host: slot.limit for host, slot in self._hosts.items()})
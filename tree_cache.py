@@ -0,0 +1,137 @@
+import os, re, json, logging, tempfile, threading, time
+from collections import OrderedDict
+from response_cache import ResponseCache
+
+# Trees kept in memory, and their total size as JSON
+TREE_CACHE_ENTRIES = int(os.getenv('TREE_CACHE_ENTRIES', '64'))
+TREE_CACHE_MAX_MB = int(os.getenv('TREE_CACHE_MAX_MB', '256'))
+# Seconds a built tree is served before it is rebuilt
+TREE_CACHE_TTL = int(os.getenv('TREE_CACHE_TTL', str(60 * 60)))
+# Trees evicted from memory spill to this SQLite file, which other processes share. TREE_CACHE_SPILL=0 disables it.
+TREE_CACHE_PATH = os.getenv('TREE_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'ch_tree_cache.sqlite3'))
+TREE_CACHE_SPILL_MAX_MB = int(os.getenv('TREE_CACHE_SPILL_MAX_MB', '1024'))
+
+
+class TreeCache:
+    """
+    Server-side cache of built company trees (or anything JSON-serialisable built from them),
+    keyed on company number. Recently used trees are kept in memory, bounded by entry count and
+    total size, and expire after a TTL. With a spill path, every tree is also written to a SQLite
+    file (a ResponseCache) so other processes serving the app can use it, and trees evicted from
+    memory are read back from there instead of being rebuilt. Safe to share between threads.
+
+    Args:
+        max_entries (int, optional): Trees kept in memory.
+        max_bytes (int, optional): Total JSON size of the trees kept in memory.
+        ttl (float, optional): Seconds a tree is served for.
+        spill_path (str, optional): SQLite file shared between processes, None to keep trees in memory only.
+        spill_max_bytes (int, optional): Size cap of the SQLite file's trees.
+    """
+
+    def __init__(self, max_entries=TREE_CACHE_ENTRIES, max_bytes=TREE_CACHE_MAX_MB * 1024 * 1024, ttl=TREE_CACHE_TTL,
+                 spill_path=None, spill_max_bytes=TREE_CACHE_SPILL_MAX_MB * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'spill_hits': 0, 'misses': 0, 'evictions': 0}
+        self.spill = ResponseCache(spill_path, max_bytes=spill_max_bytes, ttls=[(re.compile(''), ttl)]) if spill_path else None
+
+    @classmethod
+    def from_env(cls):
+        """Builds the cache from the TREE_CACHE_* environment variables."""
+        return cls(spill_path=TREE_CACHE_PATH if os.getenv('TREE_CACHE_SPILL', '1') != '0' else None)
+
+    @staticmethod
+    def _spill_key(key):
+        return f"tree/{key}"
+
+    def get(self, key):
+        """
+        Returns a cached value, or None if it isn't cached or has expired.
+
+        Args:
+            key (str): The company number.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now < entry[2]:
+                self._entries.move_to_end(key)
+                self._counters['hits'] += 1
+                return entry[0]
+            if entry is not None:
+                self._remove(key)
+
+        if self.spill is not None:
+            cached = self.spill.get(self._spill_key(key))
+            if cached is not None and cached.fresh:
+                with self._lock:
+                    self._counters['spill_hits'] += 1
+                    # Expires when the spilled tree does, reading it doesn't extend its life
+                    self._store(key, cached.body, len(json.dumps(cached.body)), cached.fetched_at + self.ttl)
+                return cached.body
+
+        with self._lock:
+            self._counters['misses'] += 1
+        return None
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores a value, evicting the least recently used values from memory if over the caps.
+
+        Args:
+            key (str): The company number.
+            value: A JSON-serialisable value, e.g. the tree and its Cytoscape elements.
+            ttl (float, optional): Seconds to serve this value for, if shorter than the cache's TTL.
+                Such values are kept in memory only, e.g. a partial tree that should be rebuilt soon.
+        """
+        size = len(json.dumps(value))
+        if self.spill is not None and ttl is None:
+            self.spill.set(self._spill_key(key), None, value)
+        with self._lock:
+            self._store(key, value, size, time.time() + min(ttl if ttl is not None else self.ttl, self.ttl))
+
+    def invalidate(self, key):
+        """Removes a value, e.g. after the tree was refreshed."""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+        if self.spill is not None:
+            self.spill.invalidate(self._spill_key(key))
+
+    def _store(self, key, value, size, expires_at):
+        """Stores a value in memory. Expects the lock to be held."""
+        if key in self._entries:
+            self._remove(key)
+        if size > self.max_bytes:
+            # Too big to keep in memory, it is still served from the spill file
+            logging.info(f"Tree for {key} ({size} bytes) is larger than the in-memory cache")
+            return
+        self._entries[key] = (value, size, expires_at)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            evicted, _ = next(iter(self._entries.items()))
+            self._remove(evicted)
+            self._counters['evictions'] += 1
+
+    def _remove(self, key):
+        """Removes a value from memory. Expects the lock to be held."""
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self):
+        """
+        Returns hit/miss counters and the in-memory size.
+
+        Returns:
+            dict: hits, spill_hits, misses, evictions, entries and bytes.
+        """
+        with self._lock:
+            return dict(self._counters, entries=len(self._entries), bytes=self._bytes)
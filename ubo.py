@@ -0,0 +1,206 @@
+import os, re, csv, sys, logging, argparse
+import batch
+
+# Natures of control that carry a percentage band, e.g. ownership-of-shares-25-to-50-percent-as-trust
+NATURE_OF_CONTROL_BAND = re.compile(
+    r'^(?:part-)?(?P<kind>ownership-of-shares|voting-rights|right-to-share-surplus-assets)-'
+    r'(?:(?P<low>\d+)-to-(?P<high>\d+)|more-than-(?P<more>\d+))-percent'
+)
+
+# The bands counted for each measure. LLPs report surplus assets rather than shares.
+MEASURES = {
+    'ownership': ('ownership-of-shares', 'right-to-share-surplus-assets'),
+    'voting': ('voting-rights',),
+}
+
+
+def control_range(natures_of_control, measure='ownership'):
+    """
+    Converts natures of control into the range of the controlled company held.
+
+    Args:
+        natures_of_control (list): Natures of control of one PSC record.
+        measure (str, optional): 'ownership' or 'voting', a key of MEASURES.
+
+    Returns:
+        tuple: (low, high) fractions, e.g. (0.25, 0.5), or None if no band for the measure is given.
+    """
+    kinds = MEASURES[measure]
+    best = None
+    for nature in natures_of_control or []:
+        match = NATURE_OF_CONTROL_BAND.match(nature)
+        if not match or match.group('kind') not in kinds:
+            continue
+        if match.group('more'):
+            band = (int(match.group('more')) / 100, 1.0)
+        else:
+            band = (int(match.group('low')) / 100, int(match.group('high')) / 100)
+        # The same holding can be reported more than once (directly and as a trust), keep the highest band
+        best = band if best is None else max(best, band)
+    return best
+
+
+class UBOEngine:
+    """
+    Computes effective ownership through multi-layer chains of an ownership graph, with an edge
+    from each controller to the company it controls carrying nature_of_control (as built by
+    utils.create_interlock_network, or a graph_store.CompactGraph).
+
+    Each edge's band becomes a (low, high) range. Ranges are multiplied along each path, and summed
+    across parallel paths (capped at 100%). Results are memoised per company, so the holdings of a
+    shared parent are computed once however many companies sit below it. Edges that close a cycle
+    (cross-holdings) are found once up front and ignored, so results don't depend on query order.
+
+    Args:
+        graph (networkx.DiGraph or CompactGraph): The ownership graph.
+        measure (str, optional): 'ownership' or 'voting', a key of MEASURES.
+    """
+
+    def __init__(self, graph, measure='ownership'):
+        if measure not in MEASURES:
+            raise ValueError(f"Unknown measure {measure}, expected one of {', '.join(MEASURES)}")
+        self.graph = graph
+        self.measure = measure
+        self.cyclic_edges = self._find_cyclic_edges()
+        self._holdings = {}
+        if self.cyclic_edges:
+            logging.warning(f"Ignoring {len(self.cyclic_edges)} edges that close ownership cycles")
+
+    def _find_cyclic_edges(self):
+        """Returns the back edges of an iterative depth-first search, removing them leaves a DAG."""
+        state = {}  # 1 while on the stack, 2 once finished
+        cyclic_edges = set()
+        # Start from the top of the chains, so the edges dropped are the ones pointing back up
+        starts = sorted(self.graph.nodes, key=lambda node: self.graph.in_degree[node] > 0)
+        for start in starts:
+            if start in state:
+                continue
+            state[start] = 1
+            stack = [(start, iter(self.graph.successors(start)))]
+            while stack:
+                node, successors = stack[-1]
+                successor = next(successors, None)
+                if successor is None:
+                    state[node] = 2
+                    stack.pop()
+                elif state.get(successor) == 1:
+                    cyclic_edges.add((node, successor))
+                elif successor not in state:
+                    state[successor] = 1
+                    stack.append((successor, iter(self.graph.successors(successor))))
+        return cyclic_edges
+
+    def _direct_owners(self, company):
+        """Yields (owner, (low, high)) for each edge into a company that carries a band."""
+        for owner in self.graph.predecessors(company):
+            if (owner, company) in self.cyclic_edges:
+                continue
+            band = control_range(self.graph[owner][company].get('nature_of_control', []), self.measure)
+            if band:
+                yield owner, band
+
+    def holdings(self, company):
+        """
+        Returns everyone holding part of a company, directly or through other companies.
+
+        Args:
+            company (str): The company's node in the graph.
+
+        Returns:
+            dict: Owner node to (low, high) effective fraction of the company.
+        """
+        if company in self._holdings:
+            return self._holdings[company]
+        if company not in self.graph:
+            raise ValueError(f"{company} is not in the ownership graph")
+
+        # Post-order over the owners still to compute, iteratively so long chains don't hit the recursion limit
+        stack = [(company, False)]
+        while stack:
+            node, owners_done = stack.pop()
+            if node in self._holdings:
+                continue
+            if not owners_done:
+                stack.append((node, True))
+                stack.extend((owner, False) for owner, _ in self._direct_owners(node) if owner not in self._holdings)
+                continue
+
+            totals = {}
+            for owner, (low, high) in self._direct_owners(node):
+                # The direct holding, then everything held through the owner
+                paths = [(owner, low, high)]
+                paths += [(ultimate, low * owner_low, high * owner_high)
+                          for ultimate, (owner_low, owner_high) in self._holdings[owner].items()]
+                for ultimate, path_low, path_high in paths:
+                    total_low, total_high = totals.get(ultimate, (0.0, 0.0))
+                    totals[ultimate] = (min(total_low + path_low, 1.0), min(total_high + path_high, 1.0))
+            self._holdings[node] = totals
+
+        return self._holdings[company]
+
+    def top_controllers(self, company, threshold=0.0, include_intermediate=False):
+        """
+        Answers which corporate controllers sit at the top of a company's ownership chains.
+
+        Trees only follow corporate PSCs, so the graph holds no individuals and these are the
+        highest companies reached, not the beneficial owners. Their own individual PSCs (or a
+        non-UK parent the tree stopped at) are what ultimately own the company.
+
+        Args:
+            company (str): The company's node in the graph.
+            threshold (float, optional): Only return controllers whose upper bound exceeds this fraction, e.g. 0.25.
+            include_intermediate (bool, optional): Also return controllers that are themselves owned by others in the graph.
+
+        Returns:
+            list: Dicts of owner, number, low and high, largest holding first.
+        """
+        owners = []
+        for owner, (low, high) in self.holdings(company).items():
+            if high <= threshold:
+                continue
+            if not include_intermediate and any(True for _ in self._direct_owners(owner)):
+                continue
+            owners.append({'owner': owner, 'number': self.graph.nodes[owner].get('number', ''), 'low': low, 'high': high})
+        return sorted(owners, key=lambda row: (-row['high'], -row['low'], row['owner']))
+
+    def batch(self, companies, threshold=0.0, include_intermediate=False):
+        """
+        Answers top_controllers for many companies, sharing the memoised holdings between them.
+
+        Returns:
+            dict: Company node to its list of top controllers. Companies not in the graph are left out.
+        """
+        results = {}
+        for company in companies:
+            if company not in self.graph:
+                logging.warning(f"{company} is not in the ownership graph")
+                continue
+            results[company] = self.top_controllers(company, threshold, include_intermediate)
+        return results
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Find the top corporate controllers of many companies through multi-layer ownership chains.")
+    parser.add_argument('companies', nargs='+', help="Company numbers, or files of company numbers (.txt or .csv).")
+    parser.add_argument('--measure', choices=list(MEASURES), default='ownership')
+    parser.add_argument('--threshold', type=float, default=0.25, help="Only report controllers that may hold more than this fraction.")
+    parser.add_argument('--intermediate', action='store_true', help="Also report controllers that are owned by others.")
+    parser.add_argument('--workers', type=int, default=batch.BATCH_MAX_WORKERS, help="Trees built concurrently.")
+    args = parser.parse_args()
+
+    company_numbers = []
+    for item in args.companies:
+        company_numbers.extend(batch.read_company_numbers(item) if os.path.isfile(item) else [item])
+
+    trees = batch.build_trees(company_numbers, max_workers=args.workers)
+    merged, _ = batch.merge_trees(trees)
+    engine = UBOEngine(merged, measure=args.measure)
+    roots = {tree[0]['company_name']: number for number, tree in trees.items() if tree}
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['company_number', 'company_name', 'owner_number', 'owner_name', 'low', 'high'])
+    for company, owners in engine.batch(roots, args.threshold, args.intermediate).items():
+        for row in owners:
+            writer.writerow([roots[company], company, row['number'], row['owner'], f"{row['low']:.4f}", f"{row['high']:.4f}"])
@@ -1,6 +1,6 @@
 import re, logging, yaml
 import networkx as nx
-from scraper import get_filing_history
+from scraper import get_company_details
 
 # Helper to normalise names
 def normalise_company_name(name):
@@ -65,79 +65,129 @@ DESCRIPTIONS_DICT = load_descriptions('yamls/filing_history_descriptions.yml')
 NATURE_OF_CONTROL_DICT = load_descriptions('yamls/psc_descriptions.yml')
 
 # Create the network
-def create_interlock_network(entity_data):
+def iter_interlock_network(entity_data):
     """
-    Creates a network graph representing the relationships between companies and entities.
+    Walks the entity data once, yielding the nodes and the controller -> controlled edges of the
+    interlock network, so graph representations other than networkx can be built with the same rules.
 
     Inputs:
-        entity_data: A list of dictionaries containing company and entity information.
+        entity_data: A list of dictionaries containing company and entity information, each non-root
+            entity naming the company it controls in controlled_company_name.
 
     Outputs:
-        G: A NetworkX graph representing the interlock between companies and entities.
+        Tuples of ('node', name, attributes) and ('edge', controller, controlled, attributes) in the order
+        they are added. A node may be yielded again with attributes to update.
     """
-    # Create the graph
-    G = nx.Graph()
-    # Set nodes for the initial company, and the last visited one
     top_company_node = None
-    root_company_node = None
 
-    # Empty set of nodes that have been created
-    visited_nodes = set()
-    
-    # Now we loop over the entity data to display all companies
     for idx, data in enumerate(entity_data):
         # Make sure there is a dict
         if not isinstance(data, dict):
             logging.error("Node data is not a dict")
             raise ValueError("Node data is not a dictionary.")
-        
-        logging.info(f"Adding {data['company_name']} to network.")
+
         company_node = data['company_name']
 
         # Identify the root company (first item or item with kind='root')
-        if root_company_node is None:
-            if data.get('kind') == 'root' or idx == 0:
-                root_company_node = company_node
-                top_company_node = company_node
-                logging.info(f'Root company identified: {company_node}')
-
-        # Add node to graph
-        logging.info(f'Adding node {data['company_name']}')
-        G.add_node(company_node, 
-                bipartite=0, 
-                label=data['company_name'],
-                number=data['company_id'],
-                type='company',
-                previous_names=data['previous_names'], 
-                link=data.get('link', ''),
-                period_end=data.get('accounts', {}).get('last_accounts', {}).get('period_end_on', ''))
-        visited_nodes.add(company_node)
-
-        # Create edges: connect to root if this is a direct controller of root
-        # Otherwise, connect to previous node (creating a chain structure)
-        if root_company_node and company_node != root_company_node:
-            # If this is likely a direct controller of root (comes right after root in list)
-            # and has nature_of_control, connect it to root
-            if idx == 1 and data.get('nature_of_control'):
-                G.add_edge(root_company_node, company_node, nature_of_control=data.get('nature_of_control', []))
-                logging.info(f'Connected root {root_company_node} to controller {company_node}')
-            else:
-                # For other nodes, connect to previous node to maintain chain structure
-                if idx > 0:
-                    prev_node = entity_data[idx - 1]['company_name']
-                    if prev_node != company_node:  # Avoid self-loops
-                        G.add_edge(prev_node, company_node, nature_of_control=data.get('nature_of_control', []))
-                        logging.info(f'Connected {prev_node} to {company_node}')
-        
-    # Sets top company as blue        
+        if top_company_node is None and (data.get('kind') == 'root' or idx == 0):
+            top_company_node = company_node
+            logging.info(f'Root company identified: {company_node}')
+
+        yield ('node', company_node, {
+                'bipartite': 0,
+                'label': data['company_name'],
+                'number': data['company_id'],
+                'type': 'company',
+                'previous_names': data['previous_names'],
+                'link': data.get('link', ''),
+                'period_end': data.get('accounts', {}).get('last_accounts', {}).get('period_end_on', '')})
+        # Some of its controllers or details couldn't be fetched, see scraper.TreeProgress.incomplete
+        if data.get('incomplete'):
+            yield ('node', company_node, {'incomplete': True})
+
+        # Each entity is a significant controller of the company it names
+        controlled_node = data.get('controlled_company_name')
+        if controlled_node and controlled_node != company_node:  # Avoid self-loops
+            yield ('edge', company_node, controlled_node, {'nature_of_control': data.get('nature_of_control', [])})
+        elif not controlled_node and data.get('kind') != 'root' and idx > 0:
+            logging.warning(f"No controlled company for {company_node}, it won't be connected")
+
+    # Sets top company as blue
     if top_company_node:
-        G.nodes[top_company_node]['color'] = 'blue'
-    
-    logging.info(f'All nodes in create_interlock_network are {list(G.nodes())}')
-    logging.info(f'All edges in create_interlock_network are {list(G.edges())}')
+        yield ('node', top_company_node, {'color': 'blue'})
+
+def create_interlock_network(entity_data):
+    """
+    Creates a directed network of the ownership relationships between companies and entities,
+    in a single pass over the entity data.
+
+    Inputs:
+        entity_data: A list of dictionaries containing company and entity information.
+
+    Outputs:
+        G: A NetworkX DiGraph with an edge from each controller to the company it controls.
+    """
+    G = nx.DiGraph()
+
+    for item in iter_interlock_network(entity_data):
+        if item[0] == 'node':
+            G.add_node(item[1], **item[2])
+        else:
+            G.add_edge(item[1], item[2], **item[3])
+
+    logging.info(f'Created network of {G.number_of_nodes()} nodes and {G.number_of_edges()} edges')
     return G
 
 # Create the elements to fill the graph
+def cytoscape_node(node, attributes, search_company_normalised):
+    """
+    Converts a network node into a Cytoscape node element.
+
+    Inputs:
+        node: The node's name, used as its ID.
+        attributes: The node's attributes, as set by iter_interlock_network.
+        search_company_normalised: The normalised name of the searched company, highlighted in the graph.
+
+    Outputs:
+        dict: The Cytoscape element.
+    """
+    node_data = {
+        'data': {'id': node, 'label': attributes.get('label', node), 'number': attributes.get('number', ''), 'link': attributes.get('link', ''),
+                 'period_end' : attributes.get('period_end', ''), 'previous_names' : attributes.get('previous_names','')}
+    }
+    # Set company/entity
+    node_classes = ['company' if attributes.get('type') == 'company' else 'entity']
+    # Normalise the node info
+    node_label_normalised = normalise_company_name(attributes.get('label', node))
+    # If the node matches the search, its the search
+    if node_label_normalised == search_company_normalised:
+        node_classes.append('search-company')
+    if attributes.get('incomplete'):
+        node_classes.append('incomplete')
+    node_data['classes'] = ' '.join(node_classes)
+    return node_data
+
+def cytoscape_edge(source, target, attributes):
+    """
+    Converts a controller -> controlled network edge into a Cytoscape edge element.
+
+    Outputs:
+        dict: The Cytoscape element.
+    """
+    # Get the nature of control info
+    nature_of_control_list = attributes.get('nature_of_control', [])
+    # Its always a list so split it out
+    edge_classes = ' '.join([noc.replace(' ', '-') for noc in nature_of_control_list])
+    # Add in the data to the edge
+    return {
+        'data': {
+            'source': source,
+            'target': target,
+            'nature_of_control': ', '.join(nature_of_control_list)
+        },
+        'classes': edge_classes
+    }
+
 def create_cytoscape_elements(graph, search_company):
     """
     Converts a NetworkX graph into Cytoscape elements for visualization, highlighting the search company.
@@ -158,41 +208,46 @@ def create_cytoscape_elements(graph, search_company):
     # NODES
     logging.info(f"All nodes: {graph.nodes()}")
     for node in graph.nodes():
-        # Get the data for the node
-        node_data = {
-            'data': {'id': node, 'label': graph.nodes[node].get('label', node), 'number': graph.nodes[node].get('number', ''), 'link': graph.nodes[node].get('link', ''),
-                     'period_end' : graph.nodes[node].get('period_end', ''), 'previous_names' : graph.nodes[node].get('previous_names','')}
-        }
-        # Set company/entity
-        node_classes = ['company' if graph.nodes[node].get('type') == 'company' else 'entity']
-        # Normalise the node info
-        node_label_normalised = normalise_company_name(graph.nodes[node].get('label', node))
-        # If the node matches the search, its the search
-        if node_label_normalised == search_company_normalised:
-            node_classes.append('search-company')
-        node_data['classes'] = ' '.join(node_classes)
-        elements.append(node_data)
-
+        elements.append(cytoscape_node(node, graph.nodes[node], search_company_normalised))
 
-    
     # EDGES
     for edge in graph.edges(data=True):
-        # Get the nature of control info
-        nature_of_control_list = edge[2].get('nature_of_control', [])
-        # Its always a list so split it out
-        edge_classes = ' '.join([noc.replace(' ', '-') for noc in nature_of_control_list])
-        # Add in the data to the edge
-        edge_data = {
-            'data': {
-                'source': edge[0],
-                'target': edge[1],
-                'nature_of_control': ', '.join(nature_of_control_list)
-            },
-            'classes': edge_classes
-        }
-        elements.append(edge_data)
+        elements.append(cytoscape_edge(*edge))
     return elements
 
+def iter_cytoscape_elements(entity_data, search_company):
+    """
+    Converts entities into Cytoscape elements one entity at a time, for drawing a tree while it is
+    still being discovered. Each node and edge is yielded once, when first seen, so the elements for
+    a longer list of entities always start with the elements for any prefix of it.
+
+    Inputs:
+        entity_data: Entities in the order discovered, e.g. scraper.TreeProgress.entities.
+        search_company: The name of the company to highlight in the graph.
+
+    Outputs:
+        Cytoscape elements, each node before any edge that uses it.
+    """
+    search_company_normalised = normalise_company_name(search_company)
+    seen_nodes, seen_edges = set(), set()
+
+    for item in iter_interlock_network(entity_data):
+        if item[0] == 'node':
+            _, node, attributes = item
+            if node not in seen_nodes and 'label' in attributes:
+                seen_nodes.add(node)
+                yield cytoscape_node(node, attributes, search_company_normalised)
+        else:
+            _, source, target, attributes = item
+            if (source, target) in seen_edges:
+                continue
+            if target not in seen_nodes:
+                # The controlled company hasn't been reported yet, draw it until it is
+                seen_nodes.add(target)
+                yield cytoscape_node(target, {'label': target, 'type': 'company'}, search_company_normalised)
+            seen_edges.add((source, target))
+            yield cytoscape_edge(source, target, attributes)
+
 def process_network_data(company_name, scraper_function, cache):
     """
     Processes the network data for a given company, utilizing a cache for efficiency.
@@ -207,7 +262,7 @@ def process_network_data(company_name, scraper_function, cache):
     """
 
     # Simple cache
-    if company_name in cache:
+    if cache and company_name in cache:
         logging.info(f"Cache hit for company: {company_name}")
         return cache[company_name]
         
@@ -247,20 +302,20 @@ def calculate_network_metrics(graph):
     
     return metrics
 
-def fetch_document_records(company_name, cache, company_number):
+def fetch_document_records(company_name, cache=None, company_number=None):
     """
     Fetches the filing history of a company, either from the cache or by calling an external scraper.
 
     Inputs:
         company_name: The name of the company to fetch the filing history for.
-        cache: A dictionary storing previously fetched filing history data.
+        cache: Optional dictionary of company name to entity list, whose root's filing history is used if present.
         company_number: The unique identifier of the company for external scraping.
 
     Outputs:
         dict: A dictionary containing filing history with 'items' key, or empty dict if not found.
     """
     # Check cache - cache stores company tree data, which includes filing_history
-    if company_name in cache:
+    if cache and company_name in cache:
         logging.info(f"Cache hit for {company_name}")
         cached_data = cache[company_name]
         # Cache stores list of entity dicts, first one is usually the root company
@@ -281,7 +336,8 @@ def fetch_document_records(company_name, cache, company_number):
     logging.info(f"No cache hit for {company_name} when fetching records")
     logging.info(f"Searching filing history for number {company_number}")
     try:
-        filing_history = get_filing_history(company_number)
+        # Shares the details cache with the node details, so a tapped node is only fetched once
+        _, filing_history = get_company_details(company_number, company_name)
         return filing_history if filing_history else {}
     except Exception as e:
         logging.error(f"Error fetching filing history for {company_number}: {e}")